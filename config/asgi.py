@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+# the hot task endpoints have native async views, use them when served by ASGI
+os.environ.setdefault('ASYNC_TASK_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -0,0 +1,17 @@
+from django.conf import settings
+
+
+# backends that only live in the process using them
+LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def cache_is_shared(alias='default'):
+    """
+    True when every web and Celery process sees the same cache (redis in
+    the deployment). The list cache stats, the cached JWT users, /metrics
+    and the Celery task run log need it.
+    """
+    return settings.CACHES[alias]['BACKEND'] not in LOCAL_CACHE_BACKENDS
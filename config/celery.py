@@ -6,6 +6,13 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 app = Celery('TaskTracker')
 
 app.config_from_object('django.conf:settings', namespace='CELERY')
+# the Django fixup of celery manages the worker's database connections: the
+# ones inherited from the parent are dropped without closing their sockets,
+# and close_if_unusable_or_obsolete runs around every task (CONN_MAX_AGE,
+# health checks, the pool)
 
 app.autodiscover_tasks()
 
+# queue wait, run time, retries and output of every task, on /metrics
+from . import task_metrics  # noqa: E402,F401
+
@@ -0,0 +1,185 @@
+"""
+Prometheus style metrics kept in the shared cache, so every web and Celery
+worker process adds to the same series. That needs redis as the cache (see
+CACHE_REDIS_URL), /metrics refuses to serve from a per-process cache.
+
+Observations are buffered per process and added to the cache with incr at
+most every METRICS_FLUSH_INTERVAL seconds, a request never waits on more
+than one flush. Histogram buckets are stored non cumulative and summed when
+rendered, sums are stored as integers in millionths.
+"""
+import atexit
+import bisect
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_PREFIX = 'metrics'
+METRICS_SERIES_KEY = f'{METRICS_PREFIX}:series'
+METRIC_SUM_SCALE = 1_000_000
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+REGISTRY = {}
+
+_pending = {}
+_series = set()
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _labels_key(labels):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _add(name, labels_key, deltas):
+    with _lock:
+        _series.add(f'{name}|{labels_key}')
+        for suffix, delta in deltas:
+            key = f'{METRICS_PREFIX}:{name}:{labels_key}:{suffix}'
+            _pending[key] = _pending.get(key, 0) + delta
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        REGISTRY[name] = self
+
+    def observe(self, value, **labels):
+        bucket = bisect.bisect_left(self.buckets, value)
+        _add(self.name, _labels_key(labels), [(bucket, 1), ('sum', round(value * METRIC_SUM_SCALE))])
+
+    def samples(self, labels_key, values):
+        counts = [values.get(self._key(labels_key, index), 0) for index in range(len(self.buckets) + 1)]
+        selector = f'{labels_key},' if labels_key else ''
+        total = 0
+        for bound, count in zip([*self.buckets, '+Inf'], counts):
+            total += count
+            yield f'{self.name}_bucket{{{selector}le="{bound}"}} {total}'
+        braces = f'{{{labels_key}}}' if labels_key else ''
+        yield f'{self.name}_sum{braces} {values.get(self._key(labels_key, "sum"), 0) / METRIC_SUM_SCALE}'
+        yield f'{self.name}_count{braces} {total}'
+
+    def keys(self, labels_key):
+        return [self._key(labels_key, index) for index in range(len(self.buckets) + 1)] + [self._key(labels_key, 'sum')]
+
+    def _key(self, labels_key, suffix):
+        return f'{METRICS_PREFIX}:{self.name}:{labels_key}:{suffix}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        REGISTRY[name] = self
+
+    def inc(self, amount=1, **labels):
+        if amount:
+            _add(self.name, _labels_key(labels), [('total', amount)])
+
+    def samples(self, labels_key, values):
+        braces = f'{{{labels_key}}}' if labels_key else ''
+        yield f'{self.name}{braces} {values.get(self._key(labels_key), 0)}'
+
+    def keys(self, labels_key):
+        return [self._key(labels_key)]
+
+    def _key(self, labels_key):
+        return f'{METRICS_PREFIX}:{self.name}:{labels_key}:total'
+
+
+def _incr(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # first use of the key, unless another process just created it
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def flush_due():
+    return time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL
+
+
+def flush_metrics(force=False):
+    """
+    Add this process's buffered observations to the cache, at most every
+    METRICS_FLUSH_INTERVAL seconds unless forced
+    """
+    global _last_flush
+    if not force and not flush_due():
+        return
+    now = time.monotonic()
+    with _lock:
+        pending = dict(_pending)
+        _pending.clear()
+        series = set(_series)
+        _last_flush = now
+    if not pending:
+        return
+    for key, delta in pending.items():
+        _incr(key, delta)
+    # the index is read-merge-written, a series lost to a race with another
+    # process comes back on the next flush
+    indexed = set(cache.get(METRICS_SERIES_KEY) or ())
+    if not series <= indexed:
+        cache.set(METRICS_SERIES_KEY, sorted(indexed | series), timeout=None)
+
+
+def render_metrics():
+    """
+    Every series in the Prometheus text format
+    """
+    flush_metrics(force=True)
+    by_metric = {}
+    for entry in cache.get(METRICS_SERIES_KEY) or ():
+        name, labels_key = entry.split('|', 1)
+        if name in REGISTRY:
+            by_metric.setdefault(name, []).append(labels_key)
+
+    lines = []
+    for name in sorted(REGISTRY):
+        metric = REGISTRY[name]
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        series = sorted(by_metric.get(name, ()))
+        values = cache.get_many([key for labels_key in series for key in metric.keys(labels_key)])
+        for labels_key in series:
+            lines.extend(metric.samples(labels_key, values))
+    return '\n'.join(lines) + '\n'
+
+
+def reset_metrics():
+    with _lock:
+        _pending.clear()
+        _series.clear()
+    keys = [METRICS_SERIES_KEY]
+    for entry in cache.get(METRICS_SERIES_KEY) or ():
+        name, labels_key = entry.split('|', 1)
+        if name in REGISTRY:
+            keys.extend(REGISTRY[name].keys(labels_key))
+    cache.delete_many(keys)
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush_metrics(force=True)
+    except Exception as e:
+        logger.warning("Could not flush the metrics on exit: %s", e)
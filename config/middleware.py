@@ -0,0 +1,198 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.utils.functional import SimpleLazyObject, empty
+from rest_framework.serializers import BaseSerializer
+
+from .metrics import Histogram, flush_due, flush_metrics
+
+
+logger = logging.getLogger(__name__)
+
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+REQUEST_SECONDS = Histogram('tasktracker_request_seconds', 'Whole request, middleware included.')
+REQUEST_VIEW_SECONDS = Histogram(
+    'tasktracker_request_view_seconds',
+    'Until the view returned its response: authentication, queries and serializers.',
+)
+REQUEST_RENDER_SECONDS = Histogram('tasktracker_request_render_seconds', 'Rendering the response, JSON encoding for the API.')
+REQUEST_SERIALIZER_SECONDS = Histogram(
+    'tasktracker_request_serializer_seconds',
+    'Building serializer.data, the queries of lazily loaded relations included.',
+)
+REQUEST_SQL_SECONDS = Histogram('tasktracker_request_sql_seconds', 'Time spent in SQL queries.')
+REQUEST_SQL_QUERIES = Histogram('tasktracker_request_sql_queries', 'SQL queries run by the request.', buckets=QUERY_COUNT_BUCKETS)
+
+# the timings of the request being handled, sync_to_async copies the context
+# so queries run from async views are counted too
+_current_timings = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('started', 'view_done', 'queries', 'sql_seconds', 'serializing', 'serializer_seconds', 'serializer_sql_seconds')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_done = None
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.serializing = False
+        self.serializer_seconds = 0.0
+        self.serializer_sql_seconds = 0.0
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.sql_seconds += time.perf_counter() - started
+
+
+def install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder)
+
+
+_serializer_data = BaseSerializer.data
+
+
+def _timed_serializer_data(self):
+    timings = _current_timings.get()
+    # only the outermost serializer, a nested one is part of its time
+    if timings is None or timings.serializing:
+        return _serializer_data.fget(self)
+    timings.serializing = True
+    started, sql_before = time.perf_counter(), timings.sql_seconds
+    try:
+        return _serializer_data.fget(self)
+    finally:
+        timings.serializing = False
+        timings.serializer_seconds += time.perf_counter() - started
+        timings.serializer_sql_seconds += timings.sql_seconds - sql_before
+
+
+# Serializer.data and ListSerializer.data both go through BaseSerializer.data
+BaseSerializer.data = property(_timed_serializer_data)
+
+
+def _route(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match and match.view_name else 'unmatched'
+
+
+def _is_staff(request):
+    user = getattr(request, 'user', None)
+    # don't load a session user just to check, the API user is set by DRF
+    if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+        return False
+    return bool(user.is_staff)
+
+
+class RequestMetricsMiddleware:
+    """
+    Per route name and method: request, view, serializer, render and SQL
+    time and the query count, as histograms on /metrics, and a Server-Timing header on
+    the responses to staff users.
+
+    The view time ends when the response comes back unrendered
+    (process_template_response), DRF responses are rendered after that.
+    The serializer time is part of the view time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # a sync hook would cost a thread hop on every async request
+            self.process_template_response = self.aprocess_template_response
+        # connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        self.finish(request, response, timings)
+        self.flush()
+        return response
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current_timings.set(timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_timings.reset(token)
+        self.finish(request, response, timings)
+        if flush_due():
+            await sync_to_async(self.flush)()
+        return response
+
+    def process_template_response(self, request, response):
+        self.view_done(request)
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        self.view_done(request)
+        return response
+
+    def view_done(self, request):
+        timings = _current_timings.get()
+        if timings is not None:
+            timings.view_done = time.perf_counter()
+
+    def finish(self, request, response, timings):
+        ended = time.perf_counter()
+        view_done = timings.view_done or ended
+        total = ended - timings.started
+        view = view_done - timings.started
+        render = ended - view_done
+
+        labels = {'route': _route(request), 'method': request.method}
+        REQUEST_SECONDS.observe(total, **labels)
+        REQUEST_VIEW_SECONDS.observe(view, **labels)
+        REQUEST_SERIALIZER_SECONDS.observe(timings.serializer_seconds, **labels)
+        REQUEST_RENDER_SECONDS.observe(render, **labels)
+        REQUEST_SQL_SECONDS.observe(timings.sql_seconds, **labels)
+        REQUEST_SQL_QUERIES.observe(timings.queries, **labels)
+
+        if _is_staff(request):
+            # the queries run while serializing count as db, not serializer
+            serializer = timings.serializer_seconds - timings.serializer_sql_seconds
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={timings.sql_seconds * 1000:.1f};desc="{timings.queries} queries"',
+                f'serializer;dur={serializer * 1000:.1f};desc="serializer.data without SQL"',
+                f'app;dur={max(view - timings.sql_seconds - serializer, 0) * 1000:.1f};desc="view without SQL and serializers"',
+                f'view;dur={view * 1000:.1f}',
+                f'render;dur={render * 1000:.1f}',
+                f'total;dur={total * 1000:.1f}',
+            ])
+
+    def flush(self):
+        try:
+            flush_metrics()
+        except Exception as e:
+            # metrics are never worth failing a request
+            logger.warning("Could not flush the request metrics: %s", e)
@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from datetime import timedelta
 from pathlib import Path
+from urllib.parse import urlsplit
 from celery.schedules import crontab
 from decouple import config
 import os
@@ -53,7 +54,7 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ],
     
     'DEFAULT_PERMISSION_CLASSES': [
@@ -75,6 +76,8 @@ SPECTACULAR_SETTINGS = {
 
 
 MIDDLEWARE = [
+    # first, so its timings cover the other middleware too
+    'config.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -114,8 +117,24 @@ if os.environ.get('POSTGRES_HOST') == 'db' :
             'PASSWORD': os.environ.get('POSTGRES_PASSWORD', 'secret'),
             'HOST': os.environ.get('POSTGRES_HOST', '127.0.0.1'),              
             'PORT': 5432,
+            # check a reused connection before the request uses it
+            'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
         }
     }
+    if config('DB_POOL', default=False, cast=bool):
+        # a psycopg 3 pool per process, connections go back to it after each
+        # request (Django wants CONN_MAX_AGE = 0 with a pool)
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+                'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+                'timeout': config('DB_POOL_TIMEOUT', default=10, cast=int),
+            },
+        }
+    else:
+        # keep each thread's connection open between requests, in seconds (0 closes it every time)
+        DATABASES['default']['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=60, cast=int)
 else:
     #for local development
     DATABASES = {
@@ -174,6 +193,59 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'users.User'
 
+# how many tag name -> id entries each process keeps in memory
+TAG_NAME_CACHE_SIZE = config('TAG_NAME_CACHE_SIZE', default=1024, cast=int)
+
+# shared cache (redis in production, per-process memory in dev). Without
+# CACHE_REDIS_URL it goes to database 1 of the Celery broker when one is
+# configured, redis is there anyway.
+_broker_url = urlsplit(os.environ.get('CELERY_BROKER_URL', ''))
+CACHE_REDIS_URL = config(
+    'CACHE_REDIS_URL',
+    default=_broker_url._replace(path='/1').geturl() if _broker_url.scheme in ('redis', 'rediss') else '',
+)
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+            'KEY_PREFIX': 'tasktracker',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# seconds a cached task list page is kept, writes make it unreachable anyway
+TASK_LIST_CACHE_TIMEOUT = config('TASK_LIST_CACHE_TIMEOUT', default=300, cast=int)
+
+# serve the task list/detail, statistics and export with native async views
+# (on by default under ASGI, see config/asgi.py)
+ASYNC_TASK_VIEWS = config('ASYNC_TASK_VIEWS', default=False, cast=bool)
+
+# days the tombstones of deleted tasks are kept for delta sync, older sync
+# tokens get a full resync
+TASK_TOMBSTONE_RETENTION_DAYS = config('TASK_TOMBSTONE_RETENTION_DAYS', default=30, cast=int)
+
+# seconds an authenticated user stays cached between JWT requests
+AUTH_USER_CACHE_TIMEOUT = config('AUTH_USER_CACHE_TIMEOUT', default=60, cast=int)
+
+# threads hashing passwords in an import job started from the admin API
+USER_IMPORT_HASH_THREADS = config('USER_IMPORT_HASH_THREADS', default=4, cast=int)
+# uploaded import files wait here for the worker, they hold plaintext
+# passwords so they stay out of MEDIA_ROOT
+USER_IMPORT_UPLOAD_DIR = config('USER_IMPORT_UPLOAD_DIR', default=os.path.join(BASE_DIR, 'import_uploads'))
+# seconds after which an upload no job picked up is deleted
+USER_IMPORT_UPLOAD_MAX_AGE = config('USER_IMPORT_UPLOAD_MAX_AGE', default=24 * 3600, cast=int)
+
+# seconds a process buffers its metrics before adding them to the shared cache
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=10, cast=float)
+# bearer token for scraping /metrics, staff users can read it with their JWT
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(days=2),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=10),
@@ -201,6 +273,20 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'tasks.tasks.send_daily_reminders',
         'schedule': crontab(hour=10, minute=59),
     },
+    # safety net for outbox rows whose on-commit enqueue was lost
+    'drain_task_notifications': {
+        'task': 'tasks.tasks.send_task_notifications',
+        'schedule': crontab(minute='*'),
+    },
+    'prune_task_tombstones': {
+        'task': 'tasks.tasks.prune_task_tombstones',
+        'schedule': crontab(hour=3, minute=15),
+    },
+    # import uploads whose job never ran
+    'purge_stale_import_uploads': {
+        'task': 'users.tasks.purge_stale_import_uploads',
+        'schedule': crontab(minute=30),
+    },
 }
 
 
@@ -0,0 +1,141 @@
+"""
+Celery task telemetry on the /metrics surface of the web tier: queue wait
+(publish to start), run time, retries, and the rows and emails a task
+reports with record_task_output. Every finished run also goes into a ring
+buffer in the cache for `manage.py celery_task_runs`. Both need a cache
+shared with the workers (redis, see CACHE_REDIS_URL).
+"""
+import logging
+import time
+from datetime import datetime
+
+from celery import current_task
+from celery.signals import before_task_publish, task_postrun, task_prerun, task_retry, worker_process_shutdown
+from django.core.cache import cache
+
+from .metrics import METRICS_PREFIX, Counter, Histogram, flush_metrics
+
+
+logger = logging.getLogger(__name__)
+
+TASK_DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+TASK_RUN_LOG_SIZE = 1000
+TASK_RUN_LOG_KEY = f'{METRICS_PREFIX}:celery:runs'
+
+TASK_QUEUE_WAIT_SECONDS = Histogram(
+    'tasktracker_celery_queue_wait_seconds', 'From publish (or ETA) to a worker starting the task.', TASK_DURATION_BUCKETS,
+)
+TASK_RUN_SECONDS = Histogram('tasktracker_celery_run_seconds', 'Task run time by final state.', TASK_DURATION_BUCKETS)
+TASK_RETRIES = Counter('tasktracker_celery_retries_total', 'Retries scheduled by tasks.')
+TASK_ROWS = Counter('tasktracker_celery_rows_total', 'Rows processed, as reported by the task.')
+TASK_EMAILS = Counter('tasktracker_celery_emails_total', 'Emails sent, as reported by the task.')
+
+# runs in progress in this process, by task id
+_runs = {}
+
+
+def record_task_output(rows=0, emails=0):
+    """
+    Add to the rows processed / emails sent of the running task, a no-op
+    when called outside a task (or on a task called directly as a function)
+    """
+    task = current_task
+    run = _runs.get(getattr(task.request, 'id', None)) if task else None
+    if run is not None:
+        run['rows'] += rows
+        run['emails'] += emails
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    if headers is not None:
+        headers['enqueued_at'] = time.time()
+
+
+def _queue_wait(request, started_at):
+    enqueued_at = getattr(request, 'enqueued_at', None) or (getattr(request, 'headers', None) or {}).get('enqueued_at')
+    if enqueued_at is None:
+        return None
+    if request.eta:
+        # a countdown isn't waiting in the queue
+        eta = datetime.fromisoformat(request.eta).timestamp() if isinstance(request.eta, str) else request.eta.timestamp()
+        enqueued_at = max(enqueued_at, eta)
+    return max(started_at - enqueued_at, 0.0)
+
+
+@task_prerun.connect
+def start_task_run(task_id=None, task=None, **kwargs):
+    if task is None:
+        return
+    _runs[task_id] = {
+        'started': time.perf_counter(),
+        'queue_wait': None if task.request.is_eager else _queue_wait(task.request, time.time()),
+        'rows': 0,
+        'emails': 0,
+    }
+
+
+@task_retry.connect
+def count_task_retry(sender=None, **kwargs):
+    if sender is not None:
+        TASK_RETRIES.inc(task=sender.name)
+
+
+@task_postrun.connect
+def finish_task_run(task_id=None, task=None, state=None, **kwargs):
+    run = _runs.pop(task_id, None)
+    if run is None or task is None:
+        return
+    runtime = time.perf_counter() - run['started']
+    if run['queue_wait'] is not None:
+        TASK_QUEUE_WAIT_SECONDS.observe(run['queue_wait'], task=task.name)
+    TASK_RUN_SECONDS.observe(runtime, task=task.name, state=state or 'UNKNOWN')
+    TASK_ROWS.inc(run['rows'], task=task.name)
+    TASK_EMAILS.inc(run['emails'], task=task.name)
+    entry = {
+        'task': task.name,
+        'id': task_id,
+        'state': state,
+        'queue_wait': None if run['queue_wait'] is None else round(run['queue_wait'], 4),
+        'runtime': round(runtime, 4),
+        'retries': task.request.retries or 0,
+        'rows': run['rows'],
+        'emails': run['emails'],
+        'finished_at': time.time(),
+    }
+    try:
+        log_task_run(entry)
+        flush_metrics()
+    except Exception as e:
+        logger.warning("Could not record the run of %s: %s", task.name, e)
+
+
+@worker_process_shutdown.connect
+def flush_task_metrics(**kwargs):
+    flush_metrics(force=True)
+
+
+def log_task_run(entry):
+    """
+    write the run into the next ring buffer slot, the counter makes every
+    worker take its own slot
+    """
+    counter = f'{TASK_RUN_LOG_KEY}:next'
+    try:
+        position = cache.incr(counter)
+    except ValueError:
+        position = 1 if cache.add(counter, 1, timeout=None) else cache.incr(counter)
+    cache.set(f'{TASK_RUN_LOG_KEY}:{position % TASK_RUN_LOG_SIZE}', entry, timeout=None)
+
+
+def recent_task_runs(last=20):
+    """
+    the last finished runs, newest first
+    """
+    position = cache.get(f'{TASK_RUN_LOG_KEY}:next') or 0
+    keys = [
+        f'{TASK_RUN_LOG_KEY}:{p % TASK_RUN_LOG_SIZE}'
+        for p in range(position, max(position - min(last, TASK_RUN_LOG_SIZE), 0), -1)
+    ]
+    entries = cache.get_many(keys)
+    return [entries[key] for key in keys if key in entries]
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import BasePermission
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
+
+from .cache import cache_is_shared
+from .metrics import render_metrics
+
+
+METRICS_TOKEN_AUTH = 'metrics-token'
+
+
+class MetricsTokenAuthentication(BaseAuthentication):
+    """
+    `Authorization: Bearer <METRICS_TOKEN>` for the Prometheus scraper,
+    any other header goes on to the JWT authentication
+    """
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        if not settings.METRICS_TOKEN or len(header) != 2 or header[0].lower() != b'bearer':
+            return None
+        if not constant_time_compare(header[1], settings.METRICS_TOKEN.encode()):
+            return None
+        return AnonymousUser(), METRICS_TOKEN_AUTH
+
+    def authenticate_header(self, request):
+        return 'Bearer realm="metrics"'
+
+
+class CanReadMetrics(BasePermission):
+    def has_permission(self, request, view):
+        return request.auth == METRICS_TOKEN_AUTH or bool(request.user and request.user.is_staff)
+
+
+class MetricsView(APIView):
+    """
+    The request and Celery metrics of every worker, in the Prometheus text
+    format. Refused with a 503 on a per-process cache: it would only show
+    the share of the worker that happens to answer.
+    """
+    authentication_classes = [MetricsTokenAuthentication, *api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    permission_classes = [CanReadMetrics]
+
+    def get(self, request):
+        if not cache_is_shared():
+            return HttpResponse(
+                "The metrics need a cache shared by every process, set CACHE_REDIS_URL\n",
+                status=503, content_type='text/plain; charset=utf-8',
+            )
+        return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,52 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.utils import timezone
+
+from .models import Task
+from .statistics import due_by_filter
+
+
+AGENDA_DAYS = 7
+AGENDA_MAX_DAYS = 31
+AGENDA_MAX_TASKS = 200
+
+
+def agenda_tasks(owner, until):
+    """
+    The owner's open tasks due on or before until, overdue ones first, in
+    the order of the (owner, due_date) partial index
+    """
+    return (
+        Task.objects.filter(due_by_filter(until), owner=owner)
+        .select_related('owner', 'category__owner')
+        .prefetch_related('tags')
+        .order_by('due_date', '-priority_rank', 'id')
+    )
+
+
+def build_agenda(owner, days=AGENDA_DAYS, serialize=list, today=None):
+    """
+    Group the open tasks due in the next days (today included) by due date,
+    with the overdue ones apart. At most AGENDA_MAX_TASKS tasks, has_more
+    tells the client there were more (the latest due dates are cut).
+    serialize turns a list of tasks into their representation.
+    """
+    today = today or timezone.localdate()
+    until = today + timedelta(days=days - 1)
+    tasks = list(agenda_tasks(owner, until)[:AGENDA_MAX_TASKS + 1])
+    has_more = len(tasks) > AGENDA_MAX_TASKS
+    tasks = tasks[:AGENDA_MAX_TASKS]
+
+    overdue = [task for task in tasks if task.due_date < today]
+    upcoming = tasks[len(overdue):]
+    return {
+        'today': today,
+        'until': until,
+        'overdue': serialize(overdue),
+        'days': [
+            {'date': due_date, 'tasks': serialize(list(group))}
+            for due_date, group in groupby(upcoming, key=lambda task: task.due_date)
+        ],
+        'has_more': has_more,
+    }
@@ -1,4 +1,5 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class TasksConfig(AppConfig):
@@ -6,4 +7,11 @@ class TasksConfig(AppConfig):
     name = 'tasks'
     
     def ready(self):
-        import tasks.signals
\ No newline at end of file
+        import tasks.signals
+        post_migrate.connect(restore_search_triggers, sender=self)
+
+
+def restore_search_triggers(sender, using, **kwargs):
+    from django.db import connections
+    from .search import ensure_sqlite_search_triggers
+    ensure_sqlite_search_triggers(connections[using])
\ No newline at end of file
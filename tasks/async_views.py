@@ -0,0 +1,203 @@
+"""
+Native async handlers for the hot read endpoints, mounted in front of the
+viewsets when ASYNC_TASK_VIEWS is on (the default under ASGI, see config/asgi.py).
+
+They reuse the viewset for the queryset, filters, validators, paginator and
+serializer, and only do the database and cache work through the async APIs, so a
+request doesn't hold a worker thread while it waits. Anything they don't
+handle natively (writes, the browsable API, cursor pagination) is handed to
+the sync viewset.
+"""
+from asgiref.sync import sync_to_async
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import exception_handler
+
+from .list_cache import aget_cached_page, aset_cached_page
+from .models import Task
+from .pagination import KeysetCursorPagination
+from .serializers import TaskSerializer
+from .statistics import aread_statistics
+from .tasks import export_tasks_to_csv
+from .versioning import add_validators, aget_data_version, not_modified_response
+from .views import ExpotrtTasksView, TaskViewSet
+
+
+sync_task_list = TaskViewSet.as_view({'get': 'list', 'post': 'create'})
+sync_task_detail = TaskViewSet.as_view({
+    'get': 'retrieve',
+    'put': 'update',
+    'patch': 'partial_update',
+    'delete': 'destroy',
+})
+sync_task_statistics = TaskViewSet.as_view({'get': 'statistics'})
+sync_export_tasks = ExpotrtTasksView.as_view()
+
+
+def _wants_json(request):
+    """
+    the async handlers only render JSON, the browsable API stays on the viewset
+    """
+    if request.GET.get(api_settings.URL_FORMAT_OVERRIDE) not in (None, 'json'):
+        return False
+    accept = request.headers.get('Accept', '*/*')
+    return 'text/html' not in accept
+
+
+def _render(response, request):
+    response.accepted_renderer = JSONRenderer()
+    response.accepted_media_type = 'application/json'
+    response.renderer_context = {'request': request, 'response': response}
+    response.render()
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def _error(exc, request):
+    response = exception_handler(exc, {'request': request})
+    if response is None:
+        raise exc
+    return _render(response, request)
+
+
+def _auth_error(exc, request):
+    # like APIView.handle_exception: 401 with the scheme of the first authenticator
+    response = _error(exc, request)
+    header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+    if header:
+        response.status_code = status.HTTP_401_UNAUTHORIZED
+        response['WWW-Authenticate'] = header
+    return response
+
+
+async def _authenticated_view(django_request, action, kwargs=None):
+    """
+    A TaskViewSet set up for the request the way dispatch would, or the error
+    response. Authentication may hit the user cache or the database.
+    """
+    request = Request(
+        django_request,
+        parsers=[JSONParser()],
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES],
+    )
+    try:
+        user = await sync_to_async(getattr)(request, 'user')
+    except exceptions.APIException as exc:
+        return None, _auth_error(exc, request)
+    if not (user and user.is_authenticated):
+        return None, _auth_error(exceptions.NotAuthenticated(), request)
+
+    request.accepted_renderer = JSONRenderer()
+    request.accepted_media_type = 'application/json'
+    view = TaskViewSet(action=action, request=request, args=(), kwargs=kwargs or {}, format_kwarg=None)
+    return view, None
+
+
+async def _conditional(view, request, render):
+    """
+    ConditionalGetMixin.conditional, with the version read through the async ORM
+    """
+    view._data_version = await aget_data_version(view.get_data_version_scope())
+    etag, last_modified = view.get_validators(request)
+    response = not_modified_response(request, etag, last_modified)
+    if response is None:
+        response = _render(await render(), request)
+    return add_validators(response, etag, last_modified)
+
+
+async def _paginated_tasks(view, request, queryset):
+    """
+    The viewset's page number pagination, counted and fetched through the async ORM
+    """
+    paginator = view.paginator
+    tasks = await paginator.apaginate_queryset(queryset, request, view=view)
+    return paginator.get_paginated_response(TaskSerializer(tasks, many=True, context=view.get_serializer_context()).data).data
+
+
+@csrf_exempt
+async def task_list(django_request):
+    if django_request.method != 'GET' or not _wants_json(django_request) \
+            or KeysetCursorPagination.is_requested(Request(django_request)):
+        return await sync_to_async(sync_task_list)(django_request)
+
+    view, error = await _authenticated_view(django_request, 'list')
+    if error:
+        return error
+    request = view.request
+
+    async def render():
+        key = view.get_list_cache_key(request)
+        data = await aget_cached_page(key)
+        if data is None:
+            # filterset validation may run a query, the rest only builds the queryset
+            queryset = await sync_to_async(view.filter_queryset)(view.get_queryset())
+            data = await _paginated_tasks(view, request, queryset)
+            await aset_cached_page(key, data)
+        return Response(data)
+
+    try:
+        return await _conditional(view, request, render)
+    except exceptions.APIException as exc:
+        return _error(exc, request)
+
+
+@csrf_exempt
+async def task_detail(django_request, pk):
+    if django_request.method != 'GET' or not _wants_json(django_request):
+        return await sync_to_async(sync_task_detail)(django_request, pk=pk)
+
+    view, error = await _authenticated_view(django_request, 'retrieve', {'pk': pk})
+    if error:
+        return error
+    request = view.request
+
+    async def render():
+        try:
+            task = await view.get_queryset().aget(pk=pk)
+        except Task.DoesNotExist:
+            raise exceptions.NotFound('No Task matches the given query.')
+        return Response(TaskSerializer(task, context=view.get_serializer_context()).data)
+
+    try:
+        return await _conditional(view, request, render)
+    except exceptions.APIException as exc:
+        return _error(exc, request)
+
+
+@csrf_exempt
+async def task_statistics(django_request):
+    if django_request.method != 'GET' or not _wants_json(django_request):
+        return await sync_to_async(sync_task_statistics)(django_request)
+
+    view, error = await _authenticated_view(django_request, 'statistics')
+    if error:
+        return error
+    return _render(Response(await aread_statistics(view.request.user)), view.request)
+
+
+@csrf_exempt
+async def export_tasks(django_request):
+    if django_request.method != 'POST' or not _wants_json(django_request) \
+            or django_request.content_type not in ('', 'application/json'):
+        return await sync_to_async(sync_export_tasks)(django_request)
+
+    view, error = await _authenticated_view(django_request, 'export')
+    if error:
+        return error
+    request, user = view.request, view.request.user
+    if not user.email:
+        return _render(Response({'error': 'Email is required to export tasks'}, status=status.HTTP_400_BAD_REQUEST), request)
+    try:
+        data = request.data if isinstance(request.data, dict) else {}
+    except exceptions.ParseError as exc:
+        return _error(exc, request)
+    compress = str(data.get('compress', '')).lower() in ('1', 'true', 'yes')
+    # talks to the broker
+    await sync_to_async(export_tasks_to_csv.delay)(user.id, compress=compress)
+    return _render(Response({'message': 'Tasks exported successfully'}, status=status.HTTP_200_OK), request)
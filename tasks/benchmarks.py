@@ -0,0 +1,248 @@
+"""
+Endpoint benchmark suite, driven by `manage.py benchmark_endpoints`.
+
+seed_dataset bulk inserts a synthetic dataset (users x tasks x tags x
+categories), run_scenarios times the hot paths against it through the full
+request stack (or the Celery task bodies for export and reminders) and
+records p50/p95 latency, queries per request and peak traced memory.
+The results are saved as a JSON baseline that later runs are compared to.
+"""
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+
+from django.core import mail
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from users.models import Profile, User
+from .models import Category, Tag, Task
+from .statistics import rebuild_counters
+from .tasks import export_tasks_to_csv, reminder_owner_ranges, send_reminder_digests
+
+
+BENCHMARK_PHONE_PREFIX = '06'
+BENCHMARK_BATCH_SIZE = 5000
+BENCHMARK_WORDS = [
+    'report', 'meeting', 'invoice', 'review', 'deploy', 'design', 'email',
+    'budget', 'plan', 'fix', 'client', 'release', 'backup', 'audit', 'draft',
+]
+
+# a run is only a regression past both the relative tolerance and these
+# absolute floors, sub-millisecond jitter isn't worth failing a build over
+BENCHMARK_MIN_DELTA_MS = 0.5
+BENCHMARK_MIN_DELTA_KB = 64
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(BENCHMARK_WORDS) for _ in range(words))
+
+
+def seed_dataset(users=20, tasks_per_user=500, tags=50, categories=5, tags_per_task=2, seed=0):
+    """
+    Bulk insert the dataset, returns the users. No Task signals fire, the
+    statistics counters are rebuilt once at the end. benchmark_task_queries
+    seeds its tables with it too.
+    """
+    rng = random.Random(seed)
+    User.objects.bulk_create(
+        (
+            User(phone_number=f'{BENCHMARK_PHONE_PREFIX}{i:09d}', email=f'bench{i}@example.com', password='!')
+            for i in range(users)
+        ),
+        ignore_conflicts=True,
+    )
+    owners = list(User.objects.filter(phone_number__startswith=BENCHMARK_PHONE_PREFIX).order_by('id')[:users])
+    # bulk_create skips the signal that makes profiles
+    Profile.objects.bulk_create((Profile(user=owner) for owner in owners), ignore_conflicts=True)
+
+    Tag.objects.bulk_create((Tag(name=f'bench-{i}') for i in range(tags)), ignore_conflicts=True)
+    tag_ids = list(Tag.objects.filter(name__startswith='bench-').values_list('id', flat=True))
+
+    Category.objects.bulk_create(
+        Category(owner=owner, name=f'category {i}') for owner in owners for i in range(categories)
+    )
+    category_ids = {}
+    for owner_id, category_id in Category.objects.filter(owner__in=owners).values_list('owner_id', 'id'):
+        category_ids.setdefault(owner_id, []).append(category_id)
+
+    today = timezone.localdate()
+    statuses = [key for key, _ in Task.choice_status]
+    priorities = [key for key, _ in Task.choice_priority]
+    batch = []
+    for owner in owners:
+        for i in range(tasks_per_user):
+            batch.append(Task(
+                owner=owner,
+                category_id=rng.choice(category_ids[owner.pk]) if category_ids.get(owner.pk) and rng.random() < 0.8 else None,
+                title=f'{_sentence(rng, 2)} {i}',
+                description=_sentence(rng, 8),
+                status=rng.choice(statuses),
+                priority=rng.choice(priorities),
+                due_date=today + timedelta(days=rng.randint(-30, 30)) if rng.random() < 0.7 else None,
+            ))
+            if len(batch) >= BENCHMARK_BATCH_SIZE:
+                _insert_tasks(batch, tag_ids, tags_per_task, rng)
+                batch = []
+    _insert_tasks(batch, tag_ids, tags_per_task, rng)
+
+    rebuild_counters()
+    return owners
+
+
+def _insert_tasks(tasks, tag_ids, tags_per_task, rng):
+    Task.objects.bulk_create(tasks)
+    if not tag_ids or not tags_per_task:
+        return
+    Task.tags.through.objects.bulk_create(
+        Task.tags.through(task_id=task.pk, tag_id=tag_id)
+        for task in tasks
+        for tag_id in rng.sample(tag_ids, min(tags_per_task, len(tag_ids)))
+    )
+
+
+class Scenarios:
+    """
+    The benchmarked paths, one method per scenario. The list requests carry
+    a throwaway parameter so every one misses the list cache and measures
+    the query and serializer work.
+    """
+    names = ['list', 'search', 'ordering', 'statistics', 'create', 'export', 'reminders']
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.client = APIClient(HTTP_HOST='localhost')
+        self.client.force_authenticate(user=owner)
+
+    def request(self, method, path, data=None, **kwargs):
+        response = getattr(self.client, method)(path, data, **kwargs)
+        if response.status_code >= 400:
+            raise BenchmarkError(f"{method.upper()} {path} returned {response.status_code}")
+        return response
+
+    def list(self, i):
+        self.request('get', '/api/tasks/', {'bench': i})
+
+    def search(self, i):
+        self.request('get', '/api/tasks/', {'search': BENCHMARK_WORDS[i % len(BENCHMARK_WORDS)], 'bench': i})
+
+    def ordering(self, i):
+        self.request('get', '/api/tasks/', {'ordering': '-priority', 'bench': i})
+
+    def statistics(self, i):
+        self.request('get', '/api/tasks/statistics/')
+
+    def create(self, i):
+        self.request('post', '/api/tasks/', {
+            'title': f'benchmark {i}',
+            'description': 'created by the benchmark',
+            'priority': 'high',
+            'tags': ['bench-0', 'bench-1'],
+        }, format='json')
+
+    def export(self, i):
+        export_tasks_to_csv(self.owner.pk)
+        mail.outbox = []
+
+    def reminders(self, i):
+        # the work the reminder fan out does, without the broker
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        for first, last in reminder_owner_ranges(tomorrow):
+            send_reminder_digests(tomorrow.isoformat(), first, last)
+        mail.outbox = []
+
+
+def _percentile(runs, n):
+    return statistics.quantiles(runs, n=n)[-1] if len(runs) > 1 else runs[0]
+
+
+def measure(func, iterations=20, warmup=2):
+    """
+    p50/p95 of func(i) in ms, then one more call counting its queries and
+    tracing its peak memory
+    """
+    for i in range(warmup):
+        func(i)
+    runs = []
+    for i in range(warmup, warmup + iterations):
+        started = time.perf_counter()
+        func(i)
+        runs.append((time.perf_counter() - started) * 1000)
+
+    tracemalloc.start()
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            func(warmup + iterations)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'p50_ms': round(statistics.median(runs), 3),
+        'p95_ms': round(_percentile(runs, 20), 3),
+        'queries': len(queries),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def run_scenarios(owner, names=None, iterations=20, warmup=2):
+    scenarios = Scenarios(owner)
+    results = {}
+    for name in names or Scenarios.names:
+        if name not in Scenarios.names:
+            raise BenchmarkError(f"unknown scenario {name!r}, pick from {', '.join(Scenarios.names)}")
+        results[name] = measure(getattr(scenarios, name), iterations, warmup)
+    return results
+
+
+def describe_run(dataset, iterations):
+    return {
+        'dataset': dataset,
+        'iterations': iterations,
+        'database': connection.vendor,
+        'python': platform.python_version(),
+        'created_at': timezone.now().isoformat(),
+    }
+
+
+def write_baseline(path, meta, results):
+    with open(path, 'w') as f:
+        json.dump({'meta': meta, 'results': results}, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path):
+    with open(path) as f:
+        baseline = json.load(f)
+    if 'results' not in baseline:
+        raise BenchmarkError(f"{path} is not a benchmark baseline")
+    return baseline
+
+
+def compare_results(current, baseline, tolerance=0.2):
+    """
+    Regressions of current against the baseline results, as
+    (scenario, metric, baseline value, current value). Query counts are
+    deterministic and compared exactly, times and memory with the tolerance.
+    """
+    floors = {'p50_ms': BENCHMARK_MIN_DELTA_MS, 'p95_ms': BENCHMARK_MIN_DELTA_MS, 'peak_kb': BENCHMARK_MIN_DELTA_KB}
+    regressions = []
+    for name, metrics in current.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if metrics['queries'] > before['queries']:
+            regressions.append((name, 'queries', before['queries'], metrics['queries']))
+        for metric, floor in floors.items():
+            old, new = before[metric], metrics[metric]
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append((name, metric, old, new))
+    return regressions
@@ -0,0 +1,192 @@
+from collections import Counter
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Category, Task, TaskTombstone
+from .signals import BATCH_EMAIL_MAX_TITLES, queue_batch_email, task_signals_muted
+from .statistics import BUCKET_FIELDS, apply_counter_deltas, task_bucket, touch_categories
+from .tag_cache import resolve_tags
+from .sync import next_change_seq
+
+
+BULK_MAX_ITEMS = 500
+# ids per UPDATE of a transition, under the bound parameter limit of every backend
+BULK_UPDATE_BATCH_SIZE = 900
+
+TaskTag = Task.tags.through
+
+
+def bulk_id_errors(ids):
+    """
+    Errors per position of a list of task ids, {} for a valid one: ids are
+    positive integers (not booleans) and each task appears once
+    """
+    errors, seen = [], set()
+    for pk in ids:
+        if isinstance(pk, bool) or not isinstance(pk, int) or pk < 1:
+            errors.append({'id': ['A valid task id is required.']})
+        elif pk in seen:
+            errors.append({'id': ['Duplicate id, a task can appear once per request.']})
+        else:
+            seen.add(pk)
+            errors.append({})
+    return errors
+
+
+def bulk_serializer_context(owner, context):
+    """
+    Serializer context for validating a bulk payload without per-item queries:
+    category ids are checked against the user's categories loaded once here
+    (tag names are resolved later for the whole batch).
+    """
+    categories = Category.objects.filter(owner=owner).select_related('owner')
+    return {
+        **context,
+        'categories': {category.pk: category for category in categories},
+    }
+
+
+def _resolve_tag_ids(items):
+    names = [name for item in items for name in item.get('tags') or []]
+    return {tag.name: tag.pk for tag in resolve_tags(names)} if names else {}
+
+
+def _replace_tags(tag_names_by_task, tag_ids, clear_existing):
+    if clear_existing and tag_names_by_task:
+        TaskTag.objects.filter(task_id__in=list(tag_names_by_task)).delete()
+    TaskTag.objects.bulk_create(
+        [
+            TaskTag(task_id=task_id, tag_id=tag_ids[name])
+            for task_id, names in tag_names_by_task.items()
+            for name in names
+        ],
+        ignore_conflicts=True,
+    )
+
+
+@transaction.atomic
+def bulk_create_tasks(owner, items):
+    """
+    Create tasks from validated serializer data in one INSERT, with their
+    tags, counters and a single batch notification.
+    """
+    tag_ids = _resolve_tag_ids(items)
+    seq = next_change_seq(owner.pk)
+    tasks, tag_names = [], []
+    for item in items:
+        item = dict(item)
+        tag_names.append(item.pop('tags', None) or [])
+        tasks.append(Task(owner=owner, change_seq=seq, **item))
+
+    Task.objects.bulk_create(tasks)
+    _replace_tags(
+        {task.pk: names for task, names in zip(tasks, tag_names) if names},
+        tag_ids,
+        clear_existing=False,
+    )
+    apply_counter_deltas(Counter(task_bucket(task) for task in tasks))
+    touch_categories({task.category_id for task in tasks})
+    queue_batch_email(owner.pk, 'created', [task.title for task in tasks])
+    return tasks
+
+
+@transaction.atomic
+def bulk_update_tasks(owner, tasks, items):
+    """
+    Apply validated partial updates to already loaded tasks with one
+    bulk UPDATE, replacing tags only for the items that sent them.
+    """
+    tag_ids = _resolve_tag_ids(items)
+    seq = next_change_seq(owner.pk)
+    deltas = Counter()
+    fields = {'updated_at', 'change_seq'}
+    tag_names = {}
+    categories = set()
+    now = timezone.now()
+    for task, item in zip(tasks, items):
+        item = dict(item)
+        old_bucket = task_bucket(task)
+        categories.add(task.category_id)
+        names = item.pop('tags', None)
+        if names is not None:
+            tag_names[task.pk] = names
+        for attr, value in item.items():
+            setattr(task, attr, value)
+        fields.update(item)
+        task.updated_at = now
+        task.change_seq = seq
+
+        new_bucket = task_bucket(task)
+        categories.add(task.category_id)
+        if new_bucket != old_bucket:
+            deltas[old_bucket] -= 1
+            deltas[new_bucket] += 1
+
+    Task.objects.bulk_update(tasks, sorted(fields))
+    _replace_tags(tag_names, tag_ids, clear_existing=True)
+    apply_counter_deltas(deltas)
+    touch_categories(categories, now)
+    queue_batch_email(owner.pk, 'updated', [task.title for task in tasks])
+    return tasks
+
+
+def lock_tasks_for_delete(owner, ids):
+    """
+    The user's tasks among ids as {pk: row}, locked until the end of the
+    transaction. A missing id is not the user's task or is already deleted.
+    """
+    rows = Task.objects.select_for_update().filter(owner=owner, pk__in=ids).values('pk', 'title', *BUCKET_FIELDS)
+    return {row['pk']: row for row in rows}
+
+
+@transaction.atomic
+def bulk_delete_tasks(owner, rows):
+    """
+    Delete the task rows from lock_tasks_for_delete, returns how many were deleted
+    """
+    if not rows:
+        return 0
+    with task_signals_muted():
+        Task.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+    apply_counter_deltas(Counter({bucket: -count for bucket, count in Counter(map(task_bucket, rows)).items()}))
+    touch_categories({row['category_id'] for row in rows})
+    seq = next_change_seq(owner.pk)
+    TaskTombstone.objects.bulk_create(
+        TaskTombstone(owner=owner, task_id=row['pk'], change_seq=seq) for row in rows
+    )
+    queue_batch_email(owner.pk, 'deleted', [row['title'] for row in rows])
+    return len(rows)
+
+
+@transaction.atomic
+def bulk_transition_tasks(owner, queryset, new_status):
+    """
+    Move every task of queryset to new_status, returns how many tasks changed.
+    The matching rows are locked first and updated by id, so a task written
+    concurrently can't be counted in one bucket and moved from another.
+    """
+    # the filtered queryset may carry search annotations and ordering,
+    # the UPDATE only needs the matching ids
+    matched = Task.objects.filter(owner=owner, pk__in=queryset.values('pk')).exclude(status=new_status)
+    rows = list(
+        matched.select_for_update().order_by('-created_at', '-pk').values('pk', 'title', *BUCKET_FIELDS)
+    )
+    if not rows:
+        return 0
+    deltas = Counter()
+    for row in rows:
+        deltas[task_bucket(row)] -= 1
+        deltas[task_bucket({**row, 'status': new_status})] += 1
+
+    now = timezone.now()
+    seq = next_change_seq(owner.pk)
+    ids = [row['pk'] for row in rows]
+    for start in range(0, len(ids), BULK_UPDATE_BATCH_SIZE):
+        Task.objects.filter(pk__in=ids[start:start + BULK_UPDATE_BATCH_SIZE]).update(
+            status=new_status, updated_at=now, change_seq=seq,
+        )
+    apply_counter_deltas(deltas)
+    touch_categories({row['category_id'] for row in rows}, now)
+    queue_batch_email(owner.pk, f'moved to {new_status}', [row['title'] for row in rows[:BATCH_EMAIL_MAX_TITLES]], count=len(rows))
+    return len(rows)
@@ -0,0 +1,24 @@
+import django_filters
+
+from .models import Task
+from .statistics import overdue_filter
+
+
+class TaskFilter(django_filters.FilterSet):
+    """
+    The exact filters of the task list, due date ranges and overdue. The
+    overdue tasks are read from the (owner, due_date) partial index of the
+    open tasks.
+    """
+    due_after = django_filters.DateFilter(field_name='due_date', lookup_expr='gte', label='Due on or after this date')
+    due_before = django_filters.DateFilter(field_name='due_date', lookup_expr='lte', label='Due on or before this date')
+    overdue = django_filters.BooleanFilter(method='filter_overdue', label='Past their due date and not done')
+
+    class Meta:
+        model = Task
+        fields = ['status', 'priority', 'category']
+
+    def filter_overdue(self, queryset, name, value):
+        if value:
+            return queryset.filter(overdue_filter())
+        return queryset.exclude(overdue_filter())
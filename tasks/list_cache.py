@@ -0,0 +1,94 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+CACHE_PREFIX = 'task-list'
+STATS_KEYS = {'hits': f'{CACHE_PREFIX}:hits', 'misses': f'{CACHE_PREFIX}:misses'}
+
+
+def normalize_query_params(query_params):
+    """
+    the same filters in a different order (or with empty values) hit the same entry
+    """
+    return sorted(
+        (key, value)
+        for key, values in query_params.lists()
+        for value in values
+        if value != ''
+    )
+
+
+def task_list_cache_key(request, data_version, day=None):
+    """
+    Key of a task list page: the user, the version of their data, and
+    the normalized query. Any write bumps the version, so the old entries
+    of that user can't be reached anymore and just expire. Pages that
+    depend on the date (overdue) also pass the day they were built for.
+    """
+    version, updated_at = data_version
+    parts = [
+        request.user.pk,
+        version,
+        updated_at.isoformat() if updated_at else None,
+        request.get_host(),
+        request.accepted_renderer.format,
+        normalize_query_params(request.query_params),
+    ]
+    if day is not None:
+        parts.append(day.isoformat())
+    digest = hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+    return f'{CACHE_PREFIX}:{request.user.pk}:{digest}'
+
+
+def _count(name):
+    key = STATS_KEYS[name]
+    try:
+        cache.incr(key)
+    except ValueError:
+        # first use, or evicted
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_cached_page(key):
+    data = cache.get(key)
+    _count('misses' if data is None else 'hits')
+    return data
+
+
+def set_cached_page(key, data):
+    cache.set(key, data, timeout=settings.TASK_LIST_CACHE_TIMEOUT)
+
+
+async def _acount(name):
+    key = STATS_KEYS[name]
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        if not await cache.aadd(key, 1, timeout=None):
+            await cache.aincr(key)
+
+
+async def aget_cached_page(key):
+    data = await cache.aget(key)
+    await _acount('misses' if data is None else 'hits')
+    return data
+
+
+async def aset_cached_page(key, data):
+    await cache.aset(key, data, timeout=settings.TASK_LIST_CACHE_TIMEOUT)
+
+
+def cache_stats():
+    values = cache.get_many(list(STATS_KEYS.values()))
+    stats = {name: values.get(key, 0) for name, key in STATS_KEYS.items()}
+    total = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = stats['hits'] / total if total else 0.0
+    return stats
+
+
+def reset_cache_stats():
+    cache.delete_many(list(STATS_KEYS.values()))
@@ -0,0 +1,83 @@
+import copy
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import load_backend
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the per request database cost of opening a new connection every "
+        "time, a persistent connection (CONN_MAX_AGE + health checks) and, on "
+        "PostgreSQL with psycopg 3, a connection pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200, help="simulated requests per mode")
+        parser.add_argument('--queries', type=int, default=3, help="queries per simulated request")
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        base = connections[options['database']].settings_dict
+        modes = self.modes(base)
+        self.stdout.write(f"{base['ENGINE']} {base['NAME']}, {options['requests']} requests x {options['queries']} queries")
+        self.stdout.write(f"  {'mode':<22} {'p50 ms':>9} {'p95 ms':>9}")
+        for name, settings_dict in modes.items():
+            runs = self.measure(settings_dict, options)
+            p50 = statistics.median(runs)
+            p95 = statistics.quantiles(runs, n=20)[-1] if len(runs) > 1 else runs[0]
+            self.stdout.write(f"  {name:<22} {p50:>9.3f} {p95:>9.3f}")
+
+    def modes(self, base):
+        def variant(**overrides):
+            settings_dict = copy.deepcopy(base)
+            settings_dict['OPTIONS'].pop('pool', None)
+            settings_dict.update(overrides)
+            return settings_dict
+
+        modes = {
+            'new connection': variant(CONN_MAX_AGE=0, CONN_HEALTH_CHECKS=False),
+            'persistent': variant(CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=False),
+            'persistent + checks': variant(CONN_MAX_AGE=600, CONN_HEALTH_CHECKS=True),
+        }
+        if base['ENGINE'] == 'django.db.backends.postgresql' and self.pool_available():
+            pool = variant(CONN_MAX_AGE=0)
+            pool['OPTIONS']['pool'] = base['OPTIONS'].get('pool') or {'min_size': 1, 'max_size': 2}
+            modes['pool'] = pool
+        else:
+            self.stdout.write("pool skipped: needs PostgreSQL with psycopg 3 and psycopg_pool")
+        return modes
+
+    def pool_available(self):
+        try:
+            import psycopg  # noqa: F401
+            import psycopg_pool  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def measure(self, settings_dict, options):
+        """
+        run the simulated requests on a connection of their own, with the
+        same bookkeeping Django does on request_started / request_finished
+        """
+        backend = load_backend(settings_dict['ENGINE'])
+        connection = backend.DatabaseWrapper(settings_dict, alias=f"benchmark-{settings_dict['CONN_MAX_AGE']}")
+        runs = []
+        try:
+            for _ in range(options['requests']):
+                started = time.perf_counter()
+                connection.close_if_unusable_or_obsolete()
+                with connection.cursor() as cursor:
+                    for _ in range(options['queries']):
+                        cursor.execute('SELECT 1')
+                        cursor.fetchone()
+                connection.close_if_unusable_or_obsolete()
+                runs.append((time.perf_counter() - started) * 1000)
+        finally:
+            connection.close()
+            if hasattr(connection, 'close_pool'):
+                connection.close_pool()
+        return runs
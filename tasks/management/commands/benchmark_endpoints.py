@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+
+from tasks.benchmarks import (
+    BenchmarkError, Scenarios, compare_results, describe_run, load_baseline,
+    run_scenarios, seed_dataset, write_baseline,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic dataset and benchmark the task endpoints (list, search, "
+        "ordering, statistics, create) and the export and reminder jobs: p50/p95 "
+        "latency, queries per request and peak memory. --output saves a JSON "
+        "baseline, --baseline compares against one and fails on regressions. "
+        "Everything is rolled back unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=20)
+        parser.add_argument('--tasks-per-user', type=int, default=500)
+        parser.add_argument('--tags', type=int, default=50)
+        parser.add_argument('--categories', type=int, default=5, help="categories per user")
+        parser.add_argument('--seed', type=int, default=0, help="random seed of the generator")
+        parser.add_argument('--iterations', type=int, default=20, help="timed runs per scenario")
+        parser.add_argument('--warmup', type=int, default=2)
+        parser.add_argument('--scenario', action='append', dest='scenarios', choices=Scenarios.names,
+                            help="run only this scenario, can be repeated")
+        parser.add_argument('--output', help="write the results to this JSON baseline")
+        parser.add_argument('--baseline', help="compare the results with this JSON baseline")
+        parser.add_argument('--tolerance', type=float, default=0.2, help="allowed relative slowdown, 0.2 = 20%%")
+        parser.add_argument('--keep', action='store_true', help="keep the seeded data")
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            try:
+                baseline = load_baseline(options['baseline'])
+            except (OSError, ValueError, BenchmarkError) as e:
+                raise CommandError(e)
+
+        dataset = {
+            'users': options['users'],
+            'tasks_per_user': options['tasks_per_user'],
+            'tags': options['tags'],
+            'categories': options['categories'],
+            'seed': options['seed'],
+        }
+        # the export and reminder emails stay in memory
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend'), transaction.atomic():
+            owners = seed_dataset(**dataset)
+            if not owners:
+                raise CommandError("--users must be at least 1")
+            self.stdout.write(f"Seeded {len(owners)} users x {options['tasks_per_user']} tasks")
+            try:
+                results = run_scenarios(owners[len(owners) // 2], options['scenarios'], options['iterations'], options['warmup'])
+            except BenchmarkError as e:
+                raise CommandError(e)
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        meta = describe_run(dataset, options['iterations'])
+        self.report(results, baseline)
+        if options['output']:
+            write_baseline(options['output'], meta, results)
+            self.stdout.write(f"Baseline written to {options['output']}")
+
+        if baseline is not None:
+            if baseline['meta'].get('dataset') != dataset:
+                self.stdout.write(self.style.WARNING(f"The baseline was taken on another dataset: {baseline['meta'].get('dataset')}"))
+            regressions = compare_results(results, baseline['results'], options['tolerance'])
+            if regressions:
+                for name, metric, old, new in regressions:
+                    self.stderr.write(f"  {name} {metric}: {old} -> {new}")
+                raise CommandError(f"{len(regressions)} regression(s) against {options['baseline']}")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
+
+    def report(self, results, baseline):
+        before = baseline['results'] if baseline else {}
+        self.stdout.write(f"  {'scenario':<12} {'p50 ms':>9} {'p95 ms':>9} {'queries':>8} {'peak KB':>9}")
+        for name, metrics in results.items():
+            line = (
+                f"  {name:<12} {metrics['p50_ms']:>9.3f} {metrics['p95_ms']:>9.3f} "
+                f"{metrics['queries']:>8} {metrics['peak_kb']:>9.1f}"
+            )
+            if name in before:
+                old = before[name]
+                line += f"   (was {old['p50_ms']:.3f} / {old['p95_ms']:.3f} ms, {old['queries']} queries, {old['peak_kb']:.1f} KB)"
+            self.stdout.write(line)
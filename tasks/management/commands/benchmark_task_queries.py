@@ -0,0 +1,100 @@
+import statistics
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tasks.benchmarks import seed_dataset
+from tasks.models import Task
+from tasks.statistics import due_by_filter, overdue_filter
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a large task dataset and report query plans and timings of the hot "
+        "task queries, without and with the Task indexes. Everything is rolled back "
+        "unless --keep is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--tasks-per-user', type=int, default=2000)
+        parser.add_argument('--repeat', type=int, default=20, help="runs per query, the median is reported")
+        parser.add_argument('--no-plans', action='store_true', help="skip printing the query plans")
+        parser.add_argument('--keep', action='store_true', help="keep the seeded data")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            owner = self.seed(options['users'], options['tasks_per_user'])
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE tasks_task')
+
+            self.drop_indexes()
+            before = self.measure(owner, options, 'without indexes')
+            self.create_indexes()
+            after = self.measure(owner, options, 'with indexes')
+
+            self.stdout.write(self.style.MIGRATE_HEADING("\nMedian time per query (ms)"))
+            for name in before:
+                speedup = before[name] / after[name] if after[name] else float('inf')
+                self.stdout.write(f"  {name:<28} {before[name]:>9.3f} -> {after[name]:>9.3f}  ({speedup:.1f}x)")
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+    # plain statements: the schema editor context can't be entered inside
+    # a transaction on SQLite
+    def drop_indexes(self):
+        with connection.cursor() as cursor:
+            for index in Task._meta.indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+
+    def create_indexes(self):
+        editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for index in Task._meta.indexes:
+                cursor.execute(str(index.create_sql(Task, editor)))
+
+    def seed(self, users, tasks_per_user):
+        """
+        the task rows of the endpoint benchmark dataset, without tags or
+        categories, the hot queries here only read the Task table
+        """
+        started = time.perf_counter()
+        owners = seed_dataset(users=users, tasks_per_user=tasks_per_user, tags=0, categories=0)
+        self.stdout.write(
+            f"Seeded {len(owners)} users x {tasks_per_user} tasks in {time.perf_counter() - started:.1f}s"
+        )
+        return owners[len(owners) // 2]
+
+    def hot_queries(self, owner):
+        today = timezone.localdate()
+        tomorrow = today + timedelta(days=1)
+        tasks = Task.objects.filter(owner=owner)
+        return {
+            'list -created_at': tasks.order_by('-created_at')[:10],
+            'list status=todo': tasks.filter(status='todo').order_by('-created_at')[:10],
+            'list priority=high': tasks.filter(priority='high').order_by('-created_at')[:10],
+            'overdue tasks': tasks.filter(overdue_filter()).values('id'),
+            'agenda next 7 days': tasks.filter(due_by_filter(today + timedelta(days=6))).order_by('due_date').values('id'),
+            'reminders due tomorrow': Task.objects.filter(due_date=tomorrow).exclude(status='done'),
+        }
+
+    def measure(self, owner, options, label):
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{label}"))
+        timings = {}
+        for name, queryset in self.hot_queries(owner).items():
+            if not options['no_plans']:
+                self.stdout.write(f"  {name}:")
+                for line in queryset.explain().splitlines():
+                    self.stdout.write(f"    {line}")
+            runs = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                list(queryset.all())
+                runs.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(runs)
+        return timings
@@ -0,0 +1,66 @@
+import statistics
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from config.cache import cache_is_shared
+from config.task_metrics import TASK_RUN_LOG_SIZE, recent_task_runs
+
+
+class Command(BaseCommand):
+    help = (
+        "Show the last Celery task runs (queue wait, run time, retries, rows and "
+        "emails) and a summary per task, read from the shared cache"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--last', type=int, default=20, help=f"runs to show, at most {TASK_RUN_LOG_SIZE}")
+        parser.add_argument('--task', help="only runs of this task, the full name or its last part")
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            raise CommandError(
+                "The task runs are logged by the workers in the shared cache, this process "
+                "has its own memory cache: set CACHE_REDIS_URL"
+            )
+        runs = recent_task_runs(options['last'])
+        if options['task']:
+            runs = [run for run in runs if options['task'] in (run['task'], run['task'].rsplit('.', 1)[-1])]
+        if not runs:
+            self.stdout.write("No task runs recorded")
+            return
+
+        self.stdout.write(
+            f"  {'finished':<19} {'task':<28} {'state':<8} {'wait s':>8} {'run s':>8} {'retries':>7} {'rows':>7} {'emails':>6}"
+        )
+        for run in runs:
+            finished = datetime.fromtimestamp(run['finished_at']).strftime('%Y-%m-%d %H:%M:%S')
+            wait = '-' if run['queue_wait'] is None else f"{run['queue_wait']:.3f}"
+            self.stdout.write(
+                f"  {finished:<19} {self.short(run['task']):<28} {run['state'] or '?':<8} {wait:>8} "
+                f"{run['runtime']:>8.3f} {run['retries']:>7} {run['rows']:>7} {run['emails']:>6}"
+            )
+
+        self.stdout.write(self.style.MIGRATE_HEADING("\nPer task"))
+        self.stdout.write(
+            f"  {'task':<28} {'runs':>5} {'failed':>6} {'p50 run s':>10} {'p95 run s':>10} {'p95 wait s':>10} {'rows':>8} {'emails':>7}"
+        )
+        by_task = {}
+        for run in runs:
+            by_task.setdefault(run['task'], []).append(run)
+        for name, task_runs in sorted(by_task.items()):
+            runtimes = [run['runtime'] for run in task_runs]
+            waits = [run['queue_wait'] for run in task_runs if run['queue_wait'] is not None]
+            failed = sum(run['state'] == 'FAILURE' for run in task_runs)
+            p95_wait = f"{self.p95(waits):.3f}" if waits else '-'
+            self.stdout.write(
+                f"  {self.short(name):<28} {len(task_runs):>5} {failed:>6} {statistics.median(runtimes):>10.3f} "
+                f"{self.p95(runtimes):>10.3f} {p95_wait:>10} {sum(run['rows'] for run in task_runs):>8} "
+                f"{sum(run['emails'] for run in task_runs):>7}"
+            )
+
+    def short(self, name):
+        return name.rsplit('.', 1)[-1]
+
+    def p95(self, values):
+        return statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tasks.statistics import find_counter_drift, rebuild_counters
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-user task statistics counters, or check them for drift with --check"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="phone number of a single user to rebuild/check")
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help="only compare the counters with the task table, exit with an error if they drifted",
+        )
+
+    def handle(self, *args, **options):
+        owner = None
+        if options['user']:
+            try:
+                owner = User.objects.get(phone_number=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        drift = find_counter_drift(owner)
+        for (owner_id, category_id, status, priority), stored, expected in drift:
+            self.stdout.write(
+                f"user={owner_id} category={category_id} status={status} priority={priority}: "
+                f"stored {stored}, expected {expected}"
+            )
+
+        if options['check']:
+            if drift:
+                raise CommandError(f"{len(drift)} counter bucket(s) drifted")
+            self.stdout.write(self.style.SUCCESS("Task counters are in sync"))
+            return
+
+        rebuild_counters(owner)
+        self.stdout.write(self.style.SUCCESS(f"Task counters rebuilt ({len(drift)} bucket(s) fixed)"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from config.cache import cache_is_shared
+from tasks.list_cache import cache_stats, reset_cache_stats
+
+
+class Command(BaseCommand):
+    help = "Show the hit/miss counters of the task list response cache"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help="zero the counters after printing them")
+
+    def handle(self, *args, **options):
+        if not cache_is_shared():
+            self.stderr.write(self.style.WARNING(
+                "The cache is local to each process (set CACHE_REDIS_URL): these counters "
+                "only cover this command, not the web workers"
+            ))
+        stats = cache_stats()
+        self.stdout.write(
+            f"hits {stats['hits']}, misses {stats['misses']}, hit ratio {stats['hit_ratio']:.1%}"
+        )
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS("Counters reset"))
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:44
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_task_counters(apps, schema_editor):
+    Task = apps.get_model('tasks', 'Task')
+    TaskCounter = apps.get_model('tasks', 'TaskCounter')
+    rows = (
+        Task.objects.values('owner_id', 'category_id', 'status', 'priority')
+        .annotate(count=models.Count('id'))
+        .order_by()
+    )
+    TaskCounter.objects.bulk_create(TaskCounter(**row) for row in rows)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0011_create_task_tags_table'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(max_length=20)),
+                ('priority', models.CharField(max_length=10)),
+                ('count', models.IntegerField(default=0)),
+                ('category', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='task_counters', to='tasks.category')),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_counters', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(condition=models.Q(('category__isnull', False)), fields=('owner', 'category', 'status', 'priority'), name='unique_task_counter_bucket'), models.UniqueConstraint(condition=models.Q(('category__isnull', True)), fields=('owner', 'status', 'priority'), name='unique_task_counter_uncategorized_bucket')],
+            },
+        ),
+        migrations.RunPython(backfill_task_counters, migrations.RunPython.noop),
+    ]
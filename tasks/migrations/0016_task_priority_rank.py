@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:53
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0015_task_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='task',
+            name='priority_rank',
+            field=models.GeneratedField(db_persist=True, expression=models.Case(models.When(priority='low', then=1), models.When(priority='medium', then=2), models.When(priority='high', then=3), default=0), output_field=models.PositiveSmallIntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', '-priority_rank', '-created_at'], name='task_owner_priority_desc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['owner', 'priority_rank', '-created_at'], name='task_owner_priority_asc_idx'),
+        ),
+    ]
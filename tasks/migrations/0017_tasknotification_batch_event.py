@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0016_task_priority_rank'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tasknotification',
+            name='event',
+            field=models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('batch', 'Batch')], max_length=20),
+        ),
+    ]
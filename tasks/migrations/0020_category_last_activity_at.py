@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:22
+
+from django.db import migrations, models
+
+
+def backfill_last_activity(apps, schema_editor):
+    Category = apps.get_model('tasks', 'Category')
+    Task = apps.get_model('tasks', 'Task')
+    latest = models.Subquery(
+        Task.objects.filter(category=models.OuterRef('pk'))
+        .order_by('-updated_at')
+        .values('updated_at')[:1]
+    )
+    Category.objects.update(last_activity_at=latest)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0019_task_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='last_activity_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_last_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tasks', '0020_category_last_activity_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(condition=models.Q(('due_date__isnull', False), models.Q(('status', 'done'), _negated=True)), fields=['owner', 'due_date'], name='task_owner_open_due_idx'),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from enum import unique
 from django.db import models
+from django.utils import timezone
 from users.models import User
 
 # Create your models here.
@@ -18,6 +19,8 @@ class Category(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='categories')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # last time one of its tasks was created, changed, moved or deleted
+    last_activity_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     def __str__(self):
         return self.name
@@ -46,15 +49,151 @@ class Task(models.Model):
     description = models.TextField()
     status = models.CharField(max_length=20, choices=choice_status, default='todo')
     priority = models.CharField(max_length=10, choices=choice_priority, default='low')
+    # integer form of priority for ordering, computed and stored by the database
+    priority_rank = models.GeneratedField(
+        expression=models.Case(
+            models.When(priority='low', then=1),
+            models.When(priority='medium', then=2),
+            models.When(priority='high', then=3),
+            default=0,
+        ),
+        output_field=models.PositiveSmallIntegerField(),
+        db_persist=True,
+    )
     due_date = models.DateField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # the owner's data version at the last change, what delta sync reads
+    change_seq = models.PositiveBigIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
+
+    class Meta:
+        indexes = [
+            # the task list: one user's tasks, newest first
+            models.Index(fields=['owner', '-created_at'], name='task_owner_created_idx'),
+            # list filters, still in the default order
+            models.Index(fields=['owner', 'status', '-created_at'], name='task_owner_status_idx'),
+            models.Index(fields=['owner', 'priority', '-created_at'], name='task_owner_priority_idx'),
+            # ?ordering=-priority and ?ordering=priority, newest first inside a priority
+            models.Index(fields=['owner', '-priority_rank', '-created_at'], name='task_owner_priority_desc_idx'),
+            models.Index(fields=['owner', 'priority_rank', '-created_at'], name='task_owner_priority_asc_idx'),
+            # daily reminders scan due dates of open tasks across all users
+            models.Index(
+                fields=['due_date'],
+                condition=models.Q(due_date__isnull=False) & ~models.Q(status='done'),
+                name='task_open_due_date_idx',
+            ),
+            # overdue / due date filters and the agenda: one user's open tasks by due date
+            models.Index(
+                fields=['owner', 'due_date'],
+                condition=models.Q(due_date__isnull=False) & ~models.Q(status='done'),
+                name='task_owner_open_due_idx',
+            ),
+            # delta sync: a user's tasks changed after a sequence number
+            models.Index(fields=['owner', 'change_seq', 'id'], name='task_owner_change_seq_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the stored state so signals can diff it on save/delete
+        # without re-reading the row
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values)
+            if value is not models.DEFERRED
+        }
+        return instance
+
+
+class TaskCounter(models.Model):
+    """
+    Per-user task count for one (category, status, priority) bucket.
+    Kept up to date by the Task signals so statistics never scan tasks.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='task_counters')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True, related_name='task_counters')
+    status = models.CharField(max_length=20)
+    priority = models.CharField(max_length=10)
+    count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.owner_id}/{self.category_id}/{self.status}/{self.priority}: {self.count}"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['owner', 'category', 'status', 'priority'],
+                condition=models.Q(category__isnull=False),
+                name='unique_task_counter_bucket',
+            ),
+            models.UniqueConstraint(
+                fields=['owner', 'status', 'priority'],
+                condition=models.Q(category__isnull=True),
+                name='unique_task_counter_uncategorized_bucket',
+            ),
+        ]
+
     
     
     
+
     
 
-    
\ No newline at end of file
+class TaskNotification(models.Model):
+    """
+    Outbox row for a task email. Written by the Task signals in the same
+    transaction as the task, sent later in batches by the Celery worker.
+    """
+    choice_event = [
+        ('created', 'Created'),
+        ('updated', 'Updated'),
+        ('batch', 'Batch'),
+    ]
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='task_notifications')
+    event = models.CharField(max_length=20, choices=choice_event)
+    # snapshot of the task fields the email shows
+    payload = models.JSONField(default=dict)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.event} notification for {self.owner_id}"
+
+    class Meta:
+        ordering = ['id']
+
+
+class DataVersion(models.Model):
+    """
+    Version number of a slice of data ('user:<id>' for a user's tasks and
+    categories, 'tags' for the shared tag list), bumped on every write.
+    Conditional GETs derive their validators from it.
+    """
+    scope = models.CharField(max_length=64, primary_key=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.scope}@{self.version}"
+
+
+class TaskTombstone(models.Model):
+    """
+    Left behind by a deleted task so delta sync clients learn about the deletion,
+    kept TASK_TOMBSTONE_RETENTION_DAYS
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='task_tombstones')
+    task_id = models.BigIntegerField()
+    change_seq = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'change_seq', 'task_id'], name='tombstone_owner_seq_idx'),
+        ]
+
+    def __str__(self):
+        return f"task {self.task_id} deleted"
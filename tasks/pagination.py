@@ -0,0 +1,230 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError as DjangoValidationError
+from django.core.paginator import InvalidPage, Paginator
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class CountedPaginator(Paginator):
+    """
+    A Django paginator over a count that was already taken, so it never
+    runs COUNT(*) itself
+    """
+
+    def __init__(self, object_list, per_page, count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self._count = count
+
+    @property
+    def count(self):
+        return self._count
+
+
+class TaskPageNumberPagination(PageNumberPagination):
+    """
+    PageNumberPagination that can also paginate through the async ORM, for
+    the async task views. Both paths pick the page and build the links the
+    same way.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        return list(self._select_page(self.django_paginator_class(queryset, page_size), request))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        page = self._select_page(CountedPaginator(queryset, page_size, await queryset.acount()), request)
+        page.object_list = [instance async for instance in page.object_list.aiterator(chunk_size=page_size)]
+        return list(page)
+
+    def _select_page(self, paginator, request):
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        if paginator.num_pages > 1 and self.template is not None:
+            # The browsable API should display pagination controls.
+            self.display_page_controls = True
+        self.request = request
+        return self.page
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset pagination over whatever ordering the view's queryset already has.
+
+    The primary key is appended as a tie-breaker and the cursor stores the
+    values of every ordering column of the edge row, so each page is a
+    single `WHERE (cols) > (values) ... LIMIT n` query: no COUNT(*) and no
+    OFFSET scan, whatever the depth of the page.
+    """
+    mode_query_param = 'pagination'
+    mode_query_value = 'cursor'
+
+    @classmethod
+    def is_requested(cls, request):
+        """
+        Cursor mode is opt-in: ?pagination=cursor for the first page,
+        the next/previous links carry the cursor after that.
+        """
+        params = request.query_params
+        return params.get(cls.mode_query_param) == cls.mode_query_value or cls.cursor_query_param in params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.ordering_fields = [self._ordering_field(queryset, field.lstrip('-')) for field in self.ordering]
+        position, self.reverse = self.decode_cursor(request)
+
+        ordering = [self._invert(field) for field in self.ordering] if self.reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        # fetch one extra row to know whether there is a following page
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        """
+        Take the ordering from the queryset and append the primary key,
+        following the direction of the last column.
+        """
+        ordering = [str(field) for field in queryset.query.order_by]
+        if not ordering:
+            ordering = ['-pk']
+        for field in ordering:
+            self._ordering_field(queryset, field.lstrip('-'))
+        if ordering[-1].lstrip('-') not in ('pk', 'id'):
+            ordering.append('-pk' if ordering[-1].startswith('-') else 'pk')
+        return tuple(ordering)
+
+    def _ordering_field(self, queryset, name):
+        """
+        The model field (or annotation output field) behind an ordering
+        column, refusing the ones a keyset can't page over
+        """
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        if name == 'pk':
+            return queryset.model._meta.pk
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise ValidationError({'ordering': f"Cannot use cursor pagination with ordering '{name}'"})
+        # NULLs can't be compared with < and >, so the keyset would skip rows
+        if field.null:
+            raise ValidationError({'ordering': f"Cannot use cursor pagination with nullable field '{name}'"})
+        return field
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def _after(ordering, position):
+        """
+        Build the row-value comparison "comes after position" as nested Q objects
+        """
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            payload = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position = payload['p']
+            reverse = bool(payload.get('r', False))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return self._parse_position(position), reverse
+
+    def _parse_position(self, position):
+        """
+        Convert the cursor values to the types of their ordering columns, a
+        tampered cursor is a 404 rather than a database error
+        """
+        parsed = []
+        for field, value in zip(self.ordering_fields, position):
+            # bool is an int, and nothing in a cursor is ever null
+            if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                raise NotFound(self.invalid_cursor_message)
+            try:
+                value = field.to_python(value)
+            except (TypeError, ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            if value is None:
+                raise NotFound(self.invalid_cursor_message)
+            parsed.append(value)
+        return parsed
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': position}
+        if reverse:
+            payload['r'] = True
+        encoded = urlsafe_b64encode(json.dumps(payload).encode('ascii')).decode('ascii')
+        url = remove_query_param(self.base_url, self.mode_query_param)
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def _get_position_from_instance(self, instance, ordering):
+        position = []
+        for field in ordering:
+            name = field.lstrip('-')
+            value = instance[name] if isinstance(instance, dict) else getattr(instance, name)
+            # isoformat keeps the microseconds, the keyset needs exact values
+            position.append(value.isoformat() if hasattr(value, 'isoformat') else value)
+        return position
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self._get_position_from_instance(self.page[-1], self.ordering), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.encode_cursor(self._get_position_from_instance(self.page[0], self.ordering), reverse=True)
+
+    def get_schema_operation_parameters(self, view):
+        parameters = super().get_schema_operation_parameters(view)
+        parameters.append({
+            'name': self.mode_query_param,
+            'required': False,
+            'in': 'query',
+            'description': "Set to 'cursor' to use keyset pagination instead of page numbers",
+            'schema': {'type': 'string', 'enum': [self.mode_query_value]},
+        })
+        return parameters
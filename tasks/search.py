@@ -0,0 +1,136 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField
+from django.db.models.expressions import RawSQL
+from rest_framework import filters
+
+from .models import Task
+
+
+TASK_TABLE = Task._meta.db_table
+SQLITE_FTS_TABLE = 'tasks_task_fts'
+
+SQLITE_FTS_TRIGGERS = {
+    'tasks_task_fts_ai': f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_task_fts_ai AFTER INSERT ON {TASK_TABLE} BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """,
+    'tasks_task_fts_ad': f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_task_fts_ad AFTER DELETE ON {TASK_TABLE} BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description)
+            VALUES ('delete', old.id, old.title, old.description);
+        END
+    """,
+    'tasks_task_fts_au': f"""
+        CREATE TRIGGER IF NOT EXISTS tasks_task_fts_au AFTER UPDATE OF title, description ON {TASK_TABLE} BEGIN
+            INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, title, description)
+            VALUES ('delete', old.id, old.title, old.description);
+            INSERT INTO {SQLITE_FTS_TABLE}(rowid, title, description) VALUES (new.id, new.title, new.description);
+        END
+    """,
+}
+
+
+def ensure_sqlite_search_triggers(connection):
+    """
+    SQLite drops the triggers whenever a migration rebuilds the task table,
+    put them back and resync the index if any was missing
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+        existing = {row[0] for row in cursor.fetchall()}
+        if SQLITE_FTS_TABLE not in existing or set(SQLITE_FTS_TRIGGERS) <= existing:
+            return
+        for sql in SQLITE_FTS_TRIGGERS.values():
+            cursor.execute(sql)
+        cursor.execute(f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')")
+
+
+def search_words(terms):
+    """
+    split the search terms into plain words, dropping any query syntax
+    """
+    return re.findall(r'\w+', ' '.join(terms))
+
+
+class PostgresTaskSearch:
+    """
+    Matches against the generated, GIN indexed search_vector column
+    (title weighted above description) and ranks with ts_rank.
+    """
+
+    def search(self, queryset, words):
+        # every word must match, as a prefix like the old icontains search
+        query = ' & '.join("'" + word.replace("'", "''") + "':*" for word in words)
+        tsquery = "to_tsquery('simple', %s)"
+        return queryset.filter(
+            RawSQL(f'"{TASK_TABLE}"."search_vector" @@ {tsquery}', [query], output_field=BooleanField())
+        ).annotate(
+            search_rank=RawSQL(f'ts_rank("{TASK_TABLE}"."search_vector", {tsquery})', [query], output_field=FloatField())
+        )
+
+
+class SQLiteTaskSearch:
+    """
+    Matches against the tasks_task_fts FTS5 table kept in sync by triggers,
+    ranks with bm25 (title weighted above description).
+    """
+
+    def search(self, queryset, words):
+        query = ' '.join(f'"{word}"*' for word in words)
+        return queryset.filter(
+            RawSQL(
+                f'"{TASK_TABLE}"."id" IN (SELECT rowid FROM {SQLITE_FTS_TABLE} WHERE {SQLITE_FTS_TABLE} MATCH %s)',
+                [query],
+                output_field=BooleanField(),
+            )
+        ).annotate(
+            # bm25 is lower for better matches, flip it so higher is better everywhere
+            search_rank=RawSQL(
+                f'(SELECT -bm25({SQLITE_FTS_TABLE}, 10.0, 1.0) FROM {SQLITE_FTS_TABLE} '
+                f'WHERE {SQLITE_FTS_TABLE} MATCH %s AND rowid = "{TASK_TABLE}"."id")',
+                [query],
+                output_field=FloatField(),
+            )
+        )
+
+
+_sqlite_fts_available = {}
+
+
+def get_search_backend(alias):
+    """
+    pick the full-text backend for a database, None means fall back to icontains
+    """
+    connection = connections[alias]
+    if connection.vendor == 'postgresql':
+        return PostgresTaskSearch()
+    if connection.vendor == 'sqlite':
+        if alias not in _sqlite_fts_available:
+            _sqlite_fts_available[alias] = SQLITE_FTS_TABLE in connection.introspection.table_names()
+        if _sqlite_fts_available[alias]:
+            return SQLiteTaskSearch()
+    return None
+
+
+class TaskSearchFilter(filters.SearchFilter):
+    """
+    `search` backed by the database full-text index, results come ordered by
+    relevance unless the client asked for an explicit ordering
+    """
+    search_description = 'A search term, every word is matched as a prefix in the title or description.'
+
+    def filter_queryset(self, request, queryset, view):
+        words = search_words(self.get_search_terms(request))
+        backend = get_search_backend(queryset.db) if words else None
+        if backend is None:
+            return super().filter_queryset(request, queryset, view)
+
+        queryset = backend.search(queryset, words)
+        if 'ordering' not in request.query_params:
+            queryset = queryset.order_by('-search_rank', *queryset.query.order_by)
+        return queryset
@@ -1,30 +1,86 @@
 
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 from .models import Tag, Task, Category
+from .statistics import CATEGORY_ROLLUP_FIELDS
+from .tag_cache import resolve_tags
 
 class CategorySerializer(serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.phone_number')
     class Meta:
         model = Category
         fields = '__all__'
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'last_activity_at']
+
+
+class CategoryRollupSerializer(CategorySerializer):
+    """
+    A category with its task counts, read from the annotations of
+    statistics.annotate_category_rollups (zero on a category just created)
+    """
+    task_counts = serializers.SerializerMethodField()
+
+    def get_task_counts(self, obj) -> dict:
+        return {
+            field.removesuffix('_tasks'): getattr(obj, field, 0)
+            for field in CATEGORY_ROLLUP_FIELDS
+        }
+
+
+class TagNameListField(serializers.ManyRelatedField):
+    """
+    Validates the whole list of tag names in one pass and returns the names,
+    they are resolved to tags by the write itself, in its transaction, so a
+    rejected or rolled back write creates no tags.
+    """
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        max_length = Tag._meta.get_field('name').max_length
+        for name in data:
+            if not isinstance(name, str) or not name or len(name) > max_length:
+                self.child_relation.fail('invalid')
+        return list(dict.fromkeys(data))
 
 
 class TagSlugRelatedField(serializers.SlugRelatedField):
     """
-    Accepts tag names (strings), creates missing tags, and returns Tag instances.
+    Accepts tag names (strings), the missing tags are created on save.
+    """
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return TagNameListField(**list_kwargs)
+
+
+class CategoryIdField(serializers.PrimaryKeyRelatedField):
+    """
+    Looks the category up in context['categories'] when the view preloaded the
+    user's categories (bulk writes), instead of one query per item.
     """
     def to_internal_value(self, data):
-        if isinstance(data, str):
-            obj, _ = Tag.objects.get_or_create(name=data)
-            return obj
-        return super().to_internal_value(data)
+        categories = self.context.get('categories')
+        if categories is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return categories[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
 
 
 class TaskSerializer(serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
-    category_id = serializers.PrimaryKeyRelatedField(
-        queryset=Category.objects.all(),
+    category_id = CategoryIdField(
+        queryset=Category.objects.select_related('owner'),
         source='category',
         required=False,
         allow_null=True,
@@ -42,7 +98,7 @@ class TaskSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Task
-        fields = '__all__'
+        exclude = ['priority_rank']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
     title = serializers.CharField(max_length=255, help_text="The title of the task")
@@ -53,7 +109,7 @@ class TaskSerializer(serializers.ModelSerializer):
         tags = validated_data.pop('tags', [])
         task = Task.objects.create(**validated_data)
         if tags:
-            task.tags.set(tags)  # tags are Tag instances
+            task.tags.set(resolve_tags(tags))  # tags are names
         return task
 
     def update(self, instance, validated_data):
@@ -62,13 +118,22 @@ class TaskSerializer(serializers.ModelSerializer):
             setattr(instance, attr, value)
         instance.save()
         if tags is not None:
-            instance.tags.set(tags)
+            instance.tags.set(resolve_tags(tags))
         return instance
 
 
 
 
 
+class TaskTransitionSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Task.choice_status, help_text="The status to move the matching tasks to")
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        required=False,
+        help_text="Only transition these task ids (combined with the query filters)"
+    )
+
+
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Tag
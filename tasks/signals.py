@@ -1,41 +1,245 @@
-from django.db.models.signals import post_save
-from .models import Task
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_save, pre_save, post_delete, pre_delete
+from .models import Task, Category, Tag, TaskNotification, TaskTombstone
 from django.dispatch import receiver
-from django.core.mail import send_mail
-from django.conf import settings
+from .statistics import BUCKET_FIELDS, task_bucket, move_task_between_buckets, merge_category_counters, touch_categories
+from .tag_cache import publish_tags_change, tag_cache
+from .tasks import schedule_notification_drain
+from .sync import (
+    change_seq_taken_in_transaction, mark_change_seq_taken, next_change_seq, require_atomic_block, stamp_tasks,
+)
+from .versioning import TAGS_SCOPE, bump_data_version
+from users.models import User
+from config.cache import cache_is_shared
+
+# the titles listed in a batch email
+BATCH_EMAIL_MAX_TITLES = 20
+
+_task_signals_muted = ContextVar('task_signals_muted', default=False)
+
+
+@contextmanager
+def task_signals_muted():
+    """
+    per-row Task receivers do nothing inside this block, for bulk writes that
+    update the counters and the outbox once for the whole batch
+    """
+    token = _task_signals_muted.set(True)
+    try:
+        yield
+    finally:
+        _task_signals_muted.reset(token)
+
+
+def queue_batch_email(owner_id, action, titles, count=None):
+    """
+    one outbox row for a whole bulk write instead of one per task,
+    count defaults to the number of titles when all of them are known
+    """
+    count = len(titles) if count is None else count
+    if not count:
+        return
+    TaskNotification.objects.create(
+        owner_id=owner_id,
+        event='batch',
+        payload={
+            'action': action,
+            'count': count,
+            'titles': list(titles[:BATCH_EMAIL_MAX_TITLES]),
+        },
+    )
+    schedule_notification_drain()
+
+
+def _origin_model(origin):
+    """
+    model of the instance or queryset a delete started from, None when unknown
+    """
+    if origin is None:
+        return None
+    return origin.model if isinstance(origin, QuerySet) else type(origin)
+
 
 @receiver(post_save, sender=Task)
-def send_task_email(sender, instance, created, **kwargs):
+def queue_task_email(sender, instance, created, **kwargs):
     """
-    send email to the user when a task is created
+    write the task email to the outbox, it is sent by a worker after commit
+    so the request never waits for the mail server
     """
-    user_email = instance.owner.email
-    if not user_email:
-        return f"User {instance.owner.username} has no email address"
+    if _task_signals_muted.get():
+        return
+    payload = {
+        'task_id': instance.pk,
+        'title': instance.title,
+        'status': instance.status,
+        'priority': instance.priority,
+    }
+    if created:
+        payload['description'] = instance.description
+    TaskNotification.objects.create(
+        owner_id=instance.owner_id,
+        event='created' if created else 'updated',
+        payload=payload,
+    )
+    schedule_notification_drain()
+
+
+@receiver(pre_save, sender=Task)
+def load_task_state(sender, instance, **kwargs):
+    """
+    make sure an existing task knows its stored state before it is saved
+    (instances built by hand instead of loaded from the database)
+    """
+    if instance._state.adding or _task_signals_muted.get():
+        return
+    stored = getattr(instance, '_loaded_values', None) or {}
+    if all(field in stored for field in BUCKET_FIELDS):
+        return
+    instance._loaded_values = Task.objects.filter(pk=instance.pk).values(*BUCKET_FIELDS).first()
+
+
+def _loaded_category(instance):
+    # the category the task was loaded or saved with, its last activity saves a touch
+    if Task.category.is_cached(instance) and instance.category is not None:
+        return [instance.category]
+    return []
+
 
+@receiver(post_save, sender=Task)
+def update_task_counters(sender, instance, created, **kwargs):
+    """
+    keep the per-user statistics counters in step with the task table
+    """
+    if _task_signals_muted.get():
+        return
+    old_bucket = None
+    if not created and getattr(instance, '_loaded_values', None):
+        old_bucket = task_bucket(instance._loaded_values)
+    move_task_between_buckets(old_bucket, task_bucket(instance))
+    touch_categories({instance.category_id, old_bucket[1] if old_bucket else None}, loaded=_loaded_category(instance))
+    instance._loaded_values = {field: getattr(instance, field) for field in BUCKET_FIELDS}
+
+
+@receiver(post_delete, sender=Task)
+def remove_task_from_counters(sender, instance, origin=None, **kwargs):
+    if _task_signals_muted.get():
+        return
+    # the counters and categories go too when the whole user is deleted
+    if _origin_model(origin) is User:
+        return
+    stored = getattr(instance, '_loaded_values', None)
+    bucket = task_bucket(stored) if stored else task_bucket(instance)
+    move_task_between_buckets(bucket, None)
+    touch_categories({bucket[1]}, loaded=_loaded_category(instance))
+
+
+@receiver(pre_delete, sender=Category)
+def move_category_counters(sender, instance, origin=None, **kwargs):
+    """
+    the tasks of a deleted category become uncategorized, move their counts too
+    (skipped when the whole user is being deleted, their counters go with them)
+    """
+    if _origin_model(origin) in (None, Category):
+        merge_category_counters(instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_cache(sender, instance, **kwargs):
+    """
+    a renamed or deleted tag must not be resolved from the cache anymore,
+    here right away and in the other processes once committed
+    """
+    tag_cache.invalidate(instance.pk)
+    if cache_is_shared():
+        transaction.on_commit(publish_tags_change)
+
+
+@receiver(pre_save, sender=Task)
+def stamp_task_change(sender, instance, **kwargs):
+    """
+    every task write takes the owner's next data version as its change_seq,
+    which also invalidates the owner's cached responses
+    """
+    if _task_signals_muted.get() or change_seq_taken_in_transaction(instance):
+        return
+    require_atomic_block()
+    instance.change_seq = next_change_seq(instance.owner_id)
+    mark_change_seq_taken(instance)
+
+
+@receiver(post_save, sender=Task)
+def save_task_change_seq(sender, instance, update_fields=None, **kwargs):
+    # a save limited to some fields didn't write the new change_seq
+    if _task_signals_muted.get() or update_fields is None or 'change_seq' in update_fields:
+        return
+    Task.objects.filter(pk=instance.pk).update(change_seq=instance.change_seq)
+
+
+@receiver(post_delete, sender=Task)
+def leave_task_tombstone(sender, instance, origin=None, **kwargs):
+    """
+    delta sync clients learn about deletions from the tombstones
+    (none when the whole user is deleted, the tombstones would go with them)
+    """
+    if _task_signals_muted.get() or _origin_model(origin) is User:
+        return
+    TaskTombstone.objects.create(
+        owner_id=instance.owner_id,
+        task_id=instance.pk,
+        change_seq=next_change_seq(instance.owner_id),
+    )
+
+
+@receiver(post_save, sender=Category)
+def stamp_category_tasks(sender, instance, created, **kwargs):
+    """
+    tasks show their category, a renamed category changes them too
+    """
     if created:
-        subject = f"New Task Created: {instance.title}"
-        message = (
-            f"Hello {instance.owner.username},\n\n"
-            f"A new task has been created for you"
-            f"Task Title: {instance.title}\n"
-            f"Status: {instance.status}\n"
-            f"Priority: {instance.priority}\n"
-            f"Description: {instance.description}\n"
-        )    
-        
+        next_change_seq(instance.owner_id)
     else:
-        subject = f"Task Updated: {instance.title}"
-        message = (
-            f"Hello {instance.owner.first_name or 'User'},\n\n"
-            f"Your task status or details have been updated.\n\n"
-            f"Title: {instance.title}\n"
-            f"Current Status: {instance.status}\n"
-            f"Current Priority: {instance.priority}"
-        )
-        
-    try:
-        send_mail(subject, message, settings.EMAIL_HOST_USER, [user_email], fail_silently=False)
-    
-    except Exception as e:
-        print(f"Error sending email to {user_email}: {e}")
\ No newline at end of file
+        stamp_tasks(instance.owner_id, Task.objects.filter(category=instance))
+
+
+@receiver(pre_delete, sender=Category)
+def stamp_uncategorized_tasks(sender, instance, origin=None, **kwargs):
+    # the tasks lose their category by a bulk SET_NULL that sends no signals
+    if _origin_model(origin) in (None, Category):
+        stamp_tasks(instance.owner_id, Task.objects.filter(category=instance))
+
+
+@receiver(m2m_changed, sender=Task.tags.through)
+def stamp_task_on_tags_change(sender, instance, action, reverse, **kwargs):
+    # tags are set after the task itself is saved, in the same transaction
+    # the change_seq of that save still covers them
+    if reverse or not action.startswith('post_') or _task_signals_muted.get():
+        return
+    if change_seq_taken_in_transaction(instance):
+        return
+    instance.change_seq = stamp_tasks(instance.owner_id, Task.objects.filter(pk=instance.pk))
+    mark_change_seq_taken(instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_data_version(sender, instance, **kwargs):
+    bump_data_version(TAGS_SCOPE)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(pre_delete, sender=Tag)
+def stamp_tagged_tasks(sender, instance, created=False, **kwargs):
+    """
+    a renamed or deleted tag changes the tasks it is on, for each of their
+    owners (pre_delete: the task links are gone after the delete)
+    """
+    if created:
+        return
+    owner_ids = Task.objects.filter(tags=instance).values_list('owner_id', flat=True).distinct()
+    for owner_id in owner_ids.order_by('owner_id'):
+        stamp_tasks(owner_id, Task.objects.filter(owner_id=owner_id, tags=instance))
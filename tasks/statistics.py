@@ -0,0 +1,294 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Category, Task, TaskCounter
+
+
+BUCKET_FIELDS = ('owner_id', 'category_id', 'status', 'priority')
+
+
+def overdue_filter(today=None):
+    """
+    Q object matching tasks that are past their due date and not done
+    """
+    today = today or timezone.localdate()
+    return Q(due_date__lt=today) & ~Q(status='done')
+
+
+def due_by_filter(until):
+    """
+    Q object matching the open tasks due on or before until, overdue ones
+    included. Written as "not done" to match the partial due date indexes.
+    """
+    return Q(due_date__lte=until) & ~Q(status='done')
+
+
+def task_bucket(values):
+    """
+    Build the counter bucket key from a task instance or a dict of its stored values
+    """
+    if isinstance(values, dict):
+        return tuple(values.get(field) for field in BUCKET_FIELDS)
+    return tuple(getattr(values, field) for field in BUCKET_FIELDS)
+
+
+# the partial unique index each kind of bucket conflicts on
+_COUNTER_CONFLICTS = {
+    True: '("owner_id", "category_id", "status", "priority") WHERE "category_id" IS NOT NULL',
+    False: '("owner_id", "status", "priority") WHERE "category_id" IS NULL',
+}
+
+# single task writes move a category's last activity at most this often
+CATEGORY_ACTIVITY_RESOLUTION = timedelta(minutes=1)
+
+
+def _upsert_counters(connection, deltas):
+    """
+    Add the deltas with one INSERT ... ON CONFLICT DO UPDATE per kind of
+    bucket (with or without a category, each has its own unique index)
+    """
+    table = connection.ops.quote_name(TaskCounter._meta.db_table)
+    for categorized, conflict in _COUNTER_CONFLICTS.items():
+        rows = [
+            (*bucket, delta) for bucket, delta in deltas.items()
+            if delta and (bucket[1] is not None) == categorized
+        ]
+        if not rows:
+            continue
+        values = ', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ("owner_id", "category_id", "status", "priority", "count") VALUES {values} '
+                f'ON CONFLICT {conflict} DO UPDATE SET "count" = {table}."count" + EXCLUDED."count"',
+                [value for row in rows for value in row],
+            )
+
+
+def bump_counter(bucket, delta):
+    """
+    Atomically add delta to a counter bucket, creating the row on first use
+    """
+    apply_counter_deltas({bucket: delta})
+
+
+def move_task_between_buckets(old_bucket, new_bucket):
+    if old_bucket == new_bucket:
+        return
+    deltas = Counter()
+    if old_bucket is not None:
+        deltas[old_bucket] -= 1
+    if new_bucket is not None:
+        deltas[new_bucket] += 1
+    apply_counter_deltas(deltas)
+
+
+def apply_counter_deltas(deltas):
+    """
+    Apply a {bucket: delta} mapping, one upsert for all the buckets on
+    PostgreSQL and SQLite, one UPDATE per bucket elsewhere
+    """
+    connection = connections[router.db_for_write(TaskCounter)]
+    if connection.vendor in ('postgresql', 'sqlite'):
+        _upsert_counters(connection, deltas)
+        return
+    for bucket, delta in deltas.items():
+        if not delta:
+            continue
+        lookup = dict(zip(BUCKET_FIELDS, bucket))
+        updated = TaskCounter.objects.filter(**lookup).update(count=F('count') + delta)
+        if updated or delta < 0:
+            continue
+        try:
+            with transaction.atomic():
+                TaskCounter.objects.create(count=delta, **lookup)
+        except IntegrityError:
+            # another request created the bucket first
+            TaskCounter.objects.filter(**lookup).update(count=F('count') + delta)
+
+
+def touch_categories(category_ids, when=None, loaded=()):
+    """
+    Move the last activity of the categories a write touched, one UPDATE.
+    The loaded categories whose last activity is more recent than
+    CATEGORY_ACTIVITY_RESOLUTION are left alone.
+    """
+    when = when or timezone.now()
+    category_ids = {category_id for category_id in category_ids if category_id is not None}
+    for category in loaded:
+        if category.last_activity_at and when - category.last_activity_at < CATEGORY_ACTIVITY_RESOLUTION:
+            category_ids.discard(category.pk)
+    if category_ids:
+        Category.objects.filter(pk__in=category_ids).update(last_activity_at=when)
+        for category in loaded:
+            if category.pk in category_ids:
+                category.last_activity_at = when
+
+
+def merge_category_counters(category):
+    """
+    Fold the counters of a category into the uncategorized buckets.
+    Called before a category is deleted, because the SET_NULL on its tasks
+    is a bulk UPDATE that does not send any Task signals.
+    """
+    apply_counter_deltas(Counter({
+        (counter.owner_id, None, counter.status, counter.priority): counter.count
+        for counter in TaskCounter.objects.filter(category=category)
+    }))
+    TaskCounter.objects.filter(category=category).delete()
+
+
+CATEGORY_ROLLUP_FIELDS = ('todo_tasks', 'in_progress_tasks', 'done_tasks', 'total_tasks', 'open_tasks', 'overdue_tasks')
+
+
+def _counter_sum(**lookups):
+    counters = (
+        TaskCounter.objects.filter(category=OuterRef('pk'), **lookups)
+        .values('category').annotate(total=Sum('count')).values('total')
+    )
+    return Coalesce(Subquery(counters, output_field=IntegerField()), Value(0))
+
+
+def annotate_category_rollups(queryset, today=None):
+    """
+    Annotate categories with their task counts by status, the open and
+    overdue counts. The counts come from the maintained counters, a few rows
+    per category; overdue depends on the date, it is counted over the
+    category's open tasks with a due date.
+    """
+    overdue = (
+        Task.objects.filter(overdue_filter(today), category=OuterRef('pk'))
+        .values('category').annotate(total=Count('id')).values('total')
+    )
+    return queryset.annotate(
+        todo_tasks=_counter_sum(status='todo'),
+        in_progress_tasks=_counter_sum(status='in_progress'),
+        done_tasks=_counter_sum(status='done'),
+        total_tasks=_counter_sum(),
+        open_tasks=_counter_sum(status__in=['todo', 'in_progress']),
+        overdue_tasks=Coalesce(Subquery(overdue, output_field=IntegerField()), Value(0)),
+    )
+
+
+def _build_payload(rows):
+    data = {
+        'total_tasks': 0,
+        'status_counts': {key: 0 for key, _ in Task.choice_status},
+        'priority_counts': {key: 0 for key, _ in Task.choice_priority},
+        'category_counts': [],
+        'overdue_tasks': 0,
+    }
+    categories = {}
+    for row in rows:
+        count = row['count']
+        if not count:
+            continue
+        data['total_tasks'] += count
+        data['status_counts'][row['status']] = data['status_counts'].get(row['status'], 0) + count
+        data['priority_counts'][row['priority']] = data['priority_counts'].get(row['priority'], 0) + count
+        entry = categories.setdefault(row['category_id'], {
+            'id': row['category_id'],
+            'name': row['category__name'],
+            'count': 0,
+        })
+        entry['count'] += count
+        data['overdue_tasks'] += row.get('overdue', 0)
+
+    # named categories first, uncategorized tasks last
+    data['category_counts'] = sorted(
+        categories.values(),
+        key=lambda entry: (entry['id'] is None, entry['name'] or '', entry['id'] or 0),
+    )
+    return data
+
+
+def compute_statistics(owner):
+    """
+    Compute every statistics bucket for a user with a single grouped aggregate
+    """
+    rows = (
+        Task.objects.filter(owner=owner)
+        .values('category_id', 'category__name', 'status', 'priority')
+        .annotate(count=Count('id'), overdue=Count('id', filter=overdue_filter()))
+        .order_by()
+    )
+    return _build_payload(rows)
+
+
+def read_statistics(owner):
+    """
+    Read a user's statistics from the maintained counters.
+    Overdue depends on the current date so it can't be a stored counter,
+    it is answered by one count over the user's open tasks instead.
+    """
+    rows = TaskCounter.objects.filter(owner=owner).values(
+        'category_id', 'category__name', 'status', 'priority', 'count'
+    )
+    data = _build_payload(rows)
+    data['overdue_tasks'] = Task.objects.filter(overdue_filter(), owner=owner).count()
+    return data
+
+
+async def aread_statistics(owner):
+    """
+    read_statistics for async views
+    """
+    rows = [
+        row async for row in TaskCounter.objects.filter(owner=owner).values(
+            'category_id', 'category__name', 'status', 'priority', 'count'
+        )
+    ]
+    data = _build_payload(rows)
+    data['overdue_tasks'] = await Task.objects.filter(overdue_filter(), owner=owner).acount()
+    return data
+
+
+def _expected_counts(owner=None):
+    tasks = Task.objects.all()
+    if owner is not None:
+        tasks = tasks.filter(owner=owner)
+    rows = tasks.values(*BUCKET_FIELDS).annotate(count=Count('id')).order_by()
+    return {task_bucket(row): row['count'] for row in rows}
+
+
+def _stored_counts(owner=None):
+    counters = TaskCounter.objects.all()
+    if owner is not None:
+        counters = counters.filter(owner=owner)
+    stored = Counter()
+    for row in counters.values(*BUCKET_FIELDS, 'count'):
+        stored[task_bucket(row)] += row['count']
+    return stored
+
+
+def find_counter_drift(owner=None):
+    """
+    Compare the counters with the real task table.
+    Returns a list of (bucket, stored, expected) for every bucket that differs.
+    """
+    expected = _expected_counts(owner)
+    stored = _stored_counts(owner)
+    drift = []
+    for bucket in set(expected) | set(stored):
+        if stored.get(bucket, 0) != expected.get(bucket, 0):
+            drift.append((bucket, stored.get(bucket, 0), expected.get(bucket, 0)))
+    return sorted(drift, key=lambda item: tuple(str(part) for part in item[0]))
+
+
+@transaction.atomic
+def rebuild_counters(owner=None):
+    """
+    Rebuild the counters from scratch, for one user or for everyone
+    """
+    counters = TaskCounter.objects.all()
+    if owner is not None:
+        counters = counters.filter(owner=owner)
+    counters.delete()
+    TaskCounter.objects.bulk_create(
+        TaskCounter(count=count, **dict(zip(BUCKET_FIELDS, bucket)))
+        for bucket, count in _expected_counts(owner).items()
+    )
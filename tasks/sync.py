@@ -0,0 +1,194 @@
+import base64
+import binascii
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.transaction import TransactionManagementError
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Task, TaskTombstone
+from .versioning import bump_data_version, get_data_version, user_scope
+
+
+SYNC_PAGE_SIZE = 200
+SYNC_MAX_PAGE_SIZE = 1000
+
+# id(instance) -> instance of the tasks stamped in the open task_write_transaction()
+_stamped_instances = ContextVar('stamped_instances', default=None)
+
+
+def next_change_seq(owner_id):
+    """
+    Sequence number for a change of owner_id's tasks, it is their next data version
+    """
+    return bump_data_version(user_scope(owner_id))
+
+
+@contextmanager
+def task_write_transaction(using=None):
+    """
+    transaction.atomic() for task writes. A task stamped in the block keeps
+    its change_seq for the rest of it (a save followed by tags.set() is one
+    change), the stamped instances are forgotten when the block commits or
+    rolls back. Also works as a decorator.
+    """
+    token = _stamped_instances.set({})
+    try:
+        with transaction.atomic(using=using):
+            yield
+    finally:
+        _stamped_instances.reset(token)
+
+
+def require_atomic_block():
+    """
+    A change_seq must be taken in the transaction of the write it stamps:
+    the owner's version row stays locked until that write commits, so a
+    delta sync can never read a version whose change isn't visible yet
+    """
+    if not transaction.get_connection(router.db_for_write(Task)).in_atomic_block:
+        raise TransactionManagementError(
+            "Task writes must run inside transaction.atomic() (see tasks.sync.task_write_transaction)."
+        )
+
+
+def mark_change_seq_taken(instance):
+    """
+    Remember that instance.change_seq was taken in the open task_write_transaction()
+    """
+    stamped = _stamped_instances.get()
+    if stamped is not None:
+        stamped[id(instance)] = instance
+
+
+def change_seq_taken_in_transaction(instance):
+    """
+    True when instance.change_seq was taken in the open task_write_transaction().
+    The owner's version row stays locked until it commits, so no reader can
+    have seen that sequence yet and the task doesn't need another one.
+    """
+    stamped = _stamped_instances.get()
+    return stamped is not None and stamped.get(id(instance)) is instance
+
+
+def stamp_tasks(owner_id, queryset):
+    """
+    Mark tasks as changed without touching them otherwise, for changes that
+    alter what they look like from the outside (category renamed, tags set)
+    """
+    # the bump and the stamp commit together
+    with transaction.atomic(using=router.db_for_write(Task)):
+        seq = next_change_seq(owner_id)
+        queryset.update(change_seq=seq)
+    return seq
+
+
+def encode_sync_token(seq, last_id=None, issued_at=None):
+    """
+    last_id is the last task sent inside seq when a page ended in the middle
+    of it, None means every change up to seq was sent. issued_at (epoch
+    seconds) is when the client was last caught up, the token expires with
+    the tombstones of the deletions that happened after it.
+    """
+    issued_at = int(time.time()) if issued_at is None else issued_at
+    return base64.urlsafe_b64encode(json.dumps([seq, last_id, issued_at]).encode()).decode()
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def decode_sync_token(token):
+    """
+    Returns (seq, last_id, issued_at), raises ValueError for anything that isn't a token
+    """
+    try:
+        seq, last_id, issued_at = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except (binascii.Error, UnicodeError, json.JSONDecodeError, TypeError, ValueError):
+        raise ValueError('Invalid sync token.')
+    # json booleans decode to bool, which is an int too
+    if not _is_int(seq) or seq < 0 or not (last_id is None or _is_int(last_id)) or not _is_int(issued_at):
+        raise ValueError('Invalid sync token.')
+    return seq, last_id, issued_at
+
+
+def tombstone_cutoff():
+    """
+    Tombstones older than this are pruned, so are the tokens issued before it
+    """
+    return timezone.now() - timedelta(days=settings.TASK_TOMBSTONE_RETENTION_DAYS)
+
+
+def prune_tombstones():
+    """
+    Delete the tombstones past the retention, returns how many
+    """
+    deleted, _ = TaskTombstone.objects.filter(deleted_at__lt=tombstone_cutoff()).delete()
+    return deleted
+
+
+def _after(seq, last_id, id_field):
+    # keyset on (change_seq, id): bulk writes stamp many rows with one seq
+    if last_id is None:
+        return Q(change_seq__gt=seq)
+    return Q(change_seq__gt=seq) | Q(change_seq=seq, **{f'{id_field}__gt': last_id})
+
+
+def read_changes(owner, since=None, limit=SYNC_PAGE_SIZE, tasks=None):
+    """
+    Tasks changed and tasks deleted after the since token, oldest change first.
+
+    Returns (tasks, deleted_ids, token, has_more, reset). Without a token
+    every task is returned, which is the initial sync. A token older than the
+    tombstone retention may have missed pruned deletions, the client gets an
+    initial sync again with reset set and must drop the tasks it holds.
+    Only changes up to the version read first are included: they are all
+    committed, so a change committed later always gets a higher sequence and
+    shows up on the next call.
+    """
+    now = int(time.time())
+    seq, last_id, issued_at = decode_sync_token(since) if since else (0, 0, now)
+    reset = issued_at < tombstone_cutoff().timestamp()
+    if reset:
+        seq, last_id, issued_at = 0, 0, now
+    # the initial sync starts before the tasks that were never changed (seq 0)
+    current, _ = get_data_version(user_scope(owner.pk))
+    tasks = Task.objects.all() if tasks is None else tasks
+
+    changed = list(
+        tasks.filter(_after(seq, last_id, 'id'), owner=owner, change_seq__lte=current)
+        .order_by('change_seq', 'id')[:limit + 1]
+    )
+    deleted = list(
+        TaskTombstone.objects.filter(_after(seq, last_id, 'task_id'), owner=owner, change_seq__lte=current)
+        .order_by('change_seq', 'task_id')
+        .values_list('change_seq', 'task_id')[:limit + 1]
+    )
+
+    # merge both streams and keep the first `limit` changes
+    merged = sorted(
+        [(task.change_seq, task.pk, task) for task in changed] + [(seq_, task_id, None) for seq_, task_id in deleted],
+        key=lambda change: (change[0], change[1], change[2] is None),
+    )
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+
+    if has_more:
+        # not caught up yet, the token keeps the time the client last was
+        token = encode_sync_token(merged[-1][0], merged[-1][1], issued_at)
+    else:
+        # caught up: everything up to the current version was sent
+        token = encode_sync_token(max(current, seq), None, now)
+    return (
+        [task for _, _, task in merged if task is not None],
+        [task_id for _, task_id, task in merged if task is None],
+        token,
+        has_more,
+        reset,
+    )
@@ -0,0 +1,144 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from config.cache import cache_is_shared
+
+from .models import Tag
+from .versioning import TAGS_SCOPE, bump_data_version, get_data_version
+
+
+class TagNameCache:
+    """
+    Bounded LRU map of tag name -> tag id, shared by the threads of one process.
+    The entries belong to one tags version: the Tag signals drop the entries
+    of a renamed or deleted tag in this process, a new version (a tag changed
+    by another process) drops all of them.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check_version(self, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def advance(self, old_version, new_version):
+        """
+        Move to new_version keeping the entries, when the only change between
+        the two versions was made by this process and needs no invalidation
+        """
+        with self._lock:
+            if self.version == old_version:
+                self.version = new_version
+
+    def get_many(self, names):
+        found = {}
+        with self._lock:
+            for name in names:
+                if name in self._entries:
+                    self._entries.move_to_end(name)
+                    found[name] = self._entries[name]
+        return found
+
+    def set_many(self, mapping, version=None):
+        with self._lock:
+            if version is not None and version != self.version:
+                # read under a version that is already gone
+                return
+            for name, tag_id in mapping.items():
+                self._entries[name] = tag_id
+                self._entries.move_to_end(name)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, tag_id):
+        with self._lock:
+            for name in [name for name, cached_id in self._entries.items() if cached_id == tag_id]:
+                del self._entries[name]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.version = None
+
+    def __len__(self):
+        return len(self._entries)
+
+
+tag_cache = TagNameCache(getattr(settings, 'TAG_NAME_CACHE_SIZE', 1024))
+
+# bumped in the shared cache after every committed tag change, so a resolve
+# that hits the cache for every name needs no query at all
+TAGS_VERSION_KEY = 'tag-names:version'
+
+
+def tags_version():
+    """
+    The version the cached names belong to. A per-process cache can't see
+    the changes of the other processes, the tags data version is read then.
+    """
+    if cache_is_shared():
+        return cache.get(TAGS_VERSION_KEY, 0)
+    return get_data_version(TAGS_SCOPE)[0]
+
+
+def publish_tags_change():
+    """
+    Called once a tag change is committed, every process drops its cached
+    names on its next resolve. Returns the new version.
+    """
+    if not cache_is_shared():
+        return get_data_version(TAGS_SCOPE)[0]
+    try:
+        return cache.incr(TAGS_VERSION_KEY)
+    except ValueError:
+        if cache.add(TAGS_VERSION_KEY, 1, timeout=None):
+            return 1
+        return cache.incr(TAGS_VERSION_KEY)
+
+
+def resolve_tags(names):
+    """
+    Turn a list of tag names into Tag instances, creating the missing ones.
+    No query when every name is cached (with a shared cache), otherwise
+    one SELECT ... IN, plus one bulk INSERT, a re-read and the tags version
+    bump when some tags are new.
+    """
+    names = list(dict.fromkeys(names))
+    version = tags_version()
+    tag_cache.check_version(version)
+    ids = tag_cache.get_many(names)
+    missing = [name for name in names if name not in ids]
+    if missing:
+        found = dict(Tag.objects.filter(name__in=missing).values_list('name', 'id'))
+        new = [name for name in missing if name not in found]
+        if new:
+            # ignore_conflicts: a concurrent request may insert the same name first
+            Tag.objects.bulk_create([Tag(name=name) for name in new], ignore_conflicts=True)
+            found.update(Tag.objects.filter(name__in=new).values_list('name', 'id'))
+            # bulk_create sends no signals, the tag list changed all the same
+            bump_data_version(TAGS_SCOPE)
+
+        def remember():
+            current = version
+            if new:
+                current = publish_tags_change()
+                # adding tags leaves the cached ids valid, unless someone
+                # else changed the tags in between
+                if current == version + 1:
+                    tag_cache.advance(version, current)
+            tag_cache.set_many(found, current)
+
+        # only cache ids that are committed, a rolled back tag must not stay cached
+        transaction.on_commit(remember)
+        ids.update(found)
+    return [Tag.from_db(DEFAULT_DB_ALIAS, ['id', 'name'], [ids[name], name]) for name in names]
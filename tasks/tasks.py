@@ -1,82 +1,377 @@
-from celery import shared_task
-from django.core.mail import send_mail, EmailMessage
+from celery import chord, shared_task
+from django.core.mail import EmailMessage, get_connection
 from django.conf import settings 
-from datetime import timedelta
+from django.db import transaction
+from datetime import date, timedelta
+from itertools import groupby
 from django.utils import timezone
-from .models import Task, User
+from .models import Task, TaskNotification, User
+from config.task_metrics import record_task_output
+from .sync import prune_tombstones
 import csv
+import gzip
 import io
+import logging
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
 
 print("celery is working")
+
+REMINDER_STREAM_CHUNK_SIZE = 2000
+REMINDER_USERS_PER_SUBTASK = 100
+REMINDER_MAX_RETRIES = 3
+# seconds before the first retry of the failed digests, doubled on each retry
+REMINDER_RETRY_DELAY = 60
+
+
+def reminder_tasks(due_date):
+    # written as "not done" to match the partial due date index
+    return (
+        Task.objects.filter(due_date=due_date)
+        .exclude(status='done')
+        .exclude(owner__email__isnull=True)
+        .exclude(owner__email='')
+    )
+
+
+def iter_reminder_digests(due_date, first_owner_id=None, last_owner_id=None):
+    """
+    stream the open tasks due on due_date with their owner joined and yield
+    one digest per user, rows come ordered by owner so a user is never split.
+    first/last_owner_id limit it to a subtask's range of owners.
+    """
+    pending_tasks = reminder_tasks(due_date)
+    if first_owner_id is not None:
+        pending_tasks = pending_tasks.filter(owner_id__gte=first_owner_id, owner_id__lte=last_owner_id)
+    pending_tasks = (
+        pending_tasks
+        .select_related('owner')
+        .only('title', 'priority', 'owner__email', 'owner__first_name', 'owner__last_name')
+        .order_by('owner_id', 'id')
+        .iterator(chunk_size=REMINDER_STREAM_CHUNK_SIZE)
+    )
+    for owner_id, tasks in groupby(pending_tasks, key=lambda task: task.owner_id):
+        tasks = list(tasks)
+        user = tasks[0].owner
+        yield {
+            'email': user.email,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'tasks': [{'title': task.title, 'priority': task.priority} for task in tasks],
+        }
+
+
+def reminder_owner_ranges(due_date):
+    """
+    (first, last) owner id of every REMINDER_USERS_PER_SUBTASK users with a
+    reminder due, read from a stream of the owner ids alone
+    """
+    owner_ids = (
+        reminder_tasks(due_date)
+        .order_by('owner_id')
+        .values_list('owner_id', flat=True)
+        .distinct()
+        .iterator(chunk_size=REMINDER_STREAM_CHUNK_SIZE)
+    )
+    ranges = []
+    for index, owner_id in enumerate(owner_ids):
+        if index % REMINDER_USERS_PER_SUBTASK == 0:
+            ranges.append((owner_id, owner_id))
+        else:
+            ranges[-1] = (ranges[-1][0], owner_id)
+    return ranges
+
+
+def build_reminder_email(digest):
+    tasks = digest['tasks']
+    if len(tasks) == 1:
+        subject = f"Reminder: '{tasks[0]['title']}' is due tomorrow"
+    else:
+        subject = f"Reminder: {len(tasks)} tasks are due tomorrow"
+    lines = "\n".join(f"- {task['title']} (Priority: {task['priority']})" for task in tasks)
+    message = (
+        f"hello {digest['first_name']} {digest['last_name']} \n\n"
+        f"this is the reminder that these tasks need to be finished by tomorrow:\n\n"
+        f"{lines}\n\n"
+        f"Good luck!"
+    )
+    return EmailMessage(subject, message, settings.EMAIL_HOST_USER, [digest['email']])
+
+
 @shared_task
 def send_daily_reminders():
+    """
+    send one reminder digest per user for the tasks due tomorrow. Every
+    subtask gets a range of REMINDER_USERS_PER_SUBTASK owners and reads their
+    digests itself, so no digest is held here, and the chord callback
+    reports the throughput of the whole run.
+    """
+    started_at = time.time()
+    tomorrow = timezone.localdate() + timedelta(days=1)
+    ranges = reminder_owner_ranges(tomorrow)
+    if not ranges:
+        return "Done! sent 0 reminder emails"
 
-    #find tommorow's date
-    tomorrow = timezone.now() + timedelta(days=1)
-
-    #find all tasks that are due tomorrow and doesnt done yet
-    pending_tasks = Task.objects.filter(due_date=tomorrow, status__in=['todo', 'in_progress'])
-
-    email_count = 0
-    
-    #send email to each user who has pending_tasks
-    for task in pending_tasks:
-        user = task.owner
-        if user.email:
-            subject = f"Reminser:'{task.title}' is due tomorrow"
-            message = (
-                f"hello {user.first_name} {user.last_name} \n\n"
-                f"this is the reminder that your task  '{task.title}'needs to be finished by tomorrow "
-                f"Priority: {task.priority}\n\n"
-                f"Good luck!"
-            )
-            send_mail(
-                subject,
-                message,
-                settings.EMAIL_HOST_USER,
-                [user.email],
-                fail_silently=False,
+    chord(send_reminder_digests.s(tomorrow.isoformat(), first, last) for first, last in ranges)(
+        report_reminder_throughput.s(started_at=started_at)
+    )
+    return f"Dispatched the reminders in {len(ranges)} subtasks"
+
+
+@shared_task(bind=True, max_retries=REMINDER_MAX_RETRIES)
+def send_reminder_digests(self, due_date, first_owner_id, last_owner_id, digests=None, sent=0, tasks=0):
+    """
+    send the reminder digests of a range of owners over a single SMTP
+    connection. The digests that fail are retried on their own with a
+    growing countdown, sent and tasks carry the counts of the earlier tries.
+    """
+    if digests is None:
+        digests = list(iter_reminder_digests(date.fromisoformat(due_date), first_owner_id, last_owner_id))
+    sent_now, tasks_now, failed = 0, 0, []
+    connection = get_connection(fail_silently=False)
+    with connection:
+        for digest in digests:
+            try:
+                sent_now += connection.send_messages([build_reminder_email(digest)]) or 0
+                tasks_now += len(digest['tasks'])
+            except Exception as e:
+                logger.warning("Error sending the reminder to %s: %s", digest['email'], e)
+                failed.append(digest)
+
+    record_task_output(rows=tasks_now, emails=sent_now)
+    sent, tasks = sent + sent_now, tasks + tasks_now
+    if failed:
+        if self.request.retries < self.max_retries:
+            raise self.retry(
+                args=[due_date, first_owner_id, last_owner_id],
+                kwargs={'digests': failed, 'sent': sent, 'tasks': tasks},
+                countdown=REMINDER_RETRY_DELAY * 2 ** self.request.retries,
             )
-            email_count +=1
-    return f"Done! sent {email_count} reminder emails"        
-    #tell celery when to run this task\
-        
+        logger.error("Gave up on %d reminder digests after %d retries", len(failed), self.max_retries)
+    return {'emails': sent, 'tasks': tasks, 'failed': len(failed)}
+
+
+@shared_task
+def report_reminder_throughput(results, started_at):
+    elapsed = max(time.time() - started_at, 1e-6)
+    emails = sum(result['emails'] for result in results)
+    tasks = sum(result['tasks'] for result in results)
+    summary = (
+        f"Done! sent {emails} reminder emails for {tasks} tasks in {elapsed:.2f}s "
+        f"({emails / elapsed:.1f} emails/sec, {tasks / elapsed:.1f} tasks/sec)"
+    )
+    logger.info(summary)
+    return summary
         
-@shared_task        
-def export_tasks_to_csv(user_id):
-    try:        
-        user = User.objects.get(id=user_id)
         
-    except User.DoesNotExist:
-        return f"User with id {user_id} does not exist"
-            
-    Tasks = Task.objects.filter(owner=user)     
-    csv_buffer = io.StringIO()  
-    writer = csv.writer(csv_buffer) 
+EXPORT_CHUNK_SIZE = 2000
+# the export stays in memory up to this size, then spills to a temp file
+EXPORT_SPOOL_MAX_SIZE = 5 * 1024 * 1024
+# larger exports are sent gzip compressed, and not attached at all above it compressed
+EXPORT_ATTACHMENT_MAX_SIZE = 10 * 1024 * 1024
+
 
+def write_tasks_csv(tasks, output, compress=False):
+    """
+    write the tasks as CSV into the binary file object output,
+    one chunk of rows (and one tags prefetch) at a time
+    """
+    if compress:
+        output = gzip.GzipFile(fileobj=output, mode='wb')
+    text = io.TextIOWrapper(output, encoding='utf-8', newline='')
+    writer = csv.writer(text)
 
-    writer.writerow(['Title', 'Description', 'Due Date', 'Status', 'Priority'])
-    for task in Tasks:
+    writer.writerow(['Title', 'Description', 'Due Date', 'Status', 'Priority', 'Category', 'Tags'])
+    rows = 0
+    for task in tasks.iterator(chunk_size=EXPORT_CHUNK_SIZE):
         writer.writerow([
             task.title,
             task.description,
             task.due_date,
             task.status,
             task.priority,
+            task.category.name if task.category else '',
+            ', '.join(tag.name for tag in task.tags.all()),
         ])
+        rows += 1
+
+    # detach so closing the wrappers doesn't close the caller's file
+    text.flush()
+    text.detach()
+    if compress:
+        output.close()
+    return rows
+
+
+@shared_task        
+def export_tasks_to_csv(user_id, compress=False):
+    try:        
+        user = User.objects.get(id=user_id)
         
+    except User.DoesNotExist:
+        return f"User with id {user_id} does not exist"
+            
+    tasks = (
+        Task.objects.filter(owner=user)
+        .select_related('category')
+        .prefetch_related('tags')
+        .order_by('id')
+    )
     email = EmailMessage(
         subject='Your Tasks Report',
         body='Attached is the CSV file containing your tasks.',
         from_email=settings.EMAIL_HOST_USER,
         to=[user.email],
+    )
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_SIZE) as export_file:
+        rows = write_tasks_csv(tasks, export_file, compress=compress)
+        if not compress and export_file.tell() > EXPORT_ATTACHMENT_MAX_SIZE:
+            # too big to mail as plain CSV, gzip usually shrinks it several times
+            compress = True
+            export_file.seek(0)
+            export_file.truncate()
+            write_tasks_csv(tasks, export_file, compress=True)
 
-    )  
-    
-    email.attach('tasks.csv', csv_buffer.getvalue(), 'text/csv')
+        # the attachment is read into memory, so it is only read under the cap
+        if export_file.tell() > EXPORT_ATTACHMENT_MAX_SIZE:
+            email.body = (
+                f"Your tasks report ({rows} tasks) is larger than "
+                f"{EXPORT_ATTACHMENT_MAX_SIZE // (1024 * 1024)}MB even compressed, "
+                f"so it could not be attached."
+            )
+        else:
+            export_file.seek(0)
+            if compress:
+                email.attach('tasks.csv.gz', export_file.read(), 'application/gzip')
+            else:
+                email.attach('tasks.csv', export_file.read(), 'text/csv')
 
     email.send()
-    return f"Done! sent the tasks report to {user.email}"
-        
-            
+    record_task_output(rows=rows, emails=1)
+    if not email.attachments:
+        return f"Refused! the tasks report ({rows} tasks) of {user.email} is too large to attach"
+    return f"Done! sent the tasks report ({rows} tasks) to {user.email}"
+
+
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_MAX_ATTEMPTS = 5
+
 
+def build_notification_email(notification):
+    """
+    render an outbox row into the email the user receives
+    """
+    user = notification.owner
+    task = notification.payload
+    if notification.event == 'batch':
+        subject = f"{task['count']} tasks {task['action']}"
+        titles = "\n".join(f"- {title}" for title in task['titles'])
+        more = task['count'] - len(task['titles'])
+        message = (
+            f"Hello {user.first_name or 'User'},\n\n"
+            f"{task['count']} of your tasks have been {task['action']}:\n\n"
+            f"{titles}\n"
+            + (f"...and {more} more\n" if more > 0 else "")
+        )
+    elif notification.event == 'created':
+        subject = f"New Task Created: {task['title']}"
+        message = (
+            f"Hello {user.username},\n\n"
+            f"A new task has been created for you"
+            f"Task Title: {task['title']}\n"
+            f"Status: {task['status']}\n"
+            f"Priority: {task['priority']}\n"
+            f"Description: {task.get('description', '')}\n"
+        )
+    else:
+        subject = f"Task Updated: {task['title']}"
+        message = (
+            f"Hello {user.first_name or 'User'},\n\n"
+            f"Your task status or details have been updated.\n\n"
+            f"Title: {task['title']}\n"
+            f"Current Status: {task['status']}\n"
+            f"Current Priority: {task['priority']}"
+        )
+    return EmailMessage(subject, message, settings.EMAIL_HOST_USER, [user.email])
+
+
+def schedule_notification_drain():
+    """
+    ask a worker to drain the outbox once the current transaction commits,
+    nothing is sent for a write that gets rolled back
+    """
+    def enqueue():
+        try:
+            send_task_notifications.delay()
+        except Exception as e:
+            # the row stays in the outbox, the periodic drain picks it up
+            logger.warning("Could not enqueue task notifications: %s", e)
+
+    transaction.on_commit(enqueue)
+
+
+def send_notification_batch(batch_size=NOTIFICATION_BATCH_SIZE):
+    """
+    send one batch of pending outbox rows over a single SMTP connection.
+    Returns (claimed, finished), rows of users without email count as finished.
+    """
+    with transaction.atomic():
+        # skip_locked lets several workers drain the outbox side by side
+        batch = list(
+            TaskNotification.objects.select_for_update(skip_locked=True, of=('self',))
+            .filter(attempts__lt=NOTIFICATION_MAX_ATTEMPTS)
+            .select_related('owner')
+            .order_by('id')[:batch_size]
+        )
+        if not batch:
+            return 0, 0
+
+        done, failed = [], []
+        connection = get_connection(fail_silently=False)
+        with connection:
+            for notification in batch:
+                if not notification.owner.email:
+                    done.append(notification.id)
+                    continue
+                try:
+                    connection.send_messages([build_notification_email(notification)])
+                    done.append(notification.id)
+                    record_task_output(emails=1)
+                except Exception as e:
+                    logger.warning("Error sending task notification %s: %s", notification.id, e)
+                    notification.attempts += 1
+                    notification.last_error = str(e)
+                    failed.append(notification)
+
+        TaskNotification.objects.filter(id__in=done).delete()
+        TaskNotification.objects.bulk_update(failed, ['attempts', 'last_error'])
+    return len(batch), len(done)
+
+
+@shared_task
+def send_task_notifications(batch_size=NOTIFICATION_BATCH_SIZE, max_batches=50):
+    """
+    drain the task email outbox in batches
+    """
+    total = 0
+    for _ in range(max_batches):
+        claimed, finished = send_notification_batch(batch_size)
+        total += finished
+        record_task_output(rows=claimed)
+        # stop on a short batch, or when the mail server keeps failing
+        if claimed < batch_size or not finished:
+            break
+    return f"Done! processed {total} task notifications"
+
+
+@shared_task
+def prune_task_tombstones():
+    """
+    drop the tombstones past TASK_TOMBSTONE_RETENTION_DAYS, the sync tokens
+    that still needed them get a full resync
+    """
+    deleted = prune_tombstones()
+    record_task_output(rows=deleted)
+    return f"Done! pruned {deleted} task tombstones"
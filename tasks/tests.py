@@ -1,9 +1,62 @@
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock, skipUnless
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+
+from asgiref.sync import async_to_sync
+
 from django.http import response
-from django.test import TestCase
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core import mail
+from django.db import connection, transaction
+from django.db.transaction import TransactionManagementError
+from django.test.utils import CaptureQueriesContext
+from django.core.management.base import CommandError
+from django.utils import timezone
 from users.models import User 
-from .models import Task
-from rest_framework.test import APITestCase
+from . import async_views
+from .models import Task, Category, Tag, TaskCounter, TaskNotification, TaskTombstone
+from .statistics import CATEGORY_ACTIVITY_RESOLUTION, compute_statistics, find_counter_drift, touch_categories
+from .search import ensure_sqlite_search_triggers
+from .tag_cache import TagNameCache, publish_tags_change, resolve_tags, tag_cache, tags_version
+from .list_cache import cache_stats, reset_cache_stats
+from .versioning import TAGS_SCOPE, bump_data_version, get_data_version, user_scope
+from .sync import encode_sync_token, task_write_transaction
+from .tasks import (
+    send_task_notifications, export_tasks_to_csv, iter_reminder_digests, reminder_owner_ranges, send_daily_reminders, send_reminder_digests, report_reminder_throughput,
+    prune_task_tombstones,
+)
+from config.celery import app as celery_app
+from config.metrics import reset_metrics
+from config.task_metrics import recent_task_runs
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+class QueryBudgetMixin:
+    """
+    assertQueryBudget fails when the block runs more queries than its budget,
+    and lists the queries so the regression is easy to find
+    """
+
+    @contextmanager
+    def assertQueryBudget(self, budget, label=''):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        executed = len(context.captured_queries)
+        if executed > budget:
+            queries = '\n'.join(f'  {query["sql"]}' for query in context.captured_queries)
+            self.fail(f"{label or 'block'} ran {executed} queries, budget is {budget}:\n{queries}")
 
 
 class TaskModelTest(TestCase):
@@ -219,4 +272,1550 @@ class TaskFilterSearchTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         
         # we check error must be because of nothing title
-        self.assertIn('title', response.data)
\ No newline at end of file
+        self.assertIn('title', response.data)
+
+class TaskStatisticsTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121111111')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/statistics/'
+        self.work = Category.objects.create(owner=self.user, name='work')
+
+    def test_statistics_follow_task_writes(self):
+        task = Task.objects.create(owner=self.user, title='a', priority='high', category=self.work)
+        Task.objects.create(owner=self.user, title='b', status='in_progress')
+        Task.objects.create(owner=self.user, title='c', status='done', priority='medium')
+
+        #update moves the task between buckets
+        task.status = 'done'
+        task.save()
+        Task.objects.get(title='b').delete()
+
+        data = self.client.get(self.url).data
+        self.assertEqual(data['total_tasks'], 2)
+        self.assertEqual(data['status_counts'], {'todo': 0, 'in_progress': 0, 'done': 2})
+        self.assertEqual(data['priority_counts'], {'low': 0, 'medium': 1, 'high': 1})
+        self.assertEqual(data, compute_statistics(self.user))
+        self.assertEqual(find_counter_drift(self.user), [])
+
+    def test_statistics_category_and_overdue(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        Task.objects.create(owner=self.user, title='late', category=self.work, due_date=yesterday)
+        Task.objects.create(owner=self.user, title='late but done', status='done', due_date=yesterday)
+        Task.objects.create(owner=self.user, title='no category')
+
+        data = self.client.get(self.url).data
+        self.assertEqual(data['overdue_tasks'], 1)
+        self.assertEqual(data['category_counts'], [
+            {'id': self.work.id, 'name': 'work', 'count': 1},
+            {'id': None, 'name': None, 'count': 2},
+        ])
+
+    def test_deleting_category_moves_counts_to_uncategorized(self):
+        Task.objects.create(owner=self.user, title='a', category=self.work)
+        self.work.delete()
+
+        data = self.client.get(self.url).data
+        self.assertEqual(data['category_counts'], [{'id': None, 'name': None, 'count': 1}])
+        self.assertEqual(find_counter_drift(self.user), [])
+
+    def test_statistics_endpoint_query_count(self):
+        for i in range(5):
+            Task.objects.create(owner=self.user, title=f'task {i}', category=self.work)
+        #one query for the counters and one for the overdue count
+        with self.assertNumQueries(2):
+            self.client.get(self.url)
+
+    def test_rebuild_command_fixes_drift(self):
+        Task.objects.create(owner=self.user, title='a')
+        #queryset updates bypass the signals
+        Task.objects.filter(owner=self.user).update(status='done')
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_task_counters', '--check', stdout=io.StringIO())
+        call_command('rebuild_task_counters', stdout=io.StringIO())
+        call_command('rebuild_task_counters', '--check', stdout=io.StringIO())
+        self.assertEqual(self.client.get(self.url).data['status_counts']['done'], 1)
+
+
+class CategoryRollupTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121414141', email='rollup@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/categories/'
+        self.work = Category.objects.create(owner=self.user, name='work')
+        self.home = Category.objects.create(owner=self.user, name='home')
+
+    def counts(self, category):
+        return self.client.get(f'{self.url}{category.id}/').data['task_counts']
+
+    def test_counts_follow_task_writes(self):
+        yesterday = timezone.localdate() - timedelta(days=1)
+        late = Task.objects.create(owner=self.user, title='late', category=self.work, due_date=yesterday)
+        Task.objects.create(owner=self.user, title='doing', status='in_progress', category=self.work)
+        Task.objects.create(owner=self.user, title='done', status='done', category=self.work, due_date=yesterday)
+        self.assertEqual(self.counts(self.work), {
+            'todo': 1, 'in_progress': 1, 'done': 1, 'total': 3, 'open': 2, 'overdue': 1,
+        })
+
+        #moving a task moves its counts too
+        late.category = self.home
+        late.save()
+        self.assertEqual(self.counts(self.work)['total'], 2)
+        self.assertEqual(self.counts(self.home), {
+            'todo': 1, 'in_progress': 0, 'done': 0, 'total': 1, 'open': 1, 'overdue': 1,
+        })
+        late.delete()
+        self.assertEqual(self.counts(self.home)['total'], 0)
+
+    def test_new_category_has_zero_counts(self):
+        response = self.client.post(self.url, {'name': 'new'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['task_counts']['total'], 0)
+        self.assertIsNone(response.data['last_activity_at'])
+
+    def test_last_activity_follows_task_writes(self):
+        self.assertIsNone(self.client.get(f'{self.url}{self.work.id}/').data['last_activity_at'])
+        task = Task.objects.create(owner=self.user, title='a', category=self.work)
+        self.work.refresh_from_db()
+        created = self.work.last_activity_at
+        self.assertIsNotNone(created)
+
+        task.category = self.home
+        task.save()
+        self.work.refresh_from_db()
+        self.home.refresh_from_db()
+        #the old and the new category both moved
+        self.assertGreater(self.work.last_activity_at, created)
+        self.assertEqual(self.home.last_activity_at, self.work.last_activity_at)
+
+    def test_recent_activity_is_not_touched_again(self):
+        task = Task.objects.create(owner=self.user, title='a', category=self.work)
+        touched = self.work.last_activity_at
+        self.assertIsNotNone(touched)
+        #the category was touched less than a minute ago, saving again skips its UPDATE
+        with self.assertNumQueries(0):
+            touch_categories({self.work.id}, loaded=[self.work])
+        task.title = 'b'
+        task.save()
+        self.work.refresh_from_db()
+        self.assertEqual(self.work.last_activity_at, touched)
+        touch_categories({self.work.id}, when=touched + CATEGORY_ACTIVITY_RESOLUTION, loaded=[self.work])
+        self.work.refresh_from_db()
+        self.assertEqual(self.work.last_activity_at, touched + CATEGORY_ACTIVITY_RESOLUTION)
+
+    def test_counter_upsert_creates_and_adds(self):
+        Task.objects.create(owner=self.user, title='a', category=self.work)
+        Task.objects.create(owner=self.user, title='b', category=self.work)
+        Task.objects.create(owner=self.user, title='c')
+        self.assertEqual(TaskCounter.objects.get(category=self.work, status='todo').count, 2)
+        self.assertEqual(TaskCounter.objects.get(owner=self.user, category=None, status='todo').count, 1)
+        self.assertEqual(find_counter_drift(self.user), [])
+
+    def test_bulk_writes_update_rollups(self):
+        bulk = '/api/tasks/bulk/'
+        response = self.client.post(bulk, [
+            {'title': f'bulk {i}', 'description': 'd', 'category_id': self.work.id} for i in range(3)
+        ], format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.counts(self.work)['todo'], 3)
+
+        self.client.post(f'/api/tasks/transition/?category={self.work.id}', {'status': 'done'}, format='json')
+        self.assertEqual(self.counts(self.work)['done'], 3)
+
+        self.client.delete(bulk, {'ids': [response.data[0]['id']]}, format='json')
+        self.assertEqual(self.counts(self.work)['total'], 2)
+        self.work.refresh_from_db()
+        self.assertIsNotNone(self.work.last_activity_at)
+
+    def test_deleting_category_sets_tasks_uncategorized(self):
+        Task.objects.create(owner=self.user, title='a', category=self.work)
+        self.work.delete()
+        self.assertEqual(find_counter_drift(self.user), [])
+        self.assertEqual([category['name'] for category in self.client.get(self.url).data['results']], ['home'])
+
+    def test_ordering_by_rollups(self):
+        for i in range(2):
+            Task.objects.create(owner=self.user, title=f'home {i}', category=self.home)
+        Task.objects.create(owner=self.user, title='work', category=self.work, status='done')
+
+        def names(ordering):
+            return [category['name'] for category in self.client.get(self.url, {'ordering': ordering}).data['results']]
+
+        self.assertEqual(names('-open_tasks'), ['home', 'work'])
+        self.assertEqual(names('open_tasks'), ['work', 'home'])
+        self.assertEqual(names('-done_tasks'), ['work', 'home'])
+        self.assertEqual(names('name'), ['home', 'work'])
+        #unknown fields fall back to the newest first
+        self.assertEqual(names('password'), ['home', 'work'])
+
+    def test_list_query_count_does_not_grow(self):
+        for i in range(5):
+            category = Category.objects.create(owner=self.user, name=f'c{i}')
+            Task.objects.create(owner=self.user, title=f't{i}', category=category)
+        #data version, count and the annotated page
+        with self.assertNumQueries(3):
+            self.client.get(self.url)
+
+    def test_etag_changes_with_the_day(self):
+        first = self.client.get(self.url)
+        again = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        #a task becomes overdue at midnight without any write
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        with mock.patch('tasks.versioning.timezone.localdate', return_value=tomorrow):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+
+
+class TaskDueDateTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121515151', email='agenda@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/'
+        self.today = timezone.localdate()
+        day = lambda offset: self.today + timedelta(days=offset)
+        Task.objects.create(owner=self.user, title='late', due_date=day(-2))
+        Task.objects.create(owner=self.user, title='late but done', status='done', due_date=day(-1))
+        Task.objects.create(owner=self.user, title='today', due_date=day(0), priority='low')
+        Task.objects.create(owner=self.user, title='today urgent', due_date=day(0), priority='high')
+        Task.objects.create(owner=self.user, title='next week', due_date=day(7), status='in_progress')
+        Task.objects.create(owner=self.user, title='someday')
+        Task.objects.create(owner=User.objects.create(phone_number='09121515152'), title='not mine', due_date=day(-2))
+
+    def titles(self, params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(task['title'] for task in response.data['results'])
+
+    def test_due_date_filters(self):
+        self.assertEqual(self.titles({'overdue': 'true'}), ['late'])
+        self.assertEqual(
+            self.titles({'overdue': 'false'}),
+            ['late but done', 'next week', 'someday', 'today', 'today urgent'],
+        )
+        self.assertEqual(self.titles({'due_before': self.today.isoformat()}), ['late', 'late but done', 'today', 'today urgent'])
+        self.assertEqual(
+            self.titles({'due_after': self.today.isoformat(), 'due_before': (self.today + timedelta(days=7)).isoformat()}),
+            ['next week', 'today', 'today urgent'],
+        )
+        response = self.client.get(self.url, {'due_before': 'soon'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_overdue_list_changes_with_the_day(self):
+        first = self.client.get(self.url, {'overdue': 'true'})
+        self.assertEqual(len(first.data['results']), 1)
+        tomorrow = self.today + timedelta(days=1)
+        #neither the etag nor the cached page outlive the day
+        with mock.patch('django.utils.timezone.localdate', return_value=tomorrow):
+            response = self.client.get(self.url, {'overdue': 'true'}, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(task['title'] for task in response.data['results']), ['late', 'today', 'today urgent'])
+
+        #the other lists keep their validators
+        plain = self.client.get(self.url)
+        with mock.patch('django.utils.timezone.localdate', return_value=tomorrow):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=plain['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_agenda(self):
+        response = self.client.get(f'{self.url}agenda/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual((data['today'], data['until']), (self.today, self.today + timedelta(days=6)))
+        self.assertEqual([task['title'] for task in data['overdue']], ['late'])
+        self.assertEqual(
+            [(day['date'], [task['title'] for task in day['tasks']]) for day in data['days']],
+            [(self.today, ['today urgent', 'today'])],
+        )
+        self.assertFalse(data['has_more'])
+
+        data = self.client.get(f'{self.url}agenda/', {'days': 8}).data
+        self.assertEqual([day['date'] for day in data['days']], [self.today, self.today + timedelta(days=7)])
+
+        for days in ('0', '32', 'week'):
+            response = self.client.get(f'{self.url}agenda/', {'days': days})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_agenda_is_capped(self):
+        with mock.patch('tasks.agenda.AGENDA_MAX_TASKS', 2):
+            data = self.client.get(f'{self.url}agenda/').data
+        self.assertTrue(data['has_more'])
+        self.assertEqual(len(data['overdue']) + sum(len(day['tasks']) for day in data['days']), 2)
+
+    def test_agenda_query_count(self):
+        #data version, tasks and their tags
+        with self.assertNumQueries(3):
+            response = self.client.get(f'{self.url}agenda/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_agenda_revalidates(self):
+        first = self.client.get(f'{self.url}agenda/')
+        again = self.client.get(f'{self.url}agenda/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(again.status_code, status.HTTP_304_NOT_MODIFIED)
+        Task.objects.create(owner=self.user, title='new', due_date=self.today)
+        response = self.client.get(f'{self.url}agenda/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TaskCursorPaginationTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09122222222')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/'
+        priorities = ['low', 'medium', 'high']
+        for i in range(25):
+            Task.objects.create(owner=self.user, title=f'task {i}', priority=priorities[i % 3])
+        #give half of the tasks the same timestamp to exercise the tie-breaker
+        same_time = timezone.now()
+        Task.objects.filter(owner=self.user, id__in=Task.objects.values('id')[:12]).update(created_at=same_time)
+
+    def walk(self, url):
+        ids, pages = [], 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids += [task['id'] for task in response.data['results']]
+            url = response.data['next']
+            pages += 1
+        return ids, pages
+
+    def test_cursor_pages_match_every_ordering(self):
+        for ordering in ['-created_at', 'created_at', 'priority', '-priority']:
+            expected = []
+            page_url = f'{self.url}?ordering={ordering}&page=1'
+            while page_url:
+                response = self.client.get(page_url)
+                expected += [task['id'] for task in response.data['results']]
+                page_url = response.data['next']
+
+            ids, pages = self.walk(f'{self.url}?ordering={ordering}&pagination=cursor')
+            self.assertEqual(sorted(ids), sorted(expected), ordering)
+            self.assertEqual(len(set(ids)), 25, ordering)
+            self.assertEqual(pages, 3)
+
+    def test_previous_link_returns_same_page(self):
+        first = self.client.get(f'{self.url}?ordering=priority&pagination=cursor').data
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).data
+        back = self.client.get(second['previous']).data
+        self.assertEqual(back['results'], first['results'])
+        self.assertIsNone(back['previous'])
+
+    def test_cursor_page_runs_no_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f'{self.url}?pagination=cursor')
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+    def test_invalid_cursor(self):
+        response = self.client.get(f'{self.url}?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_tampered_cursor_positions(self):
+        from base64 import urlsafe_b64encode
+
+        def cursor(position):
+            return urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+
+        #the default ordering is -created_at then -pk
+        valid = self.client.get(f'{self.url}?cursor={cursor([timezone.now().isoformat(), 1000])}')
+        self.assertEqual(valid.status_code, status.HTTP_200_OK)
+        for position in (
+            ['notadate', 3],
+            [{'a': 1}, 3],
+            [timezone.now().isoformat(), 'three'],
+            [timezone.now().isoformat(), True],
+            [timezone.now().isoformat(), None],
+            [timezone.now().isoformat(), [3]],
+            [timezone.now().isoformat()],
+            [timezone.now().isoformat(), 3, 4],
+            'notalist',
+        ):
+            response = self.client.get(f'{self.url}?cursor={cursor(position)}')
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+
+    def test_page_numbers_stay_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['count'], 25)
+
+
+class EndpointQueryBudgetTest(QueryBudgetMixin, APITestCase):
+    """
+    every endpoint has a fixed query budget, it must not grow with the number of rows
+    """
+    budgets = {
+        'task-list': 4,
+        'task-detail': 3,
+        #category, savepoint, version bump, insert, outbox, counter upsert, tags version,
+        #tag lookup, current tags, existing links, link insert, release, response tags
+        'task-create': 13,
+        #task, tags prefetch, savepoint, version bump, update, outbox, tags version, tag lookup,
+        #current tags, unlink, existing links, link insert, release, response tags
+        'task-update': 14,
+        #task, tags prefetch, savepoint, unlink tags, delete, counter upsert, version bump,
+        #tombstone, release
+        'task-delete': 9,
+        #savepoint, task, tags prefetch, version bump, update, outbox, counter upsert, release
+        'task-complete': 8,
+        'task-statistics': 2,
+        'category-list': 3,
+        'category-detail': 2,
+        'tag-list-create': 3,
+    }
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09123333333', email='budget@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(owner=self.user, name='work')
+        self.tags = [Tag.objects.create(name=f'tag{i}') for i in range(3)]
+
+    def seed(self, count):
+        for i in range(count):
+            task = Task.objects.create(owner=self.user, title=f'task {i}', category=self.category)
+            task.tags.set(self.tags[:i % 3 + 1])
+        return task
+
+    def check_endpoints(self):
+        task = Task.objects.filter(owner=self.user).last()
+        calls = {
+            'task-list': lambda: self.client.get('/api/tasks/'),
+            'task-detail': lambda: self.client.get(f'/api/tasks/{task.id}/'),
+            'task-create': lambda: self.client.post('/api/tasks/', {
+                'title': 'new', 'description': 'd', 'category_id': self.category.id, 'tags': ['tag0', 'tag1'],
+            }, format='json'),
+            'task-update': lambda: self.client.patch(f'/api/tasks/{task.id}/', {'title': 'edited', 'tags': ['tag2']}, format='json'),
+            'task-complete': lambda: self.client.post(f'/api/tasks/{task.id}/complete/'),
+            'task-statistics': lambda: self.client.get('/api/tasks/statistics/'),
+            'category-list': lambda: self.client.get('/api/categories/'),
+            'category-detail': lambda: self.client.get(f'/api/categories/{self.category.id}/'),
+            'tag-list-create': lambda: self.client.get('/api/tags/'),
+            'task-delete': lambda: self.client.delete(f'/api/tasks/{task.id}/'),
+        }
+        for name, call in calls.items():
+            with self.assertQueryBudget(self.budgets[name], name):
+                response = call()
+            self.assertLess(response.status_code, 300, name)
+
+    def test_budgets_with_one_row(self):
+        self.seed(1)
+        self.check_endpoints()
+
+    def test_budgets_with_many_rows(self):
+        self.seed(30)
+        self.check_endpoints()
+
+
+class TagResolutionTest(QueryBudgetMixin, APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09124444444')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/'
+        tag_cache.clear()
+        self.addCleanup(tag_cache.clear)
+
+    def test_create_task_with_tags(self):
+        Tag.objects.create(name='old')
+        data = {'title': 'tagged', 'description': 'd', 'tags': ['old', 'new', 'new']}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(sorted(response.data['tags']), ['new', 'old'])
+        self.assertEqual(Tag.objects.count(), 2)
+
+    def test_rejected_create_leaves_no_tags(self):
+        version = get_data_version(TAGS_SCOPE)
+        response = self.client.post(self.url, {'title': '', 'description': 'd', 'tags': ['orphan']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        #validation only checks the names, nothing is written
+        self.assertFalse(Tag.objects.exists())
+        self.assertEqual(get_data_version(TAGS_SCOPE), version)
+
+    def test_tags_resolved_in_one_pass(self):
+        Tag.objects.bulk_create([Tag(name=f'existing{i}') for i in range(10)])
+        bump_data_version(TAGS_SCOPE)
+        names = [f'existing{i}' for i in range(10)] + [f'fresh{i}' for i in range(10)]
+        #tags version, select existing, insert missing, re-read the inserted ones, bump the tags version
+        with self.assertNumQueries(5):
+            tags = resolve_tags(names)
+        self.assertEqual([tag.name for tag in tags], names)
+        self.assertEqual(Tag.objects.count(), 20)
+
+    def shared_cache(self):
+        cache.clear()
+        for target in ('tasks.tag_cache.cache_is_shared', 'tasks.signals.cache_is_shared'):
+            patcher = mock.patch(target, return_value=True)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_cached_tags_skip_database(self):
+        self.shared_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            resolve_tags(['hot'])
+        #the tags version comes from the shared cache
+        with self.assertNumQueries(0):
+            tags = resolve_tags(['hot'])
+        self.assertEqual(tags[0].id, Tag.objects.get(name='hot').id)
+
+    def test_shared_version_drops_the_cache(self):
+        self.shared_cache()
+        with self.captureOnCommitCallbacks(execute=True):
+            old = resolve_tags(['shared'])[0]
+        #another process renames the tag and publishes the change
+        Tag.objects.filter(pk=old.pk).update(name='renamed')
+        publish_tags_change()
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = resolve_tags(['shared'])[0]
+        self.assertNotEqual(tag.id, old.id)
+
+    def test_tag_rename_is_published(self):
+        self.shared_cache()
+        tag = Tag.objects.create(name='before')
+        version = tags_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = 'after'
+            tag.save()
+        self.assertEqual(tags_version(), version + 1)
+
+    def test_cache_dropped_when_another_process_changes_tags(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            old = resolve_tags(['shared'])[0]
+        #another process renames the tag: no signal here, only its version bump
+        Tag.objects.filter(pk=old.pk).update(name='renamed')
+        bump_data_version(TAGS_SCOPE)
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = resolve_tags(['shared'])[0]
+        self.assertNotEqual(tag.id, old.id)
+        self.assertEqual(Tag.objects.get(pk=tag.id).name, 'shared')
+
+    def test_cache_dropped_on_rename(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = resolve_tags(['before'])[0]
+        tag.name = 'after'
+        tag.save()
+        self.assertEqual(tag_cache.get_many(['before']), {})
+
+    def test_cache_is_bounded(self):
+        cache = TagNameCache(max_size=2)
+        cache.set_many({'a': 1, 'b': 2})
+        cache.get_many(['a'])
+        cache.set_many({'c': 3})
+        self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+
+    def test_invalid_tag_name(self):
+        data = {'title': 'tagged', 'description': 'd', 'tags': ['x' * 51]}
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', response.data)
+
+
+class TaskNotificationOutboxTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09125555555', email='outbox@example.com', username='outbox')
+        self.client.force_authenticate(user=self.user)
+
+    def test_write_goes_to_outbox_not_smtp(self):
+        with mock.patch('tasks.tasks.send_task_notifications.delay') as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/tasks/', {'title': 'a', 'description': 'd'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(mail.outbox), 0)
+        notification = TaskNotification.objects.get()
+        self.assertEqual(notification.event, 'created')
+        self.assertEqual(notification.payload['title'], 'a')
+        delay.assert_called_once()
+
+    def test_rolled_back_write_leaves_no_notification(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                Task.objects.create(owner=self.user, title='a', description='d')
+                raise RuntimeError
+        self.assertFalse(TaskNotification.objects.exists())
+
+    def test_worker_sends_and_clears_outbox(self):
+        task = Task.objects.create(owner=self.user, title='a', description='d')
+        task.status = 'done'
+        task.save()
+        no_email = User.objects.create(phone_number='09125555556')
+        Task.objects.create(owner=no_email, title='b', description='d')
+
+        result = send_task_notifications()
+        self.assertEqual(result, "Done! processed 3 task notifications")
+        self.assertEqual([email.subject for email in mail.outbox], ['New Task Created: a', 'Task Updated: a'])
+        self.assertFalse(TaskNotification.objects.exists())
+
+    def test_failed_send_is_retried_later(self):
+        Task.objects.create(owner=self.user, title='a', description='d')
+        with mock.patch('tasks.tasks.build_notification_email', side_effect=OSError('smtp down')):
+            send_task_notifications()
+        notification = TaskNotification.objects.get()
+        self.assertEqual(notification.attempts, 1)
+        self.assertEqual(notification.last_error, 'smtp down')
+
+        send_task_notifications()
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(TaskNotification.objects.exists())
+
+
+class DailyReminderTest(TestCase):
+
+    def setUp(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        self.tomorrow = timezone.localdate() + timedelta(days=1)
+
+    def test_one_digest_per_user(self):
+        busy = User.objects.create(phone_number='09126666661', email='busy@example.com')
+        calm = User.objects.create(phone_number='09126666662', email='calm@example.com')
+        no_email = User.objects.create(phone_number='09126666663')
+        for i in range(3):
+            Task.objects.create(owner=busy, title=f'busy {i}', due_date=self.tomorrow)
+        Task.objects.create(owner=busy, title='finished', due_date=self.tomorrow, status='done')
+        Task.objects.create(owner=calm, title='calm', due_date=self.tomorrow, status='in_progress')
+        Task.objects.create(owner=calm, title='later', due_date=self.tomorrow + timedelta(days=1))
+        Task.objects.create(owner=no_email, title='nobody', due_date=self.tomorrow)
+
+        #owner is joined, so streaming the digests is a single query
+        with self.assertNumQueries(1):
+            digests = list(iter_reminder_digests(self.tomorrow))
+        self.assertEqual([len(digest['tasks']) for digest in digests], [3, 1])
+
+        mail.outbox = []
+        with mock.patch('tasks.tasks.REMINDER_USERS_PER_SUBTASK', 1):
+            send_daily_reminders()
+        subjects = sorted((email.to[0], email.subject) for email in mail.outbox)
+        self.assertEqual(subjects, [
+            ('busy@example.com', 'Reminder: 3 tasks are due tomorrow'),
+            ('calm@example.com', "Reminder: 'calm' is due tomorrow"),
+        ])
+
+    def test_failed_digest_is_retried_alone(self):
+        users = [User.objects.create(phone_number=f'0912666668{i}', email=f'user{i}@example.com') for i in range(3)]
+        for user in users:
+            Task.objects.create(owner=user, title=user.email, due_date=self.tomorrow)
+        calls = []
+        real_send = mail.get_connection().__class__.send_messages
+
+        def flaky_send(connection, messages):
+            calls.append(messages[0].to[0])
+            #the second user fails on the first attempt only
+            if calls.count('user1@example.com') == 1 and messages[0].to[0] == 'user1@example.com':
+                raise OSError('connection reset')
+            return real_send(connection, messages)
+
+        mail.outbox = []
+        with mock.patch.object(mail.get_connection().__class__, 'send_messages', flaky_send):
+            result = send_reminder_digests.delay(self.tomorrow.isoformat(), users[0].pk, users[-1].pk).get()
+        self.assertEqual(calls, ['user0@example.com', 'user1@example.com', 'user2@example.com', 'user1@example.com'])
+        self.assertEqual(sorted(email.to[0] for email in mail.outbox), [f'user{i}@example.com' for i in range(3)])
+        #the retry adds its counts to the first try's
+        self.assertEqual(result, {'emails': 3, 'tasks': 3, 'failed': 0})
+
+    def test_subtasks_get_owner_ranges(self):
+        users = [User.objects.create(phone_number=f'0912666670{i}', email=f'stream{i}@example.com') for i in range(5)]
+        for user in users:
+            Task.objects.create(owner=user, title=user.email, due_date=self.tomorrow)
+            Task.objects.create(owner=user, title='second', due_date=self.tomorrow)
+
+        with mock.patch('tasks.tasks.REMINDER_USERS_PER_SUBTASK', 2):
+            #only the owner ids are read
+            with self.assertNumQueries(1):
+                ranges = reminder_owner_ranges(self.tomorrow)
+            self.assertEqual(ranges, [(users[0].pk, users[1].pk), (users[2].pk, users[3].pk), (users[4].pk, users[4].pk)])
+            with mock.patch('tasks.tasks.report_reminder_throughput.run', return_value='report') as report:
+                self.assertEqual(send_daily_reminders(), 'Dispatched the reminders in 3 subtasks')
+        #the chord callback sums every subtask
+        results = report.call_args.args[0]
+        self.assertEqual(sum(result['emails'] for result in results), 5)
+        self.assertEqual(sum(result['tasks'] for result in results), 10)
+
+    def test_throughput_report(self):
+        summary = report_reminder_throughput(
+            [{'emails': 2, 'tasks': 5, 'seconds': 0.1}, {'emails': 1, 'tasks': 1, 'seconds': 0.1}],
+            started_at=time.time() - 2,
+        )
+        self.assertTrue(summary.startswith('Done! sent 3 reminder emails for 6 tasks'))
+        self.assertIn('emails/sec', summary)
+
+
+class ExportTasksTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09127777777', email='export@example.com')
+        category = Category.objects.create(owner=self.user, name='work')
+        tags = [Tag.objects.create(name='a'), Tag.objects.create(name='b')]
+        for i in range(5):
+            task = Task.objects.create(owner=self.user, title=f'task {i}', description='d', category=category)
+            task.tags.set(tags)
+        Task.objects.create(owner=self.user, title='loose', description='d')
+        mail.outbox = []
+
+    def read_rows(self, content):
+        return list(csv.reader(io.StringIO(content)))
+
+    def test_export_includes_category_and_tags(self):
+        #user, tasks with category, one tags prefetch for the chunk
+        with self.assertNumQueries(3):
+            export_tasks_to_csv(self.user.id)
+        name, content, mimetype = mail.outbox[0].attachments[0]
+        self.assertEqual((name, mimetype), ('tasks.csv', 'text/csv'))
+        rows = self.read_rows(content)
+        self.assertEqual(rows[0][-2:], ['Category', 'Tags'])
+        self.assertEqual(len(rows), 7)
+        self.assertEqual(rows[1][-2:], ['work', 'a, b'])
+        self.assertEqual(rows[-1][-2:], ['', ''])
+
+    def test_export_compressed(self):
+        export_tasks_to_csv(self.user.id, compress=True)
+        name, content, mimetype = mail.outbox[0].attachments[0]
+        self.assertEqual((name, mimetype), ('tasks.csv.gz', 'application/gzip'))
+        rows = self.read_rows(gzip.decompress(content).decode())
+        self.assertEqual(len(rows), 7)
+
+    def test_large_export_is_compressed(self):
+        #the plain csv is a few hundred bytes, gzip brings it under the cap
+        with mock.patch('tasks.tasks.EXPORT_ATTACHMENT_MAX_SIZE', 200):
+            export_tasks_to_csv(self.user.id)
+        name, content, mimetype = mail.outbox[0].attachments[0]
+        self.assertEqual((name, mimetype), ('tasks.csv.gz', 'application/gzip'))
+        self.assertEqual(len(self.read_rows(gzip.decompress(content).decode())), 7)
+
+    def test_too_large_export_is_not_attached(self):
+        with mock.patch('tasks.tasks.EXPORT_ATTACHMENT_MAX_SIZE', 10):
+            result = export_tasks_to_csv(self.user.id)
+        self.assertTrue(result.startswith('Refused!'))
+        self.assertEqual(mail.outbox[0].attachments, [])
+        self.assertIn('could not be attached', mail.outbox[0].body)
+
+    def test_export_endpoint_passes_compress(self):
+        self.client.force_authenticate(user=self.user)
+        with mock.patch('tasks.views.export_tasks_to_csv.delay') as delay:
+            response = self.client.post('/api/export-tasks/', {'compress': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        delay.assert_called_once_with(self.user.id, compress=True)
+
+
+class BenchmarkTaskQueriesCommandTest(TestCase):
+
+    def test_benchmark_reports_and_rolls_back(self):
+        out = io.StringIO()
+        call_command('benchmark_task_queries', users=2, tasks_per_user=20, repeat=1, stdout=out)
+        self.assertIn('task_owner_created_idx', out.getvalue())
+        self.assertIn('Median time per query', out.getvalue())
+        self.assertFalse(Task.objects.exists())
+
+
+class EndpointBenchmarkTest(TestCase):
+
+    def run_benchmark(self, *args):
+        out = io.StringIO()
+        call_command(
+            'benchmark_endpoints', '--users', '3', '--tasks-per-user', '30', '--tags', '5',
+            '--iterations', '2', '--warmup', '0', *args, stdout=out, stderr=io.StringIO(),
+        )
+        return out.getvalue()
+
+    def test_baseline_and_compare(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'baseline.json')
+        out = self.run_benchmark('--output', path)
+        self.assertFalse(Task.objects.exists())
+        with open(path) as f:
+            baseline = json.load(f)
+        self.assertEqual(
+            set(baseline['results']),
+            {'list', 'search', 'ordering', 'statistics', 'create', 'export', 'reminders'},
+        )
+        for metrics in baseline['results'].values():
+            self.assertEqual(set(metrics), {'p50_ms', 'p95_ms', 'queries', 'peak_kb'})
+            self.assertGreater(metrics['queries'], 0)
+        self.assertIn('search', out)
+
+        # one query less in the baseline than the code runs now, the huge
+        # tolerance keeps the timings of two tiny runs out of it
+        baseline['results']['statistics']['queries'] -= 1
+        with open(path, 'w') as f:
+            json.dump(baseline, f)
+        with self.assertRaisesMessage(CommandError, '1 regression(s)'):
+            self.run_benchmark('--baseline', path, '--scenario', 'statistics', '--tolerance', '1000')
+
+    def test_compare_ignores_jitter(self):
+        from .benchmarks import compare_results
+
+        before = {'list': {'p50_ms': 1.0, 'p95_ms': 2.0, 'queries': 4, 'peak_kb': 100.0}}
+        # 40% slower but only 0.4ms
+        jitter = {'list': {'p50_ms': 1.4, 'p95_ms': 2.0, 'queries': 4, 'peak_kb': 100.0}}
+        self.assertEqual(compare_results(jitter, before), [])
+        slower = {'list': {'p50_ms': 3.0, 'p95_ms': 2.0, 'queries': 4, 'peak_kb': 100.0}}
+        self.assertEqual(compare_results(slower, before), [('list', 'p50_ms', 1.0, 3.0)])
+
+
+class DatabaseConnectionReuseTest(TestCase):
+
+    def test_connection_benchmark(self):
+        out = io.StringIO()
+        call_command('benchmark_db_connections', requests=5, queries=1, stdout=out)
+        for mode in ('new connection', 'persistent', 'persistent + checks'):
+            self.assertIn(mode, out.getvalue())
+
+
+class TaskFullTextSearchTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09128888888')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/'
+        self.in_description = Task.objects.create(owner=self.user, title='errands', description='buy milk and bread')
+        self.in_title = Task.objects.create(owner=self.user, title='buy milk', description='from the shop')
+        Task.objects.create(owner=self.user, title='gym', description='leg day')
+        other = User.objects.create(phone_number='09128888889')
+        Task.objects.create(owner=other, title='buy milk', description='not mine')
+
+    def titles(self, query):
+        response = self.client.get(f'{self.url}?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [task['title'] for task in response.data['results']]
+
+    def test_search_ranks_title_matches_first(self):
+        self.assertEqual(self.titles('search=milk'), ['buy milk', 'errands'])
+
+    def test_search_matches_word_prefixes(self):
+        self.assertEqual(self.titles('search=brea'), ['errands'])
+        self.assertEqual(self.titles('search=buy gym'), [])
+
+    def test_search_index_follows_updates(self):
+        self.in_title.title = 'call mom'
+        self.in_title.save()
+        self.in_description.delete()
+        self.assertEqual(self.titles('search=milk'), [])
+        self.assertEqual(self.titles('search=mom'), ['call mom'])
+
+    def test_query_syntax_is_ignored(self):
+        self.assertEqual(self.titles('search=milk"* OR (gym'), [])
+        #nothing left to match on, falls back to a plain contains search
+        self.assertEqual(self.titles('search=*'), [])
+
+    def test_explicit_ordering_wins(self):
+        self.assertEqual(self.titles('search=milk&ordering=created_at'), ['errands', 'buy milk'])
+
+    def test_search_with_cursor_pagination(self):
+        self.assertEqual(self.titles('search=milk&pagination=cursor'), ['buy milk', 'errands'])
+
+    @skipUnless(connection.vendor == 'sqlite', 'the FTS5 triggers only exist on SQLite')
+    def test_missing_triggers_are_restored(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER tasks_task_fts_ai')
+        Task.objects.create(owner=self.user, title='unindexed yoga', description='d')
+        ensure_sqlite_search_triggers(connection)
+        self.assertEqual(self.titles('search=yoga'), ['unindexed yoga'])
+
+
+class TaskPriorityRankTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09129999990')
+        self.client.force_authenticate(user=self.user)
+
+    def test_rank_follows_priority(self):
+        task = Task.objects.create(owner=self.user, title='a', priority='medium')
+        task.refresh_from_db()
+        self.assertEqual(task.priority_rank, 2)
+        #computed by the database, so bulk updates can't leave it stale
+        Task.objects.filter(pk=task.pk).update(priority='high')
+        task.refresh_from_db()
+        self.assertEqual(task.priority_rank, 3)
+
+    def test_priority_ordering(self):
+        for title, priority in [('l', 'low'), ('h', 'high'), ('m', 'medium')]:
+            Task.objects.create(owner=self.user, title=title, priority=priority)
+        response = self.client.get('/api/tasks/?ordering=-priority')
+        self.assertEqual([task['title'] for task in response.data['results']], ['h', 'm', 'l'])
+        self.assertNotIn('priority_rank', response.data['results'][0])
+        response = self.client.get('/api/tasks/?ordering=priority')
+        self.assertEqual([task['title'] for task in response.data['results']], ['l', 'm', 'h'])
+
+
+class TaskBulkEndpointTest(QueryBudgetMixin, APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121212121', email='bulk@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/bulk/'
+        self.category = Category.objects.create(owner=self.user, name='work')
+        tag_cache.clear()
+        self.addCleanup(tag_cache.clear)
+
+    def payload(self, count):
+        return [
+            {'title': f'bulk {i}', 'description': 'd', 'priority': 'high',
+             'category_id': self.category.id, 'tags': ['shared', f'own{i}']}
+            for i in range(count)
+        ]
+
+    def test_bulk_create(self):
+        response = self.client.post(self.url, self.payload(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([task['title'] for task in response.data], ['bulk 0', 'bulk 1', 'bulk 2'])
+        self.assertEqual(sorted(response.data[0]['tags']), ['own0', 'shared'])
+        self.assertEqual(response.data[0]['category']['name'], 'work')
+        self.assertEqual(find_counter_drift(self.user), [])
+        #one coalesced notification for the whole batch
+        notification = TaskNotification.objects.get()
+        self.assertEqual((notification.event, notification.payload['count']), ('batch', 3))
+        send_task_notifications()
+        self.assertEqual([email.subject for email in mail.outbox], ['3 tasks created'])
+
+    def test_bulk_create_query_count_is_constant(self):
+        self.client.post(self.url, self.payload(2), format='json')
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(self.url, self.payload(5), format='json')
+        with CaptureQueriesContext(connection) as many:
+            self.client.post(self.url, self.payload(50), format='json')
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def test_bulk_create_is_all_or_nothing(self):
+        payload = self.payload(2)
+        payload[1]['title'] = ''
+        payload[0]['category_id'] = Category.objects.create(
+            owner=User.objects.create(phone_number='09121212122'), name='not mine'
+        ).id
+        response = self.client.post(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('category_id', response.data[0])
+        self.assertIn('title', response.data[1])
+        self.assertFalse(Task.objects.exists())
+
+    def test_bulk_update(self):
+        tasks = [Task.objects.create(owner=self.user, title=f't{i}', description='d') for i in range(3)]
+        payload = [
+            {'id': tasks[0].id, 'status': 'done', 'tags': ['x']},
+            {'id': tasks[1].id, 'title': 'renamed', 'category_id': self.category.id},
+        ]
+        response = self.client.patch(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['status'], 'done')
+        self.assertEqual(response.data[0]['tags'], ['x'])
+        self.assertEqual(response.data[1]['title'], 'renamed')
+        self.assertEqual(response.data[1]['category']['id'], self.category.id)
+        tasks[2].refresh_from_db()
+        self.assertEqual(tasks[2].status, 'todo')
+        self.assertEqual(find_counter_drift(self.user), [])
+
+    def test_bulk_update_unknown_task(self):
+        other = Task.objects.create(owner=User.objects.create(phone_number='09121212123'), title='x')
+        response = self.client.patch(self.url, [{'id': other.id, 'title': 'stolen'}], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {'id': ['Task not found.']})
+
+    def test_bulk_update_rejects_bad_and_duplicate_ids(self):
+        task = Task.objects.create(owner=self.user, title='t', description='d')
+        payload = [
+            {'id': task.id, 'title': 'first'},
+            {'id': [task.id], 'title': 'list'},
+            {'id': True, 'title': 'bool'},
+            {'id': task.id, 'title': 'again'},
+            {'title': 'no id'},
+        ]
+        response = self.client.patch(self.url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data[0], {})
+        self.assertEqual([list(error) for error in response.data[1:]], [['id']] * 4)
+        self.assertIn('Duplicate', str(response.data[3]['id'][0]))
+        task.refresh_from_db()
+        self.assertEqual(task.title, 't')
+
+    def test_bulk_delete_rejects_bad_and_duplicate_ids(self):
+        task = Task.objects.create(owner=self.user, title='t', description='d')
+        for ids in ([True], [task.id, task.id], [0], ['1'], [None]):
+            response = self.client.delete(self.url, {'ids': ids}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, ids)
+        self.assertTrue(Task.objects.filter(pk=task.pk).exists())
+
+    def test_bulk_delete(self):
+        tasks = [Task.objects.create(owner=self.user, title=f't{i}', description='d') for i in range(3)]
+        TaskNotification.objects.all().delete()
+        response = self.client.delete(self.url, {'ids': [tasks[0].id, tasks[1].id]}, format='json')
+        self.assertEqual(response.data, {'deleted': 2})
+        self.assertEqual(Task.objects.filter(owner=self.user).count(), 1)
+        self.assertEqual(find_counter_drift(), [])
+        self.assertEqual(TaskNotification.objects.get().payload['action'], 'deleted')
+
+    def test_bulk_delete_rejects_unknown_ids(self):
+        task = Task.objects.create(owner=self.user, title='t', description='d')
+        other = Task.objects.create(owner=User.objects.create(phone_number='09121212124'), title='x')
+        #another user's task and a deleted one get the same error as in PATCH, nothing is deleted
+        response = self.client.delete(self.url, {'ids': [task.id, other.id, 99999]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['ids'][0], {})
+        self.assertEqual([str(error['id'][0]) for error in response.data['ids'][1:]], ['Task not found.'] * 2)
+        self.assertEqual(Task.objects.filter(pk__in=[task.pk, other.pk]).count(), 2)
+
+    def test_bulk_limits(self):
+        response = self.client.post(self.url, [], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with mock.patch('tasks.views.BULK_MAX_ITEMS', 2):
+            response = self.client.post(self.url, self.payload(3), format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TaskTransitionTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121313131', email='sprint@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/transition/'
+        self.sprint = Category.objects.create(owner=self.user, name='sprint')
+        for i in range(4):
+            Task.objects.create(owner=self.user, title=f'sprint {i}', category=self.sprint, priority='high' if i % 2 else 'low')
+        Task.objects.create(owner=self.user, title='backlog item')
+        other = User.objects.create(phone_number='09121313132')
+        Task.objects.create(owner=other, title='sprint of someone else')
+        TaskNotification.objects.all().delete()
+
+    def test_transition_by_filters(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(f'{self.url}?category={self.sprint.id}&priority=high', {'status': 'done'}, format='json')
+        self.assertEqual(response.data, {'updated': 2})
+        task_updates = [query for query in queries.captured_queries if query['sql'].startswith('UPDATE "tasks_task" ')]
+        self.assertEqual(len(task_updates), 1)
+        self.assertEqual(Task.objects.filter(status='done').count(), 2)
+        self.assertEqual(self.client.get('/api/tasks/statistics/').data['status_counts']['done'], 2)
+        self.assertEqual(find_counter_drift(), [])
+        notification = TaskNotification.objects.get()
+        self.assertEqual(notification.payload['count'], 2)
+
+    def test_transition_by_search_and_ids(self):
+        ids = list(Task.objects.filter(owner=self.user).values_list('id', flat=True)[:2])
+        response = self.client.post(f'{self.url}?search=sprint', {'status': 'in_progress', 'ids': ids}, format='json')
+        self.assertEqual(response.data, {'updated': 2})
+        self.assertEqual(find_counter_drift(), [])
+
+    def test_transition_skips_unchanged_tasks(self):
+        self.client.post(self.url, {'status': 'done'}, format='json')
+        response = self.client.post(self.url, {'status': 'done'}, format='json')
+        self.assertEqual(response.data, {'updated': 0})
+        self.assertEqual(Task.objects.exclude(status='done').count(), 1)
+        self.assertEqual(TaskNotification.objects.count(), 1)
+
+    def test_transition_only_moves_the_locked_tasks(self):
+        from .bulk import next_change_seq
+
+        def task_written_meanwhile(owner_id):
+            #a task that matches the filters shows up after the rows were read
+            Task.objects.create(owner=self.user, title='late sprint task', category=self.sprint)
+            return next_change_seq(owner_id)
+
+        with mock.patch('tasks.bulk.next_change_seq', side_effect=task_written_meanwhile):
+            response = self.client.post(f'{self.url}?category={self.sprint.id}', {'status': 'done'}, format='json')
+        self.assertEqual(response.data, {'updated': 4})
+        self.assertEqual(Task.objects.get(title='late sprint task').status, 'todo')
+        self.assertEqual(find_counter_drift(), [])
+
+    def test_transition_updates_in_batches(self):
+        with mock.patch('tasks.bulk.BULK_UPDATE_BATCH_SIZE', 3):
+            response = self.client.post(self.url, {'status': 'in_progress'}, format='json')
+        self.assertEqual(response.data, {'updated': 5})
+        self.assertEqual(Task.objects.filter(owner=self.user, status='in_progress').count(), 5)
+        self.assertEqual(find_counter_drift(), [])
+
+    def test_invalid_status(self):
+        response = self.client.post(self.url, {'status': 'archived'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalGetTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121414141')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(owner=self.user, name='home')
+        self.task = Task.objects.create(owner=self.user, title='water plants', category=self.category)
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return etag, self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_list_is_not_modified(self):
+        etag, response = self.revalidate('/api/tasks/')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        # only the version lookup, no task queries
+        with self.assertNumQueries(1):
+            self.client.get('/api/tasks/', HTTP_IF_NONE_MATCH=etag)
+
+    def test_validators_change_on_writes(self):
+        etag = self.client.get('/api/tasks/')['ETag']
+        self.client.patch(f'/api/tasks/{self.task.id}/', {'tags': ['garden']}, format='json')
+        response = self.client.get('/api/tasks/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'][0]['tags'], ['garden'])
+
+        # renaming the category changes the nested data of the task
+        etag = response['ETag']
+        self.client.patch(f'/api/categories/{self.category.id}/', {'name': 'house'}, format='json')
+        self.assertEqual(self.client.get('/api/tasks/', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+        etag = self.client.get(f'/api/tasks/{self.task.id}/')['ETag']
+        self.client.post('/api/tasks/transition/', {'status': 'done'}, format='json')
+        self.assertEqual(self.client.get(f'/api/tasks/{self.task.id}/', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+    def test_validators_depend_on_query_and_user(self):
+        etag = self.client.get('/api/tasks/')['ETag']
+        self.assertNotEqual(self.client.get('/api/tasks/?status=done')['ETag'], etag)
+
+        other = User.objects.create(phone_number='09121414142')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get('/api/tasks/', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+        # someone else's writes don't touch this user's version
+        etag = self.client.get('/api/categories/')['ETag']
+        Task.objects.create(owner=self.user, title='not mine')
+        self.assertEqual(self.client.get('/api/categories/', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_if_modified_since(self):
+        response = self.client.get('/api/categories/')
+        self.assertIn('Last-Modified', response)
+        response = self.client.get('/api/categories/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_tag_list_follows_global_version(self):
+        etag, response = self.revalidate('/api/tags/')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        # tags created through a task write are bulk inserted, without signals
+        self.client.post('/api/tasks/', {'title': 'new', 'description': 'd', 'tags': ['fresh']}, format='json')
+        self.assertEqual(self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class TaskListCacheTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121515151')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(owner=self.user, name='errands')
+        self.task = Task.objects.create(owner=self.user, title='buy milk', category=self.category)
+        self.task.tags.set(resolve_tags(['shop']))
+        reset_cache_stats()
+
+    def test_repeated_list_is_served_from_cache(self):
+        first = self.client.get('/api/tasks/?status=todo&ordering=-created_at')
+        # same query, other parameter order: version lookup only
+        with self.assertNumQueries(1):
+            second = self.client.get('/api/tasks/?ordering=-created_at&status=todo')
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(cache_stats()['hits'], 1)
+        self.assertEqual(cache_stats()['misses'], 1)
+
+    def test_writes_of_the_user_invalidate(self):
+        url = '/api/tasks/'
+        self.client.get(url)
+        self.client.patch(f'/api/tasks/{self.task.id}/', {'title': 'buy oat milk'}, format='json')
+        self.assertEqual(self.client.get(url).data['results'][0]['title'], 'buy oat milk')
+
+        Category.objects.filter(pk=self.category.pk).get().save()
+        self.client.get(url)
+        # renaming a tag reaches the owners of the tasks carrying it
+        tag = Tag.objects.get(name='shop')
+        tag.name = 'store'
+        tag.save()
+        self.assertEqual(self.client.get(url).data['results'][0]['tags'], ['store'])
+        self.assertEqual(cache_stats(), {'hits': 0, 'misses': 4, 'hit_ratio': 0.0})
+
+    def test_other_users_writes_keep_the_cache(self):
+        self.client.get('/api/tasks/')
+        other = User.objects.create(phone_number='09121515152')
+        Task.objects.create(owner=other, title='not related')
+        self.client.get('/api/tasks/')
+        self.assertEqual(cache_stats()['hits'], 1)
+
+    def test_stats_command(self):
+        self.client.get('/api/tasks/')
+        self.client.get('/api/tasks/')
+        out = io.StringIO()
+        call_command('task_list_cache_stats', '--reset', stdout=out, stderr=io.StringIO())
+        self.assertIn('hits 1, misses 1, hit ratio 50.0%', out.getvalue())
+        self.assertEqual(cache_stats()['misses'], 0)
+
+
+class TaskDeltaSyncTest(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create(phone_number='09121616161')
+        self.client.force_authenticate(user=self.user)
+        self.url = '/api/tasks/changes/'
+        self.category = Category.objects.create(owner=self.user, name='work')
+        self.tasks = [Task.objects.create(owner=self.user, title=f'task {i}', category=self.category) for i in range(3)]
+
+    def sync(self, token=None, **params):
+        if token:
+            params['since'] = token
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_one_version_per_write_with_tags(self):
+        task = self.tasks[0]
+        version = get_data_version(user_scope(self.user.pk))[0]
+        self.client.patch(f'/api/tasks/{task.id}/', {'title': 'tagged', 'tags': ['a', 'b']}, format='json')
+        self.client.patch(f'/api/tasks/{task.id}/', {'tags': ['c']}, format='json')
+        #the tags are set in the transaction of the save, its change_seq covers them
+        self.assertEqual(get_data_version(user_scope(self.user.pk))[0], version + 2)
+        task.refresh_from_db()
+        self.assertEqual(task.change_seq, version + 2)
+
+        #tags set on their own, not after a save, still stamp the task once
+        task = Task.objects.get(pk=task.pk)
+        with task_write_transaction():
+            task.tags.set([Tag.objects.get(name='a')])
+        task.refresh_from_db()
+        self.assertEqual(task.change_seq, version + 3)
+
+    def test_stamped_instances_forgotten_on_rollback(self):
+        task = Task.objects.get(pk=self.tasks[0].pk)
+        with self.assertRaises(RuntimeError), task_write_transaction():
+            task.title = 'rolled back'
+            task.save()
+            raise RuntimeError
+        #the next write takes a new change_seq
+        version = get_data_version(user_scope(self.user.pk))[0]
+        with task_write_transaction():
+            task.save()
+        self.assertEqual(task.change_seq, version + 1)
+
+    def test_task_write_needs_a_transaction(self):
+        with mock.patch('tasks.sync.transaction.get_connection') as get_connection:
+            get_connection.return_value.in_atomic_block = False
+            with self.assertRaises(TransactionManagementError):
+                Task.objects.create(owner=self.user, title='autocommit')
+
+    def test_initial_sync_then_only_changes(self):
+        data = self.sync()
+        self.assertEqual([task['title'] for task in data['changed']], ['task 0', 'task 1', 'task 2'])
+        self.assertFalse(data['has_more'])
+
+        # nothing changed
+        empty = self.sync(data['token'])
+        self.assertEqual((empty['changed'], empty['deleted']), ([], []))
+
+        self.client.patch(f'/api/tasks/{self.tasks[1].id}/', {'title': 'renamed'}, format='json')
+        self.client.delete(f'/api/tasks/{self.tasks[2].id}/')
+        new = self.client.post('/api/tasks/', {'title': 'new', 'description': 'd', 'tags': ['x']}, format='json').data
+        data = self.sync(data['token'])
+        self.assertEqual([task['title'] for task in data['changed']], ['renamed', 'new'])
+        self.assertEqual(data['changed'][1]['tags'], ['x'])
+        self.assertEqual(data['deleted'], [self.tasks[2].id])
+        self.assertEqual(self.sync(data['token'])['changed'], [])
+        self.assertTrue(Task.objects.filter(pk=new['id']).exists())
+
+    def test_indirect_and_bulk_changes(self):
+        token = self.sync()['token']
+        self.category.name = 'office'
+        self.category.save()
+        data = self.sync(token)
+        self.assertEqual(len(data['changed']), 3)
+        self.assertEqual(data['changed'][0]['category']['name'], 'office')
+
+        self.client.post('/api/tasks/transition/', {'status': 'done', 'ids': [self.tasks[0].id]}, format='json')
+        self.client.delete('/api/tasks/bulk/', {'ids': [self.tasks[1].id]}, format='json')
+        data = self.sync(data['token'])
+        self.assertEqual([task['status'] for task in data['changed']], ['done'])
+        self.assertEqual(data['deleted'], [self.tasks[1].id])
+
+        self.category.delete()
+        data = self.sync(data['token'])
+        self.assertEqual([task['category'] for task in data['changed']], [None, None])
+
+    def test_pages_split_inside_a_bulk_write(self):
+        token = self.sync()['token']
+        self.client.post('/api/tasks/bulk/', [{'title': f'bulk {i}', 'description': 'd'} for i in range(5)], format='json')
+        titles = []
+        while True:
+            data = self.sync(token, limit=2)
+            titles += [task['title'] for task in data['changed']]
+            token = data['token']
+            if not data['has_more']:
+                break
+        self.assertEqual(titles, [f'bulk {i}' for i in range(5)])
+
+    def test_other_users_changes_and_bad_tokens(self):
+        token = self.sync()['token']
+        other = User.objects.create(phone_number='09121616162')
+        Task.objects.create(owner=other, title='not mine').delete()
+        self.assertEqual(self.sync(token)['changed'], [])
+        self.assertEqual(self.sync(token)['deleted'], [])
+        self.assertEqual(self.client.get(self.url, {'since': 'garbage'}).status_code, status.HTTP_400_BAD_REQUEST)
+        #booleans are not sequence numbers
+        for seq, last_id in ((True, None), (1, False)):
+            since = encode_sync_token(seq, last_id)
+            self.assertEqual(self.client.get(self.url, {'since': since}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'limit': 0}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_token_gets_a_full_resync(self):
+        self.assertFalse(self.sync()['reset'])
+        self.client.delete(f'/api/tasks/{self.tasks[0].id}/')
+        old = timezone.now() - timedelta(days=settings.TASK_TOMBSTONE_RETENTION_DAYS + 1)
+        TaskTombstone.objects.update(deleted_at=old)
+        self.assertEqual(prune_task_tombstones(), 'Done! pruned 1 task tombstones')
+
+        #the deletion is gone, a token from before it can't be answered with a delta
+        data = self.sync(encode_sync_token(0, None, int(old.timestamp()) - 1))
+        self.assertTrue(data['reset'])
+        self.assertEqual([task['title'] for task in data['changed']], ['task 1', 'task 2'])
+        self.assertFalse(self.sync(data['token'])['reset'])
+
+    def test_deleting_a_user_leaves_no_tombstones(self):
+        self.user.delete()
+        self.assertEqual(TaskTombstone.objects.count(), 0)
+
+
+class CategoryStampTransactionTest(APITransactionTestCase):
+
+    def setUp(self):
+        # the commits schedule the notification drain, don't wait on a broker
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        self.user = User.objects.create(phone_number='09121616163')
+        self.client.force_authenticate(user=self.user)
+        self.category = Category.objects.create(owner=self.user, name='work')
+        with transaction.atomic():
+            Task.objects.create(owner=self.user, title='task', category=self.category)
+
+    def test_rename_and_delete_stamp_in_a_transaction(self):
+        from . import signals
+
+        in_transaction = []
+
+        def stamp_tasks(owner_id, queryset):
+            in_transaction.append(connection.in_atomic_block)
+            return original(owner_id, queryset)
+
+        original = signals.stamp_tasks
+        url = f'/api/categories/{self.category.id}/'
+        with mock.patch('tasks.signals.stamp_tasks', stamp_tasks):
+            self.client.patch(url, {'name': 'renamed'}, format='json')
+            self.client.delete(url)
+        #a sync between the version bump and the stamp would skip the tasks
+        self.assertEqual(in_transaction, [True, True])
+
+
+class AsyncTaskViewsTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(phone_number='09121717171', email='async@example.com')
+        self.category = Category.objects.create(owner=self.user, name='io')
+        for i in range(12):
+            task = Task.objects.create(owner=self.user, title=f'task {i}', category=self.category, status='done' if i % 3 else 'todo')
+            task.tags.set(resolve_tags(['async']))
+        self.task = task
+        self.auth = {'headers': {'Authorization': f'Bearer {RefreshToken.for_user(self.user).access_token}'}}
+        self.factory = AsyncRequestFactory()
+        self.client.force_authenticate(user=self.user)
+
+    def get(self, view, path, *args, **headers):
+        request = self.factory.get(path, headers={**self.auth['headers'], **headers})
+        return async_to_sync(view)(request, *args)
+
+    def test_list_matches_the_viewset(self):
+        for path in ['/api/tasks/', '/api/tasks/?page=2', '/api/tasks/?page=last', '/api/tasks/?status=todo&ordering=-priority']:
+            response = self.get(async_views.task_list, path)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(json.loads(response.content), json.loads(json.dumps(self.client.get(path).data)))
+        #both paths share the paginator, the errors are the same too
+        for path in ['/api/tasks/?page=9', '/api/tasks/?page=0', '/api/tasks/?page=x']:
+            response = self.get(async_views.task_list, path)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(json.loads(response.content), self.client.get(path).data)
+
+    def test_list_revalidation_and_errors(self):
+        etag = self.get(async_views.task_list, '/api/tasks/')['ETag']
+        self.assertEqual(self.client.get('/api/tasks/')['ETag'], etag)
+        self.assertEqual(self.get(async_views.task_list, '/api/tasks/', **{'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.get(async_views.task_list, '/api/tasks/?page=9').status_code, 404)
+        self.assertEqual(self.get(async_views.task_list, '/api/tasks/?category=999').status_code, 400)
+        response = async_to_sync(async_views.task_list)(self.factory.get('/api/tasks/'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+    def test_detail_and_statistics(self):
+        response = self.get(async_views.task_detail, f'/api/tasks/{self.task.id}/', self.task.id)
+        self.assertEqual(json.loads(response.content)['tags'], ['async'])
+        other = Task.objects.create(owner=User.objects.create(phone_number='09121717172'), title='x')
+        self.assertEqual(self.get(async_views.task_detail, f'/api/tasks/{other.id}/', other.id).status_code, 404)
+
+        response = self.get(async_views.task_statistics, '/api/tasks/statistics/')
+        self.assertEqual(json.loads(response.content), json.loads(json.dumps(self.client.get('/api/tasks/statistics/').data)))
+
+    def test_writes_fall_back_to_the_viewset(self):
+        request = self.factory.post('/api/tasks/', {'title': 'new', 'description': 'd'}, content_type='application/json', **self.auth)
+        response = async_to_sync(async_views.task_list)(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(Task.objects.filter(title='new').exists())
+
+    @mock.patch('tasks.async_views.export_tasks_to_csv.delay')
+    def test_export(self, delay):
+        request = self.factory.post('/api/export-tasks/', {'compress': True}, content_type='application/json', **self.auth)
+        response = async_to_sync(async_views.export_tasks)(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        delay.assert_called_once_with(self.user.id, compress=True)
+
+
+@override_settings(METRICS_FLUSH_INTERVAL=0, METRICS_TOKEN='scrape-token')
+class RequestMetricsTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+        # the test cache is local memory, shared by the single test process
+        patcher = mock.patch('config.views.cache_is_shared', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(phone_number='09121717171')
+        self.staff = User.objects.create(phone_number='09121717172', is_staff=True)
+        Task.objects.create(owner=self.user, title='t')
+
+    def scrape(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.content.decode()
+
+    def test_server_timing_only_for_staff(self):
+        self.client.force_authenticate(user=self.user)
+        self.assertNotIn('Server-Timing', self.client.get('/api/tasks/'))
+        self.client.force_authenticate(user=self.staff)
+        timing = self.client.get('/api/tasks/')['Server-Timing']
+        for name in ('db;dur=', 'serializer;dur=', 'app;dur=', 'view;dur=', 'render;dur=', 'total;dur='):
+            self.assertIn(name, timing)
+        self.assertIn('queries"', timing)
+
+    def test_histograms_by_route(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get('/api/tasks/')
+        self.client.get('/api/tasks/')
+        self.client.get('/api/tasks/statistics/')
+
+        body = self.scrape()
+        self.assertIn('# TYPE tasktracker_request_seconds histogram', body)
+        self.assertIn('tasktracker_request_seconds_count{method="GET",route="task-list"} 2', body)
+        self.assertIn('tasktracker_request_render_seconds_count{method="GET",route="task-statistics"} 1', body)
+        # a page out of the list cache runs a single query, a miss runs the whole budget
+        self.assertIn('tasktracker_request_sql_queries_bucket{method="GET",route="task-list",le="1"} 1', body)
+        self.assertIn('tasktracker_request_sql_queries_bucket{method="GET",route="task-list",le="5"} 2', body)
+        self.assertIn('tasktracker_request_sql_queries_sum{method="GET",route="task-statistics"} 2.0', body)
+
+    def test_serializer_time_is_its_own_series(self):
+        self.client.force_authenticate(user=self.user)
+        self.client.get('/api/tasks/statistics/')
+        with mock.patch('tasks.serializers.TaskSerializer.to_representation', autospec=True) as represent:
+            represent.side_effect = lambda serializer, task: time.sleep(0.03) or {'id': task.id}
+            self.client.get('/api/tasks/?page_size=1')
+
+        body = self.scrape()
+        self.assertIn('# TYPE tasktracker_request_serializer_seconds histogram', body)
+        #the list spent its 30ms in serializer.data, the statistics endpoint has no serializer
+        self.assertIn('tasktracker_request_serializer_seconds_bucket{method="GET",route="task-list",le="0.025"} 0', body)
+        self.assertIn('tasktracker_request_serializer_seconds_count{method="GET",route="task-list"} 1', body)
+        self.assertIn('tasktracker_request_serializer_seconds_sum{method="GET",route="task-statistics"} 0.0', body)
+
+    def test_metrics_are_protected(self):
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(user=self.user)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=self.staff)
+        self.assertEqual(self.client.get('/metrics').status_code, status.HTTP_200_OK)
+
+    def test_metrics_refused_on_a_local_cache(self):
+        with mock.patch('config.views.cache_is_shared', return_value=False):
+            response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertIn(b'CACHE_REDIS_URL', response.content)
+
+    def test_async_requests(self):
+        from django.http import HttpResponse
+        from config.middleware import RequestMetricsMiddleware
+
+        async def view(request):
+            await Task.objects.acount()
+            return HttpResponse('ok')
+
+        middleware = RequestMetricsMiddleware(view)
+        request = AsyncRequestFactory().get('/api/tasks/')
+        async_to_sync(middleware)(request)
+        self.assertIn('tasktracker_request_sql_queries_sum{method="GET",route="unmatched"} 1.0', self.scrape())
+
+
+@override_settings(METRICS_FLUSH_INTERVAL=0, METRICS_TOKEN='scrape-token')
+class CeleryTaskTelemetryTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        reset_metrics()
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        patcher = mock.patch('config.views.cache_is_shared', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create(phone_number='09121818181', email='telemetry@example.com')
+
+    def test_export_reports_rows_and_emails(self):
+        for i in range(3):
+            Task.objects.create(owner=self.user, title=f'export {i}')
+        export_tasks_to_csv.delay(self.user.id)
+
+        run = recent_task_runs(1)[0]
+        self.assertEqual(run['task'], 'tasks.tasks.export_tasks_to_csv')
+        self.assertEqual((run['state'], run['rows'], run['emails'], run['retries']), ('SUCCESS', 3, 1, 0))
+        # eager runs never went through the queue
+        self.assertIsNone(run['queue_wait'])
+
+        body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').content.decode()
+        self.assertIn('tasktracker_celery_emails_total{task="tasks.tasks.export_tasks_to_csv"} 1', body)
+        self.assertIn('tasktracker_celery_rows_total{task="tasks.tasks.export_tasks_to_csv"} 3', body)
+        self.assertIn('tasktracker_celery_run_seconds_count{state="SUCCESS",task="tasks.tasks.export_tasks_to_csv"} 1', body)
+
+    def test_queue_wait_and_retries(self):
+        from config.task_metrics import count_task_retry, finish_task_run, stamp_enqueued_at, start_task_run
+
+        headers = {}
+        stamp_enqueued_at(headers=headers)
+        request = mock.Mock(is_eager=False, eta=None, retries=1, enqueued_at=headers['enqueued_at'] - 5)
+        task = mock.Mock(request=request)
+        task.name = 'tasks.tasks.send_daily_reminders'
+        start_task_run(task_id='abc', task=task)
+        count_task_retry(sender=task)
+        finish_task_run(task_id='abc', task=task, state='SUCCESS')
+
+        run = recent_task_runs(1)[0]
+        self.assertGreaterEqual(run['queue_wait'], 5)
+        self.assertEqual(run['retries'], 1)
+        body = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token').content.decode()
+        self.assertIn('tasktracker_celery_retries_total{task="tasks.tasks.send_daily_reminders"} 1', body)
+        self.assertIn('tasktracker_celery_queue_wait_seconds_bucket{task="tasks.tasks.send_daily_reminders",le="5"} 0', body)
+        self.assertIn('tasktracker_celery_queue_wait_seconds_bucket{task="tasks.tasks.send_daily_reminders",le="10"} 1', body)
+
+    @mock.patch('tasks.management.commands.celery_task_runs.cache_is_shared', return_value=True)
+    def test_runs_command(self, cache_is_shared):
+        out = io.StringIO()
+        call_command('celery_task_runs', stdout=out)
+        self.assertIn('No task runs recorded', out.getvalue())
+
+        export_tasks_to_csv.delay(self.user.id)
+        export_tasks_to_csv.delay(self.user.id)
+        out = io.StringIO()
+        call_command('celery_task_runs', '--last', '5', '--task', 'export_tasks_to_csv', stdout=out)
+        self.assertEqual(out.getvalue().count('export_tasks_to_csv'), 3)
+        self.assertIn('Per task', out.getvalue())
+
+    def test_runs_command_needs_a_shared_cache(self):
+        #a local cache would read an empty log and look like no task ever ran
+        with self.assertRaisesMessage(CommandError, 'CACHE_REDIS_URL'):
+            call_command('celery_task_runs', stdout=io.StringIO())
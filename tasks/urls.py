@@ -1,4 +1,5 @@
 from rest_framework.routers import DefaultRouter
+from django.conf import settings
 from django.urls import path, include
 from .views import TagListCreatView, TaskViewSet, CategoryViewSet, ExpotrtTasksView, TagListCreatView
 
@@ -11,4 +12,18 @@ urlpatterns = [
     path('export-tasks/', ExpotrtTasksView.as_view(), name='export-tasks'),
     path('tags/', TagListCreatView.as_view(), name= 'tag-list-create'),
 
-]
\ No newline at end of file
+]
+
+if settings.ASYNC_TASK_VIEWS:
+    from . import async_views
+
+    # native async handlers in front of the viewsets, they fall back to them
+    # for everything else. Same names as the routes they front, for reverse()
+    # and the request metrics.
+    urlpatterns = [
+        path('tasks/', async_views.task_list, name='task-list'),
+        path('tasks/statistics/', async_views.task_statistics, name='task-statistics'),
+        path('tasks/<int:pk>/', async_views.task_detail, name='task-detail'),
+        path('export-tasks/', async_views.export_tasks, name='export-tasks'),
+    ] + urlpatterns
+
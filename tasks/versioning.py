@@ -0,0 +1,165 @@
+import hashlib
+from datetime import datetime, time
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+from .list_cache import get_cached_page, set_cached_page, task_list_cache_key
+from .models import DataVersion
+
+
+TAGS_SCOPE = 'tags'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def bump_data_version(scope):
+    """
+    Move a scope to its next version, creating the row on first use.
+    Returns the new version. Inside a transaction the row stays locked until
+    commit, so the versions of a scope are handed out in commit order.
+    """
+    now = timezone.now()
+    version = _increment(scope, now)
+    if version is not None:
+        return version
+    try:
+        with transaction.atomic():
+            DataVersion.objects.create(scope=scope, version=1, updated_at=now)
+        return 1
+    except IntegrityError:
+        return _increment(scope, now)
+
+
+def _increment(scope, now):
+    connection = connections[router.db_for_write(DataVersion)]
+    if connection.vendor in ('postgresql', 'sqlite'):
+        # one round trip instead of an UPDATE and a SELECT
+        table = connection.ops.quote_name(DataVersion._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET "version" = "version" + 1, "updated_at" = %s WHERE "scope" = %s RETURNING "version"',
+                [DataVersion._meta.get_field('updated_at').get_db_prep_value(now, connection), scope],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else None
+    if DataVersion.objects.filter(scope=scope).update(version=F('version') + 1, updated_at=now):
+        return DataVersion.objects.filter(scope=scope).values_list('version', flat=True).get()
+    return None
+
+
+def get_data_version(scope):
+    """
+    Returns (version, updated_at), (0, None) for a scope that was never written
+    """
+    row = DataVersion.objects.filter(scope=scope).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+async def aget_data_version(scope):
+    row = await DataVersion.objects.filter(scope=scope).values_list('version', 'updated_at').afirst()
+    return row or (0, None)
+
+
+def not_modified_response(request, etag, last_modified):
+    """
+    The 304 (or 412) for a request whose preconditions match the validators,
+    None when the body has to be rendered
+    """
+    return get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+
+
+def add_validators(response, etag, last_modified):
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # let browsers keep the body but always revalidate
+        response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds ETag / Last-Modified validators to list and retrieve, derived from
+    the data version of the view's scope. A request whose If-None-Match or
+    If-Modified-Since still matches gets a 304 before any queryset or
+    serializer work runs.
+    """
+
+    def get_data_version_scope(self):
+        return user_scope(self.request.user.pk)
+
+    def get_data_version(self):
+        # looked up once per request, shared by the validators and the list cache
+        if not hasattr(self, '_data_version'):
+            self._data_version = get_data_version(self.get_data_version_scope())
+        return self._data_version
+
+    def depends_on_date(self):
+        """
+        True when the response also changes with the day (overdue counts and
+        filters), the validators then change at local midnight
+        """
+        return False
+
+    def get_validators(self, request):
+        version, updated_at = self.get_data_version()
+        # the representation also depends on the url (filters, page) and the renderer
+        parts = [
+            self.get_data_version_scope(),
+            str(version),
+            str(request.user.pk),
+            request.get_full_path(),
+            request.accepted_renderer.format,
+        ]
+        if self.depends_on_date():
+            today = timezone.localdate()
+            parts.append(today.isoformat())
+            midnight = timezone.make_aware(datetime.combine(today, time.min))
+            updated_at = max(updated_at, midnight) if updated_at else midnight
+        etag = '"%s"' % hashlib.sha256(':'.join(parts).encode()).hexdigest()[:32]
+        # http dates have a one second resolution
+        last_modified = int(updated_at.timestamp()) if updated_at else None
+        return etag, last_modified
+
+    def conditional(self, request, render):
+        etag, last_modified = self.get_validators(request)
+        response = not_modified_response(request, etag, last_modified) or render()
+        return add_validators(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: super(ConditionalGetMixin, self).list(request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs))
+
+
+class CachedListMixin(ConditionalGetMixin):
+    """
+    Conditional GET, plus a per-user cache of the list pages for the
+    clients that don't revalidate (keys in tasks.list_cache)
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, lambda: self.cached_list(request, *args, **kwargs))
+
+    def get_list_cache_key(self, request):
+        day = timezone.localdate() if self.depends_on_date() else None
+        return task_list_cache_key(request, self.get_data_version(), day)
+
+    def cached_list(self, request, *args, **kwargs):
+        key = self.get_list_cache_key(request)
+        data = get_cached_page(key)
+        if data is not None:
+            return Response(data)
+        response = super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+        if response.status_code == 200:
+            set_cached_page(key, response.data)
+        return response
@@ -1,4 +1,5 @@
-from django.db.models import When, Case, IntegerField
+from django.db import transaction
+from django.db.models import F
 
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import generics, viewsets, filters, status
@@ -7,45 +8,112 @@ from rest_framework.decorators import action, permission_classes
 from rest_framework.views import APIView
 
 from .tasks import export_tasks_to_csv
+from .statistics import CATEGORY_ROLLUP_FIELDS, annotate_category_rollups, read_statistics
+from .agenda import AGENDA_DAYS, AGENDA_MAX_DAYS, AGENDA_MAX_TASKS, build_agenda
+from .filters import TaskFilter
+from .pagination import KeysetCursorPagination, TaskPageNumberPagination
+from .search import TaskSearchFilter
+from .versioning import TAGS_SCOPE, CachedListMixin, ConditionalGetMixin
+from .sync import SYNC_MAX_PAGE_SIZE, SYNC_PAGE_SIZE, read_changes, task_write_transaction
+from .bulk import (
+    BULK_MAX_ITEMS, bulk_id_errors, bulk_serializer_context, bulk_create_tasks, bulk_update_tasks, bulk_delete_tasks,
+    bulk_transition_tasks, lock_tasks_for_delete,
+)
 from .models import Task, Category, Tag
 
-from .serializers import TagSerializer, TaskSerializer, CategorySerializer
+from .serializers import TagSerializer, TaskSerializer, CategoryRollupSerializer, TaskTransitionSerializer
 from django_filters.rest_framework import DjangoFilterBackend
 
 from drf_spectacular.utils import extend_schema, OpenApiParameter, OpenApiExample
 from drf_spectacular.types import OpenApiTypes
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     API endpoints for Category management.
+    Every category carries its task counts and last activity, kept up to date
+    on the task writes (see statistics.annotate_category_rollups).
     """
-    serializer_class = CategorySerializer
+    serializer_class = CategoryRollupSerializer
     permission_classes = [IsAuthenticated]
-    
+    ordering_fields = ('name', 'created_at', 'last_activity_at', *CATEGORY_ROLLUP_FIELDS)
+
+    def depends_on_date(self):
+        # the overdue counts change at midnight without any write
+        return True
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                name='ordering',
+                description=(
+                    'Which field to use when ordering the categories, prefix with - for descending '
+                    '(e.g. -open_tasks). One of name, created_at, last_activity_at, todo_tasks, '
+                    'in_progress_tasks, done_tasks, total_tasks, open_tasks, overdue_tasks'
+                ),
+                required=False,
+                type=str
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Category.objects.none()
-        return Category.objects.filter(owner=self.request.user).order_by('-created_at')
+        queryset = annotate_category_rollups(Category.objects.filter(owner=self.request.user).select_related('owner'))
+
+        ordering = self.request.query_params.get('ordering', '-created_at')
+        if ordering.lstrip('-') not in self.ordering_fields:
+            ordering = '-created_at'
+        field = F(ordering.lstrip('-'))
+        # categories without any activity yet go last either way
+        field = field.desc(nulls_last=True) if ordering.startswith('-') else field.asc(nulls_last=True)
+        return queryset.order_by(field, '-pk')
 
+    # a rename or delete stamps the category's tasks, the new version must
+    # commit together with the stamped rows (see TaskViewSet)
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
 
-class TaskViewSet(viewsets.ModelViewSet):
+    @transaction.atomic
+    def perform_update(self, serializer):
+        serializer.save()
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
+class TaskViewSet(CachedListMixin, viewsets.ModelViewSet):
     """
     API endpoints for Task management.
     """
     serializer_class = TaskSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = TaskPageNumberPagination
     
     # Remove filters.OrderingFilter to prevent it from overwriting custom ordering
     filter_backends = [
         DjangoFilterBackend,       # for exact filtering
-        filters.SearchFilter,      # for searching
+        TaskSearchFilter,          # full-text search, ranked by relevance
     ]
     
-    filterset_fields = ['status', 'priority', 'category']  # for exact filtering
+    filterset_class = TaskFilter  # exact filters, due date ranges and overdue
     search_fields = ['title', 'description']   # for searching
 
+    @property
+    def paginator(self):
+        """
+        page numbers by default, keyset cursors when the client asks for them
+        """
+        if not hasattr(self, '_paginator'):
+            if KeysetCursorPagination.is_requested(self.request):
+                self._paginator = KeysetCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
     # Documentation for GET (List)
     @extend_schema(
         
@@ -76,6 +144,37 @@ class TaskViewSet(viewsets.ModelViewSet):
                 required=False,
                 type=int,
             ),
+            OpenApiParameter(
+                name='due_after',
+                description='Tasks due on or after this date (YYYY-MM-DD)',
+                required=False,
+                type=OpenApiTypes.DATE,
+            ),
+            OpenApiParameter(
+                name='due_before',
+                description='Tasks due on or before this date (YYYY-MM-DD)',
+                required=False,
+                type=OpenApiTypes.DATE,
+            ),
+            OpenApiParameter(
+                name='overdue',
+                description='true: only tasks past their due date and not done, false: every other task',
+                required=False,
+                type=bool,
+            ),
+            OpenApiParameter(
+                name='pagination',
+                description="Set to 'cursor' for keyset pagination (no total count, follow the next/previous links)",
+                required=False,
+                type=str,
+                enum=['cursor']
+            ),
+            OpenApiParameter(
+                name='cursor',
+                description='Cursor taken from the next/previous link of a cursor paginated response',
+                required=False,
+                type=str,
+            ),
         ]
         
     )
@@ -103,6 +202,11 @@ class TaskViewSet(viewsets.ModelViewSet):
                         "medium": 4,
                         "high": 3,
                     },
+                    "category_counts": [
+                        {"id": 1, "name": "Work", "count": 7},
+                        {"id": None, "name": None, "count": 3},
+                    ],
+                    "overdue_tasks": 1,
                 },
             ),
         ],
@@ -112,60 +216,235 @@ class TaskViewSet(viewsets.ModelViewSet):
         """
         Get statistics of user's tasks
         """
-        user_tasks=Task.objects.filter(owner=request.user)
-        data={
-            'total_tasks': user_tasks.count(),
-            "status_counts": {
-                "todo": user_tasks.filter(status="todo").count(),
-                "in_progress": user_tasks.filter(status="in_progress").count(),
-                "done": user_tasks.filter(status="done").count(),
-            },
-            "priority_counts": {
-                "low": user_tasks.filter(priority="low").count(),
-                "medium": user_tasks.filter(priority="medium").count(),
-                "high": user_tasks.filter(priority="high").count(),
-            },
-        }
-        return Response(data)
+        return Response(read_statistics(request.user))
+
+    @extend_schema(
+        summary="Create, update or delete many tasks at once",
+        description=(
+            "POST: a list of tasks to create. "
+            "PATCH: a list of partial tasks, each with its `id`. "
+            "DELETE: `{\"ids\": [...]}`, every id must be one of the user's tasks. "
+            f"At most {BULK_MAX_ITEMS} items per request. The whole batch is written in one "
+            "transaction: if any item is invalid nothing is written and the response lists the "
+            "errors per item, in payload order."
+        ),
+        request=TaskSerializer(many=True),
+        responses={200: TaskSerializer(many=True), 201: TaskSerializer(many=True)},
+    )
+    @action(detail=False, methods=['post', 'patch', 'delete'], url_path='bulk')
+    def bulk(self, request):
+        """
+        Create, update or delete many tasks in one request
+        """
+        if request.method == 'DELETE':
+            ids = request.data.get('ids') if isinstance(request.data, dict) else None
+            if not isinstance(ids, list):
+                return Response({'ids': ['Expected a list of task ids.']}, status=status.HTTP_400_BAD_REQUEST)
+            if len(ids) > BULK_MAX_ITEMS:
+                return Response({'ids': [f'At most {BULK_MAX_ITEMS} items per request.']}, status=status.HTTP_400_BAD_REQUEST)
+            errors = bulk_id_errors(ids)
+            if any(errors):
+                return Response({'ids': errors}, status=status.HTTP_400_BAD_REQUEST)
+            with transaction.atomic():
+                rows = lock_tasks_for_delete(request.user, ids)
+                # like PATCH, an id that isn't the user's task rejects the whole batch
+                errors = [{} if pk in rows else {'id': ['Task not found.']} for pk in ids]
+                if any(errors):
+                    return Response({'ids': errors}, status=status.HTTP_400_BAD_REQUEST)
+                deleted = bulk_delete_tasks(request.user, [rows[pk] for pk in ids])
+            return Response({'deleted': deleted})
+
+        items = request.data
+        if not isinstance(items, list) or not items:
+            return Response({'non_field_errors': ['Expected a non-empty list of tasks.']}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > BULK_MAX_ITEMS:
+            return Response({'non_field_errors': [f'At most {BULK_MAX_ITEMS} items per request.']}, status=status.HTTP_400_BAD_REQUEST)
+        context = bulk_serializer_context(request.user, self.get_serializer_context())
+
+        if request.method == 'POST':
+            serializer = TaskSerializer(data=items, many=True, context=context)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            tasks = bulk_create_tasks(request.user, serializer.validated_data)
+            return Response(self._serialize_in_order(tasks), status=status.HTTP_201_CREATED)
+
+        with transaction.atomic():
+            ids = [item.get('id') if isinstance(item, dict) else None for item in items]
+            id_errors = bulk_id_errors(ids)
+            if any(id_errors):
+                return Response(id_errors, status=status.HTTP_400_BAD_REQUEST)
+            tasks = Task.objects.select_for_update().filter(owner=request.user, pk__in=ids)
+            tasks = {task.pk: task for task in tasks}
+            errors, valid = [], []
+            for pk, item in zip(ids, items):
+                if pk not in tasks:
+                    errors.append({'id': ['Task not found.']})
+                    continue
+                serializer = TaskSerializer(tasks[pk], data=item, partial=True, context=context)
+                if serializer.is_valid():
+                    errors.append({})
+                    valid.append(serializer.validated_data)
+                else:
+                    errors.append(serializer.errors)
+            if any(errors):
+                return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+            updated = bulk_update_tasks(request.user, [tasks[pk] for pk in ids], valid)
+        return Response(self._serialize_in_order(updated))
+
+    def _serialize_in_order(self, tasks):
+        """
+        re-read the written tasks with their relations in a fixed number of
+        queries and serialize them in payload order
+        """
+        fresh = Task.objects.filter(pk__in=[task.pk for task in tasks]).select_related(
+            'owner', 'category__owner'
+        ).prefetch_related('tags')
+        fresh = {task.pk: task for task in fresh}
+        return TaskSerializer([fresh[task.pk] for task in tasks], many=True, context=self.get_serializer_context()).data
+
+    @extend_schema(
+        summary="Change the status of every task matching the filters",
+        description=(
+            "Takes the same query filters as the list (status, priority, category, search) plus "
+            "optional `ids` in the body, and moves every matching task to the given status with "
+            "a single update. Returns how many tasks changed."
+        ),
+        request=TaskTransitionSerializer,
+        responses={200: OpenApiTypes.OBJECT},
+        examples=[OpenApiExample(name="Successful Response", value={"updated": 12}, response_only=True)],
+    )
+    @action(detail=False, methods=['post'], url_path='transition')
+    def transition(self, request):
+        """
+        Change the status of every task matching the filters
+        """
+        serializer = TaskTransitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queryset = self.filter_queryset(self.get_queryset())
+        if 'ids' in serializer.validated_data:
+            queryset = queryset.filter(pk__in=serializer.validated_data['ids'])
+        updated = bulk_transition_tasks(request.user, queryset, serializer.validated_data['status'])
+        return Response({'updated': updated})
+
+    @extend_schema(
+        summary="Tasks changed since a sync token",
+        description=(
+            "Returns the tasks created or updated and the ids of the tasks deleted after `since`, "
+            "oldest change first, with the token to send next time. Without `since` every task is "
+            "returned (initial sync). When `has_more` is true, call again right away with the new token. "
+            "A token older than the deletion history is answered with an initial sync and `reset` true: "
+            "drop the local tasks before applying it."
+        ),
+        parameters=[
+            OpenApiParameter(name='since', description='Token from the previous sync', required=False, type=str),
+            OpenApiParameter(
+                name='limit',
+                description=f'Changes per response, at most {SYNC_MAX_PAGE_SIZE} (default {SYNC_PAGE_SIZE})',
+                required=False,
+                type=int,
+            ),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+        examples=[
+            OpenApiExample(
+                name="Successful Response",
+                value={"changed": [], "deleted": [12, 15], "token": "WzQyLCBudWxsLCAxNzYwODE2MDAwXQ==", "has_more": False, "reset": False},
+                response_only=True,
+            ),
+        ],
+    )
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request):
+        """
+        Delta sync: the tasks changed and deleted since the client's token
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', SYNC_PAGE_SIZE)), SYNC_MAX_PAGE_SIZE)
+        except ValueError:
+            return Response({'limit': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'limit': ['Must be at least 1.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        tasks = Task.objects.select_related('owner', 'category__owner').prefetch_related('tags')
+        try:
+            changed, deleted, token, has_more, reset = read_changes(
+                request.user, request.query_params.get('since'), limit, tasks
+            )
+        except ValueError as e:
+            return Response({'since': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'changed': TaskSerializer(changed, many=True, context=self.get_serializer_context()).data,
+            'deleted': deleted,
+            'token': token,
+            'has_more': has_more,
+            'reset': reset,
+        })
+
+    @extend_schema(
+        summary="Open tasks due in the next days",
+        description=(
+            f"The open tasks due from today to `days` - 1 days later (default {AGENDA_DAYS}, at most "
+            f"{AGENDA_MAX_DAYS}), grouped by due date, and the overdue ones apart. At most "
+            f"{AGENDA_MAX_TASKS} tasks; `has_more` is true when later due dates were left out."
+        ),
+        parameters=[
+            OpenApiParameter(name='days', description='Days to cover, today included', required=False, type=int),
+        ],
+        responses={200: OpenApiTypes.OBJECT},
+    )
+    @action(detail=False, methods=['get'], url_path='agenda')
+    def agenda(self, request):
+        """
+        The open tasks due soon, by day, and the overdue ones
+        """
+        try:
+            days = int(request.query_params.get('days', AGENDA_DAYS))
+        except ValueError:
+            return Response({'days': ['A valid integer is required.']}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= days <= AGENDA_MAX_DAYS:
+            return Response({'days': [f'Must be between 1 and {AGENDA_MAX_DAYS}.']}, status=status.HTTP_400_BAD_REQUEST)
+
+        context = self.get_serializer_context()
+        return self.conditional(request, lambda: Response(build_agenda(
+            request.user, days, serialize=lambda tasks: TaskSerializer(tasks, many=True, context=context).data,
+        )))
+
+    def depends_on_date(self):
+        # what is overdue changes at midnight without any write
+        return self.action == 'agenda' or 'overdue' in self.request.query_params
 
     @action(detail=True, methods=['post'],url_path= 'complete')
+    @transaction.atomic
     def mark_as_done(self,request,pk=None):
         """
         Mark a task as done
         """
         task=self.get_object()
         task.status="done"
-        task.save()
+        task.save(update_fields=['status', 'updated_at', 'change_seq'])
         return Response({'message': 'Task marked as done'})
     
     def get_queryset(self):
         if getattr(self, 'swagger_fake_view', False):
             return Task.objects.none()
 
-        # 1. Base queryset
-        queryset = Task.objects.filter(owner=self.request.user)
+        # 1. Base queryset, with everything the serializer reads loaded up front
+        queryset = (
+            Task.objects.filter(owner=self.request.user)
+            .select_related('owner', 'category__owner')
+            .prefetch_related('tags')
+        )
         
         # 2. Get ordering parameter manually
         ordering = self.request.query_params.get('ordering', '-created_at')
         
         # 3. Apply ordering logic
         if 'priority' in ordering:
-            # Add custom priority sorting value
-            queryset = queryset.annotate(
-                priority_val=Case(
-                    When(priority='low', then=1),
-                    When(priority='medium', then=2),
-                    When(priority='high', then=3),
-                    default=0,
-                    output_field=IntegerField(),
-                )
-            )
-            
-            # Check for descending order
+            # priority_rank is the stored, indexed integer form of priority
             if ordering.startswith('-'):
-                queryset = queryset.order_by('-priority_val', '-created_at')
+                queryset = queryset.order_by('-priority_rank', '-created_at')
             else:
-                queryset = queryset.order_by('priority_val', '-created_at')
+                queryset = queryset.order_by('priority_rank', '-created_at')
                 
         else:
             # Standard ordering for other fields
@@ -173,8 +452,19 @@ class TaskViewSet(viewsets.ModelViewSet):
             
         return queryset
 
+    # the writes run in a transaction so the owner's data version (the
+    # change_seq of the task) commits together with the rows it stamps
+    @task_write_transaction()
     def perform_create(self, serializer):
         serializer.save(owner=self.request.user)
+
+    @task_write_transaction()
+    def perform_update(self, serializer):
+        serializer.save()
+
+    @task_write_transaction()
+    def perform_destroy(self, instance):
+        instance.delete()
         
 class ExpotrtTasksView(APIView):
     permission_classes=[IsAuthenticated] 
@@ -182,6 +472,17 @@ class ExpotrtTasksView(APIView):
     @extend_schema(
         summary="Export tasks to CSV",
         description="Export user's tasks to CSV file and send via email",
+        request={
+            'application/json': {
+                'type': 'object',
+                'properties': {
+                    'compress': {
+                        'type': 'boolean',
+                        'description': 'Send the CSV gzip compressed (tasks.csv.gz), exports over 10MB are always compressed'
+                    }
+                }
+            }
+        },
         responses={
             200: {
                 'type': 'object',
@@ -211,14 +512,19 @@ class ExpotrtTasksView(APIView):
                 {'error': 'Email is required to export tasks'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        export_tasks_to_csv.delay(user.id)
+        compress = str(request.data.get('compress', '')).lower() in ('1', 'true', 'yes')
+        export_tasks_to_csv.delay(user.id, compress=compress)
         return Response(
             {'message': 'Tasks exported successfully'},
             status=status.HTTP_200_OK
         )    
         
         
-class TagListCreatView(generics.ListCreateAPIView):
+class TagListCreatView(ConditionalGetMixin, generics.ListCreateAPIView):
     queryset = Tag.objects.all()        
     serializer_class = TagSerializer
-    permission_classes = [IsAuthenticated]
\ No newline at end of file
+    permission_classes = [IsAuthenticated]
+
+    def get_data_version_scope(self):
+        # tags are shared by every user
+        return TAGS_SCOPE
\ No newline at end of file
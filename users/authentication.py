@@ -0,0 +1,53 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from config.cache import cache_is_shared
+
+from .user_cache import cache_user, current_generation, get_cached_user
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user (with their profile) from a
+    short lived cache instead of a SELECT on every request. Entries are
+    dropped when the user or their profile is saved or deleted.
+
+    Only with a cache shared by every process: a per-process cache would
+    keep serving a deactivated user in the other workers, so it falls back
+    to the plain JWTAuthentication lookup.
+    """
+
+    def get_user(self, validated_token):
+        if not cache_is_shared():
+            return super().get_user(validated_token)
+
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        user = get_cached_user(user_id)
+        if user is None:
+            generation = current_generation(user_id)
+            try:
+                user = self.user_model.objects.select_related('profile').get(
+                    **{api_settings.USER_ID_FIELD: user_id}
+                )
+            except self.user_model.DoesNotExist:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            cache_user(user, generation)
+
+        # the same checks as JWTAuthentication, on the cached user
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # a cached user comes without its password, only the hash of it
+            password_hash = getattr(user, 'cached_password_hash', None) or get_md5_hash_password(user.password)
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_hash:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+        return user
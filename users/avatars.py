@@ -0,0 +1,80 @@
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# square sizes served to clients, in pixels
+AVATAR_VARIANT_SIZES = (64, 128, 256)
+# the cleaned copy kept in place of the upload is at most this wide/high
+AVATAR_ORIGINAL_MAX_SIZE = 1024
+AVATAR_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+# refuse decompression bombs long before Pillow's own limit
+AVATAR_MAX_PIXELS = 40_000_000
+AVATAR_ALLOWED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+AVATAR_ALLOWED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'gif'}
+
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+
+class InvalidAvatar(Exception):
+    pass
+
+
+def open_avatar(fileobj):
+    """
+    Validate an uploaded image and return it decoded, upright and without
+    any metadata. Raises InvalidAvatar.
+    """
+    try:
+        with Image.open(fileobj) as probe:
+            if probe.format not in AVATAR_ALLOWED_FORMATS:
+                raise InvalidAvatar(f"Unsupported image format {probe.format}.")
+            if probe.width * probe.height > AVATAR_MAX_PIXELS:
+                raise InvalidAvatar("Image is too large.")
+            probe.verify()
+        # verify() leaves the image unusable, decode it again
+        fileobj.seek(0)
+        with Image.open(fileobj) as image:
+            image.seek(0)  # first frame of an animation
+            image = ImageOps.exif_transpose(image)
+            image.load()
+    except InvalidAvatar:
+        raise
+    except (UnidentifiedImageError, OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        raise InvalidAvatar(f"Not a valid image: {e}")
+
+    # a fresh image carries pixels only: no EXIF, GPS, ICC or text chunks
+    has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+    clean = Image.new('RGBA' if has_alpha else 'RGB', image.size)
+    clean.paste(image.convert(clean.mode))
+    return clean
+
+
+def _encode(image, fmt):
+    buffer = io.BytesIO()
+    if fmt == 'jpeg':
+        if image.mode != 'RGB':
+            # jpeg has no alpha, flatten on white
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        image.save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=4)
+    return buffer.getvalue()
+
+
+def render_avatar_variants(image):
+    """
+    Returns (original_jpeg_bytes, {size: {'webp': bytes, 'jpeg': bytes}})
+    with every variant a center cropped square
+    """
+    original = image.copy()
+    original.thumbnail((AVATAR_ORIGINAL_MAX_SIZE, AVATAR_ORIGINAL_MAX_SIZE), Image.Resampling.LANCZOS)
+
+    variants = {}
+    for size in AVATAR_VARIANT_SIZES:
+        square = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        variants[size] = {'webp': _encode(square, 'webp'), 'jpeg': _encode(square, 'jpeg')}
+    return _encode(original, 'jpeg'), variants
@@ -0,0 +1,320 @@
+"""
+Bulk user import from CSV or JSON lines, used by `manage.py import_users` and
+the admin import API.
+
+The file is streamed and handled a chunk at a time: the rows are validated
+with the same phone number rules as registration (one query per chunk for
+the numbers and emails already taken), the passwords are hashed on an
+executor (a process pool for the command, threads in the Celery job), then
+the users and their profiles are inserted with two bulk_creates. bulk_create
+sends no post_save, so the profiles are created here rather than by the signal.
+"""
+import csv
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import validate_password
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.storage import FileSystemStorage
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Lower
+from rest_framework import serializers
+
+from .models import Profile, User
+from .validators import validate_phone_number_format
+
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_MAX_REPORTED_ERRORS = 100
+IMPORT_FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+IMPORT_FIELDS = ('phone_number', 'password', 'email', 'first_name', 'last_name', 'username', 'bio')
+IMPORT_PHASES = ('read', 'validate', 'hash', 'insert_users', 'insert_profiles')
+
+NAME_MAX_LENGTH = 100
+
+
+def import_upload_storage():
+    """
+    Where the files uploaded to the import API wait for the worker, outside
+    MEDIA_ROOT and never served: they hold plaintext passwords
+    """
+    return FileSystemStorage(location=settings.USER_IMPORT_UPLOAD_DIR)
+
+
+class UserImportError(Exception):
+    """
+    the file itself can't be imported (unknown format, missing columns)
+    """
+
+
+class ImportReport:
+    """
+    counts, rejected rows and the seconds spent in every phase
+    """
+
+    def __init__(self, dry_run=False):
+        self.dry_run = dry_run
+        self.rows = 0
+        self.created = 0
+        self.rejected = 0
+        self.errors = []
+        self.timings = defaultdict(float)
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] += time.perf_counter() - started
+
+    def reject(self, line, errors):
+        self.rejected += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'rows': self.rows,
+            'created': self.created,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'timings': {name: round(self.timings[name], 4) for name in IMPORT_PHASES},
+        }
+
+
+def detect_format(name, fmt=None):
+    """
+    'csv' or 'jsonl', from an explicit format or the file extension
+    """
+    if fmt:
+        if fmt not in IMPORT_FORMATS.values():
+            raise UserImportError(f"unknown format {fmt!r}, use csv or jsonl")
+        return fmt
+    extension = os.path.splitext(name or '')[1].lower()
+    if extension not in IMPORT_FORMATS:
+        raise UserImportError("can't tell the format from the file name, use .csv or .jsonl")
+    return IMPORT_FORMATS[extension]
+
+
+def iter_rows(stream, fmt):
+    """
+    Yield (line number, row) from a text stream, row is None for a line that
+    isn't a JSON object
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        if 'phone_number' not in (reader.fieldnames or []):
+            raise UserImportError("the CSV header needs a phone_number column")
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield line_number, row if isinstance(row, dict) else None
+
+
+def _clean_row(row):
+    cleaned = {}
+    for field in IMPORT_FIELDS:
+        value = row.get(field)
+        value = '' if value is None else str(value)
+        cleaned[field] = value if field == 'password' else value.strip()
+    return cleaned
+
+
+def _check_row(row, taken_phones, taken_emails):
+    errors = {}
+    phone_number, email = row['phone_number'], row['email']
+    try:
+        validate_phone_number_format(phone_number)
+    except serializers.ValidationError as e:
+        errors['phone_number'] = [str(message) for message in e.detail]
+    else:
+        if phone_number in taken_phones:
+            errors['phone_number'] = ['شماره تلفن قبلاً ثبت شده است']
+
+    if email:
+        try:
+            validate_email(email)
+        except DjangoValidationError as e:
+            errors['email'] = list(e.messages)
+        else:
+            if email.lower() in taken_emails:
+                errors['email'] = ['ایمیل قبلاً ثبت شده است']
+
+    for field in ('first_name', 'last_name', 'username'):
+        if len(row[field]) > NAME_MAX_LENGTH:
+            errors[field] = [f'حداکثر {NAME_MAX_LENGTH} کاراکتر']
+
+    if row['password']:
+        try:
+            validate_password(row['password'], user=User(phone_number=phone_number, email=email or None))
+        except DjangoValidationError as e:
+            errors['password'] = list(e.messages)
+    return errors
+
+
+def validate_chunk(chunk, report, seen_phones=None, seen_emails=None):
+    """
+    Drop the invalid rows of a chunk into the report and return the others
+    as (line number, cleaned row).
+    The numbers and emails already in the database are read with one query
+    each, seen_* carry the ones accepted by earlier chunks that weren't
+    inserted (dry runs).
+    """
+    seen_phones = set() if seen_phones is None else seen_phones
+    seen_emails = set() if seen_emails is None else seen_emails
+    rows = [(line, _clean_row(row)) for line, row in chunk if row is not None]
+    for line, row in chunk:
+        if row is None:
+            report.reject(line, {'non_field_errors': ['not a JSON object']})
+
+    phones = {row['phone_number'] for _, row in rows}
+    emails = {row['email'].lower() for _, row in rows if row['email']}
+    taken_phones = seen_phones | set(User.objects.filter(phone_number__in=phones).values_list('phone_number', flat=True))
+    # compared case insensitively, Foo@x.com is the same address as foo@x.com
+    taken_emails = set(
+        User.objects.annotate(email_lower=Lower('email')).filter(email_lower__in=emails)
+        .values_list('email_lower', flat=True)
+    ) if emails else set()
+    taken_emails |= seen_emails
+
+    valid = []
+    for line, row in rows:
+        errors = _check_row(row, taken_phones, taken_emails)
+        if errors:
+            report.reject(line, errors)
+            continue
+        # a number or email repeated inside the file
+        taken_phones.add(row['phone_number'])
+        seen_phones.add(row['phone_number'])
+        if row['email']:
+            taken_emails.add(row['email'].lower())
+            seen_emails.add(row['email'].lower())
+        valid.append((line, row))
+    return valid
+
+
+def hash_passwords(passwords, executor=None):
+    """
+    make_password for every password, on the executor when there is one.
+    Rows without a password get an unusable one, that costs nothing.
+    """
+    hashed = [None] * len(passwords)
+    todo = [index for index, password in enumerate(passwords) if password]
+    for index, password in enumerate(passwords):
+        if not password:
+            hashed[index] = make_password(None)
+    if executor is None:
+        results = map(make_password, (passwords[index] for index in todo))
+    else:
+        workers = getattr(executor, '_max_workers', 1) or 1
+        results = executor.map(make_password, [passwords[index] for index in todo], chunksize=max(1, len(todo) // (workers * 4)))
+    for index, value in zip(todo, results):
+        hashed[index] = value
+    return hashed
+
+
+def insert_chunk(rows, hashed, report):
+    """
+    bulk_create the users of a chunk and their profiles, in one transaction
+    """
+    users = [
+        User(
+            phone_number=row['phone_number'],
+            password=password,
+            email=row['email'] or None,
+            first_name=row['first_name'],
+            last_name=row['last_name'],
+            username=row['username'] or None,
+        )
+        for row, password in zip(rows, hashed)
+    ]
+    with transaction.atomic():
+        with report.phase('insert_users'):
+            User.objects.bulk_create(users)
+            if users and users[0].pk is None:
+                # backends that can't return ids from a bulk insert
+                ids = dict(User.objects.filter(phone_number__in=[user.phone_number for user in users]).values_list('phone_number', 'pk'))
+                for user in users:
+                    user.pk = ids[user.phone_number]
+        with report.phase('insert_profiles'):
+            Profile.objects.bulk_create(Profile(user=user, bio=row['bio']) for user, row in zip(users, rows))
+    return len(users)
+
+
+def init_hasher_process():
+    """
+    ProcessPoolExecutor initializer, spawned workers need the Django settings
+    for the password hashers
+    """
+    import django
+
+    django.setup()
+
+
+def import_users(stream, fmt, executor=None, chunk_size=IMPORT_CHUNK_SIZE, dry_run=False, progress=None):
+    """
+    Import the users of a text stream, returns an ImportReport.
+    progress(report) is called after every chunk.
+    """
+    report = ImportReport(dry_run=dry_run)
+    seen_phones, seen_emails = (set(), set()) if dry_run else (None, None)
+    rows = iter_rows(stream, fmt)
+    while True:
+        with report.phase('read'):
+            chunk = []
+            for item in rows:
+                chunk.append(item)
+                if len(chunk) >= chunk_size:
+                    break
+        if not chunk:
+            break
+        report.rows += len(chunk)
+        _import_chunk(chunk, report, executor, dry_run, seen_phones, seen_emails)
+        if progress is not None:
+            progress(report)
+    return report
+
+
+def _import_chunk(chunk, report, executor, dry_run, seen_phones, seen_emails):
+    with report.phase('validate'):
+        valid = validate_chunk(chunk, report, seen_phones, seen_emails)
+    if dry_run:
+        # what would have been created
+        report.created += len(valid)
+        return
+    if not valid:
+        return
+    with report.phase('hash'):
+        hashed = hash_passwords([row['password'] for _, row in valid], executor)
+    try:
+        report.created += insert_chunk([row for _, row in valid], hashed, report)
+    except IntegrityError:
+        # someone registered one of these numbers or emails since the chunk
+        # was validated, check it again against the database and insert the rest
+        hashed = {row['phone_number']: password for (_, row), password in zip(valid, hashed)}
+        with report.phase('validate'):
+            again = validate_chunk(valid, report)
+        try:
+            report.created += insert_chunk(
+                [row for _, row in again], [hashed[row['phone_number']] for _, row in again], report
+            )
+        except IntegrityError:
+            # the race happened again, give up on these rows rather than retry forever
+            for line, _ in again:
+                report.reject(line, {'non_field_errors': ['conflicts with a user registered during the import']})
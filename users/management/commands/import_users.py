@@ -0,0 +1,67 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.importing import IMPORT_CHUNK_SIZE, IMPORT_PHASES, UserImportError, detect_format, import_users, init_hasher_process
+
+
+class Command(BaseCommand):
+    help = (
+        "Import users from a CSV or JSON lines file (columns: phone_number, password, "
+        "email, first_name, last_name, username, bio). The file is streamed in chunks, "
+        "passwords are hashed on a process pool."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="file to import, - reads stdin (needs --format)")
+        parser.add_argument('--format', choices=['csv', 'jsonl'])
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE)
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help="processes hashing passwords, 1 hashes in this process",
+        )
+        parser.add_argument('--dry-run', action='store_true', help="validate only, nothing is written")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        try:
+            fmt = detect_format(None if path == '-' else path, options['format'])
+        except UserImportError as e:
+            raise CommandError(e)
+
+        executor = None
+        if options['workers'] > 1 and not options['dry_run']:
+            executor = ProcessPoolExecutor(options['workers'], initializer=init_hasher_process)
+        try:
+            if path == '-':
+                report = self.run(sys.stdin, fmt, executor, options)
+            else:
+                with open(path, encoding='utf-8-sig', newline='') as stream:
+                    report = self.run(stream, fmt, executor, options)
+        except (UserImportError, OSError) as e:
+            raise CommandError(e)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        for error in report.errors:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        if report.rejected > len(report.errors):
+            self.stderr.write(f"... {report.rejected - len(report.errors)} more rejected row(s)")
+        self.stdout.write("  phase             seconds")
+        for name in IMPORT_PHASES:
+            self.stdout.write(f"  {name:<16} {report.timings[name]:>8.3f}")
+        verb = 'would be created' if report.dry_run else 'created'
+        self.stdout.write(self.style.SUCCESS(f"{report.rows} row(s): {report.created} user(s) {verb}, {report.rejected} rejected"))
+
+    def run(self, stream, fmt, executor, options):
+        def progress(report):
+            if options['verbosity'] > 1:
+                self.stdout.write(f"{report.rows} rows, {report.created} created, {report.rejected} rejected")
+
+        return import_users(
+            stream, fmt, executor=executor, chunk_size=options['chunk_size'],
+            dry_run=options['dry_run'], progress=progress,
+        )
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from users.models import Profile
+from users.tasks import process_avatar
+
+
+class Command(BaseCommand):
+    help = (
+        "Process the avatars still pending (uploaded before the avatar worker existed, "
+        "or whose job could not be enqueued)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true', help="process them here instead of enqueueing Celery jobs")
+
+    def handle(self, *args, **options):
+        pending = (
+            Profile.objects.filter(avatar_status=Profile.AVATAR_PENDING)
+            .exclude(avatar__isnull=True).exclude(avatar='')
+            .values_list('pk', 'avatar')
+        )
+        count = 0
+        for profile_id, name in pending.iterator():
+            if options['now']:
+                self.stdout.write(process_avatar(profile_id, name))
+            else:
+                process_avatar.delay(profile_id, name)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"{count} avatar(s) {'processed' if options['now'] else 'enqueued'}"))
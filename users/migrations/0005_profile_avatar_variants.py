@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:08
+
+from django.db import migrations, models
+
+
+def mark_existing_avatars(apps, schema_editor):
+    # uploaded before the avatar worker existed, `manage.py process_avatars` handles them
+    Profile = apps.get_model('users', 'Profile')
+    Profile.objects.exclude(avatar__isnull=True).exclude(avatar='').update(avatar_status='pending')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_error',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('ready', 'Ready'), ('failed', 'Failed')], max_length=10),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.RunPython(mark_existing_avatars, migrations.RunPython.noop),
+    ]
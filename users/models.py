@@ -1,8 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
+from .user_cache import invalidate_cached_user
+
 
 class UserManager(BaseUserManager):
     def create_user(self, phone_number, password=None, **extra_fields):
@@ -44,8 +46,21 @@ class User(AbstractUser):
         verbose_name_plural = 'کاربران'
         
 class Profile(models.Model):
+    AVATAR_PENDING = 'pending'
+    AVATAR_READY = 'ready'
+    AVATAR_FAILED = 'failed'
+    avatar_status_choices = [
+        (AVATAR_PENDING, 'Pending'),
+        (AVATAR_READY, 'Ready'),
+        (AVATAR_FAILED, 'Failed'),
+    ]
+
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     avatar = models.ImageField(upload_to='avatars/',null=True,blank=True)
+    # filled by the avatar worker: {"<size>": {"webp": path, "jpeg": path}}
+    avatar_variants = models.JSONField(default=dict, blank=True)
+    avatar_status = models.CharField(max_length=10, choices=avatar_status_choices, blank=True)
+    avatar_error = models.CharField(max_length=255, blank=True)
     bio = models.TextField(null=True,blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -60,4 +75,18 @@ def create_or_update_profile(sender, instance, created, **kwargs):
     else:
         if hasattr(instance, 'profile'):
             instance.profile.save()
-        
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    # saved, deactivated or deleted: the authentication cache must reload it
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def drop_cached_profile_user(sender, instance, **kwargs):
+    # the cached user carries their profile
+    invalidate_cached_user(instance.user_id)
+
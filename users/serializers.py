@@ -1,6 +1,13 @@
+import os
+
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
 from .models import User, Profile
 from django.contrib.auth.password_validation import validate_password
+from .avatars import AVATAR_ALLOWED_EXTENSIONS, AVATAR_MAX_UPLOAD_SIZE
+from .validators import validate_phone_number_format
+from .tasks import avatar_variant_paths, delete_avatar_files, schedule_avatar_processing
  
  
 
@@ -20,12 +27,7 @@ class UserRegisterSerializer(serializers.ModelSerializer):
         
         
     def validate_phone_number(self, value):
-        if not value.startswith('09'):
-            raise serializers.ValidationError('شماره تلفن باید با 09 شروع شود')
-        if len(value) != 11:
-            raise serializers.ValidationError('شماره تلفن باید 11 رقم باشد')
-        if not value.isdigit():
-            raise serializers.ValidationError('شماره تلفن باید عدد باشد')
+        validate_phone_number_format(value)
 
         if User.objects.filter(phone_number=value).exists():
             raise serializers.ValidationError('شماره تلفن قبلاً ثبت شده است')
@@ -51,11 +53,54 @@ class UserRegisterSerializer(serializers.ModelSerializer):
 class ProfileSerializer(serializers.ModelSerializer):   
     phone_number = serializers.CharField(source='user.phone_number', read_only=True) 
     
-    avatar = serializers.ImageField(required=False)
+    # a plain file here: decoding and validating the image is the avatar worker's job
+    avatar = serializers.FileField(required=False, allow_null=True)
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Profile
-        fields = ['phone_number', 'avatar', 'bio','created_at']
-        read_only_fields = ['created_at']
+        fields = ['phone_number', 'avatar', 'avatar_status', 'avatar_error', 'avatar_variants', 'bio','created_at']
+        read_only_fields = ['created_at', 'avatar_status', 'avatar_error']
+
+    def validate_avatar(self, value):
+        if value is None:
+            return value
+        if value.size > AVATAR_MAX_UPLOAD_SIZE:
+            raise serializers.ValidationError(f'حجم تصویر نباید بیشتر از {AVATAR_MAX_UPLOAD_SIZE // (1024 * 1024)} مگابایت باشد')
+        extension = os.path.splitext(value.name)[1].lower().lstrip('.')
+        if extension not in AVATAR_ALLOWED_EXTENSIONS:
+            raise serializers.ValidationError('فرمت تصویر پشتیبانی نمی‌شود')
+        return value
+
+    def get_avatar_variants(self, profile):
+        """
+        {"<size>": {"webp": url, "jpeg": url}} once the avatar is processed
+        """
+        request = self.context.get('request')
+        variants = {}
+        for size, formats in (profile.avatar_variants or {}).items():
+            variants[size] = {}
+            for fmt, path in formats.items():
+                url = default_storage.url(path)
+                variants[size][fmt] = request.build_absolute_uri(url) if request else url
+        return variants
+
+    def update(self, instance, validated_data):
+        if 'avatar' not in validated_data:
+            return super().update(instance, validated_data)
+
+        stale = [instance.avatar.name] if instance.avatar else []
+        if validated_data['avatar'] is None:
+            # avatar removed, its variants go too
+            stale += avatar_variant_paths(instance.avatar_variants)
+            validated_data.update(avatar_variants={}, avatar_status='', avatar_error='')
+        else:
+            # the old variants are served until the worker replaces them
+            validated_data.update(avatar_status=Profile.AVATAR_PENDING, avatar_error='')
+        profile = super().update(instance, validated_data)
 
-    
\ No newline at end of file
+        if stale:
+            transaction.on_commit(lambda: delete_avatar_files(stale))
+        if profile.avatar:
+            schedule_avatar_processing(profile)
+        return profile
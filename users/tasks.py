@@ -0,0 +1,138 @@
+import io
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from celery import shared_task
+from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+
+from config.task_metrics import record_task_output
+
+from .avatars import InvalidAvatar, open_avatar, render_avatar_variants
+from .importing import UserImportError, import_upload_storage, import_users
+from .models import Profile
+from .user_cache import invalidate_cached_user
+
+
+logger = logging.getLogger(__name__)
+
+
+def schedule_avatar_processing(profile):
+    """
+    hand the new upload to a worker once it is committed
+    """
+    name = profile.avatar.name
+
+    def enqueue():
+        try:
+            process_avatar.delay(profile.pk, name)
+        except Exception as e:
+            # stays pending, `manage.py process_avatars` picks it up
+            logger.warning("Could not enqueue avatar processing for profile %s: %s", profile.pk, e)
+
+    transaction.on_commit(enqueue)
+
+
+def delete_avatar_files(paths):
+    for path in paths:
+        try:
+            default_storage.delete(path)
+        except Exception as e:
+            logger.warning("Could not delete avatar file %s: %s", path, e)
+
+
+def avatar_variant_paths(variants):
+    return [path for formats in variants.values() for path in formats.values()]
+
+
+@shared_task
+def process_avatar(profile_id, name):
+    """
+    Validate an uploaded avatar, replace it with a clean copy (no metadata,
+    at most AVATAR_ORIGINAL_MAX_SIZE) and write the square WebP/JPEG variants.
+    Does nothing if the profile got another avatar in the meantime.
+    """
+    profile = Profile.objects.filter(pk=profile_id, avatar=name).first()
+    if profile is None:
+        return "Skipped, the avatar changed"
+
+    try:
+        with default_storage.open(name, 'rb') as upload:
+            original, variants = render_avatar_variants(open_avatar(upload))
+    except (InvalidAvatar, FileNotFoundError) as e:
+        updated = Profile.objects.filter(pk=profile_id, avatar=name).update(
+            avatar=None, avatar_variants={}, avatar_status=Profile.AVATAR_FAILED, avatar_error=str(e)[:255],
+        )
+        if updated:
+            # never serve a file that didn't pass validation
+            delete_avatar_files([name])
+            invalidate_cached_user(profile.user_id)
+        return f"Rejected avatar of profile {profile_id}: {e}"
+
+    # a new directory per run so clients never see a cached older image
+    directory = f'avatars/{profile_id}/{uuid.uuid4().hex[:12]}'
+    stem = os.path.splitext(os.path.basename(name))[0]
+    written = {'original': default_storage.save(f'{directory}/{stem}.jpg', ContentFile(original))}
+    stored = {}
+    for size, formats in variants.items():
+        stored[str(size)] = {
+            fmt: default_storage.save(f'{directory}/{size}.{"jpg" if fmt == "jpeg" else fmt}', ContentFile(data))
+            for fmt, data in formats.items()
+        }
+
+    # only if the avatar is still the one we processed
+    updated = Profile.objects.filter(pk=profile_id, avatar=name).update(
+        avatar=written['original'], avatar_variants=stored, avatar_status=Profile.AVATAR_READY, avatar_error='',
+    )
+    if not updated:
+        delete_avatar_files([written['original'], *avatar_variant_paths(stored)])
+        return "Skipped, the avatar changed"
+
+    # update() sends no signals, and the cached user carries the profile
+    invalidate_cached_user(profile.user_id)
+    delete_avatar_files([name, *avatar_variant_paths(profile.avatar_variants)])
+    return f"Done! processed the avatar of profile {profile_id} ({len(stored)} sizes)"
+
+
+@shared_task
+def import_users_file(path, fmt, dry_run=False):
+    """
+    Import an uploaded user file, returns the import report.
+    Celery's pool children can't start processes of their own, the
+    passwords are hashed on threads instead (hashlib's PBKDF2 releases the GIL).
+    """
+    storage = import_upload_storage()
+    try:
+        with storage.open(path, 'rb') as upload:
+            stream = io.TextIOWrapper(upload, encoding='utf-8-sig', newline='')
+            with ThreadPoolExecutor(settings.USER_IMPORT_HASH_THREADS) as executor:
+                report = import_users(stream, fmt, executor=executor, dry_run=dry_run)
+    except UserImportError as e:
+        return {'error': str(e)}
+    finally:
+        storage.delete(path)
+    record_task_output(rows=report.rows)
+    logger.info("Imported users from %s: %s created, %s rejected", path, report.created, report.rejected)
+    return report.as_dict()
+
+
+@shared_task
+def purge_stale_import_uploads():
+    """
+    delete the import uploads older than USER_IMPORT_UPLOAD_MAX_AGE, their
+    job was lost before it could run
+    """
+    storage = import_upload_storage()
+    if not storage.exists(''):
+        return "Done! deleted 0 stale import uploads"
+    cutoff = timezone.now() - timedelta(seconds=settings.USER_IMPORT_UPLOAD_MAX_AGE)
+    stale = [name for name in storage.listdir('')[1] if storage.get_modified_time(name) < cutoff]
+    for name in stale:
+        storage.delete(name)
+    return f"Done! deleted {len(stale)} stale import uploads"
@@ -1,3 +1,301 @@
-from django.test import TestCase
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from PIL import Image
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from config.cache import cache_is_shared
+from config.celery import app as celery_app
+from .importing import import_upload_storage, import_users
+from .models import Profile, User
+from .user_cache import get_cached_user
+from .tasks import purge_stale_import_uploads
 
 # Create your tests here.
+
+
+class CachedJWTAuthenticationTest(APITestCase):
+
+    def setUp(self):
+        # ids come back between tests, don't pick up a user cached by an earlier one
+        cache.clear()
+        # the test cache is local memory, shared by the single test process
+        patcher = mock.patch('users.authentication.cache_is_shared', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(phone_number='09123030303', password='pass-12345')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_user_comes_from_cache(self):
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, status.HTTP_200_OK)
+        # no user or profile SELECT once cached
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/profile/')
+        self.assertEqual(response.data['phone_number'], '09123030303')
+
+    def test_local_cache_is_not_used(self):
+        with mock.patch('users.authentication.cache_is_shared', return_value=False):
+            self.client.get('/api/users/profile/')
+            # the user is read again, another worker could have deactivated them
+            with self.assertNumQueries(2):
+                self.client.get('/api/users/profile/')
+            self.user.is_active = False
+            self.user.save()
+            self.assertEqual(self.client.get('/api/users/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_rejected(self):
+        self.client.get('/api/users/profile/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_profile_update_is_seen(self):
+        self.client.get('/api/users/profile/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/users/profile/', {'bio': 'hello'}, format='multipart')
+        self.assertEqual(self.client.get('/api/users/profile/').data['bio'], 'hello')
+
+    def test_deleted_user(self):
+        self.client.get('/api/users/profile/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.delete()
+        self.assertEqual(self.client.get('/api/users/profile/').status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_hash_is_not_cached(self):
+        # the real cache_is_shared this time, a file cache is shared between processes
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location,
+        }}), mock.patch('users.authentication.cache_is_shared', wraps=cache_is_shared):
+            self.assertEqual(self.client.get('/api/users/profile/').status_code, status.HTTP_200_OK)
+            entry = cache.get(f'auth-user:{self.user.pk}')
+            self.assertNotIn(self.user.password.encode(), pickle.dumps(entry))
+            self.assertNotIn(self.user.password.split('$')[-1].encode(), pickle.dumps(entry))
+
+            user = get_cached_user(self.user.pk)
+            self.assertEqual((user.pk, user.phone_number, user.profile.pk), (self.user.pk, '09123030303', self.user.profile.pk))
+            self.assertIn('password', user.get_deferred_fields())
+            #the cached user and profile are served without a query
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get('/api/users/profile/').status_code, status.HTTP_200_OK)
+
+
+class AvatarProcessingTest(APITestCase):
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        media_root = self.settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.user = User.objects.create_user(phone_number='09123131313', password='pass-12345')
+        self.client.force_authenticate(user=self.user)
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+
+    def image_file(self, name='photo.jpg', size=(900, 600), fmt='JPEG', mode='RGB'):
+        image = Image.new(mode, size, 'red')
+        exif = Image.Exif()
+        exif[0x010F] = 'PhoneMaker'  # camera make
+        buffer = io.BytesIO()
+        image.save(buffer, fmt, exif=exif) if fmt == 'JPEG' else image.save(buffer, fmt)
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+    def upload(self, upload):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/users/profile/', {'avatar': upload}, format='multipart')
+        return response
+
+    def test_upload_is_processed_in_the_background(self):
+        response = self.upload(self.image_file())
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['avatar_status'], 'pending')
+
+        # a fresh user, the forced one keeps its loaded profile
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+        data = self.client.get('/api/users/profile/').data
+        self.assertEqual(data['avatar_status'], 'ready')
+        self.assertEqual(sorted(data['avatar_variants'], key=int), ['64', '128', '256'])
+        self.assertTrue(data['avatar_variants']['64']['webp'].endswith('.webp'))
+
+        profile = Profile.objects.get(user=self.user)
+        for size, formats in profile.avatar_variants.items():
+            for path in formats.values():
+                with default_storage.open(path) as stored, Image.open(stored) as image:
+                    self.assertEqual(image.size, (int(size), int(size)))
+        with profile.avatar.open() as stored, Image.open(stored) as image:
+            # the clean copy replaced the upload, without the camera metadata
+            self.assertEqual(image.size, (900, 600))
+            self.assertNotIn(0x010F, image.getexif())
+
+    def test_transparent_png(self):
+        self.upload(self.image_file('logo.png', fmt='PNG', mode='RGBA'))
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(profile.avatar_status, 'ready')
+        with default_storage.open(profile.avatar_variants['128']['jpeg']) as stored, Image.open(stored) as image:
+            self.assertEqual(image.mode, 'RGB')
+
+    def test_invalid_image_is_rejected_by_the_worker(self):
+        self.upload(SimpleUploadedFile('fake.jpg', b'not an image', content_type='image/jpeg'))
+        profile = Profile.objects.get(user=self.user)
+        self.assertEqual(profile.avatar_status, 'failed')
+        self.assertFalse(profile.avatar)
+        self.assertIn('Not a valid image', profile.avatar_error)
+
+    def test_upload_validation(self):
+        response = self.upload(SimpleUploadedFile('notes.txt', b'hello'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_process_pending_command(self):
+        profile = Profile.objects.get(user=self.user)
+        profile.avatar.save('legacy.jpg', self.image_file(), save=False)
+        Profile.objects.filter(pk=profile.pk).update(avatar=profile.avatar.name, avatar_status='pending')
+        out = io.StringIO()
+        call_command('process_avatars', '--now', stdout=out)
+        self.assertIn('1 avatar(s) processed', out.getvalue())
+        self.assertEqual(Profile.objects.get(pk=profile.pk).avatar_status, 'ready')
+
+
+class UserImportTest(APITestCase):
+
+    def setUp(self):
+        User.objects.create_user(phone_number='09120000000', email='taken@example.com')
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.uploads = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.uploads, ignore_errors=True)
+        # MEDIA_ROOT too, to see that nothing lands there
+        uploads = self.settings(USER_IMPORT_UPLOAD_DIR=self.uploads, MEDIA_ROOT=os.path.join(self.tmp, 'media'))
+        uploads.enable()
+        self.addCleanup(uploads.disable)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmp, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def test_csv_import(self):
+        path = self.write('users.csv', (
+            'phone_number,password,email,first_name,last_name,bio\n'
+            '09121111111,import-pass-123,ali@example.com,Ali,Rezaei,hello\n'
+            '09122222222,,,Sara,,\n'
+            '9123333333,,,,,\n'         # doesn't start with 09
+            '09121111111,,,,,\n'        # twice in the file
+            '09120000000,,,,,\n'        # already registered
+            '09124444444,,taken@example.com,,,\n'
+            '09125555555,123,,,,\n'     # password validators
+        ))
+        out, err = io.StringIO(), io.StringIO()
+        call_command('import_users', path, '--workers', '1', stdout=out, stderr=err)
+        self.assertIn('7 row(s): 2 user(s) created, 5 rejected', out.getvalue())
+        for phase in ('read', 'validate', 'hash', 'insert_users', 'insert_profiles'):
+            self.assertIn(phase, out.getvalue())
+        self.assertIn('line 4:', err.getvalue())
+        self.assertIn('شماره تلفن باید با 09 شروع شود', err.getvalue())
+
+        ali = User.objects.get(phone_number='09121111111')
+        self.assertTrue(ali.check_password('import-pass-123'))
+        self.assertEqual((ali.email, ali.first_name, ali.profile.bio), ('ali@example.com', 'Ali', 'hello'))
+        sara = User.objects.get(phone_number='09122222222')
+        self.assertFalse(sara.has_usable_password())
+        self.assertIsNone(sara.email)
+        # bulk_create doesn't send post_save, the import makes the profiles itself
+        self.assertTrue(Profile.objects.filter(user=sara).exists())
+
+    def test_jsonl_import_with_process_pool(self):
+        path = self.write('users.jsonl', (
+            '{"phone_number": "09126666666", "password": "import-pass-123"}\n'
+            'not json\n'
+            '\n'
+            '{"phone_number": "09127777777", "bio": "from jsonl"}\n'
+        ))
+        out = io.StringIO()
+        call_command('import_users', path, '--chunk-size', '1', '--workers', '2', stdout=out, stderr=io.StringIO())
+        self.assertIn('2 user(s) created, 1 rejected', out.getvalue())
+        self.assertTrue(User.objects.get(phone_number='09126666666').check_password('import-pass-123'))
+        self.assertEqual(Profile.objects.get(user__phone_number='09127777777').bio, 'from jsonl')
+
+    def test_dry_run_writes_nothing(self):
+        path = self.write('users.csv', 'phone_number\n09128888888\n09128888888\n')
+        out = io.StringIO()
+        call_command('import_users', path, '--dry-run', stdout=out, stderr=io.StringIO())
+        self.assertIn('1 user(s) would be created, 1 rejected', out.getvalue())
+        self.assertFalse(User.objects.filter(phone_number='09128888888').exists())
+
+    def test_rows_rejected_when_the_insert_races_twice(self):
+        stream = io.StringIO('phone_number\n09121212121\n09121212122\n')
+        #another registration wins the race on the insert and on its retry
+        with mock.patch('users.importing.insert_chunk', side_effect=[IntegrityError, IntegrityError]) as insert:
+            report = import_users(stream, 'csv')
+        self.assertEqual(insert.call_count, 2)
+        self.assertEqual((report.created, report.rejected), (0, 2))
+        self.assertEqual([error['line'] for error in report.errors], [2, 3])
+
+    def test_email_taken_in_another_case(self):
+        stream = io.StringIO('phone_number,email\n09121313131,Taken@Example.com\n')
+        report = import_users(stream, 'csv')
+        self.assertEqual((report.created, report.rejected), (0, 1))
+        self.assertIn('email', report.errors[0]['errors'])
+
+    def test_upload_not_enqueued_is_deleted(self):
+        self.client.force_authenticate(user=User.objects.create_superuser(phone_number='09129999990', password='admin-pass-123'))
+        upload = SimpleUploadedFile('users.csv', b'phone_number\n09129999999\n')
+        with mock.patch('users.views.import_users_file.delay', side_effect=ConnectionError('broker down')):
+            with self.assertRaises(ConnectionError):
+                self.client.post('/api/users/import/', {'file': upload}, format='multipart')
+        self.assertEqual(os.listdir(self.uploads), [])
+
+    def test_stale_uploads_are_purged(self):
+        storage = import_upload_storage()
+        old = storage.save('old.csv', io.BytesIO(b'phone_number\n'))
+        storage.save('new.csv', io.BytesIO(b'phone_number\n'))
+        day_ago = time.time() - 2 * 24 * 3600
+        os.utime(storage.path(old), (day_ago, day_ago))
+        self.assertEqual(purge_stale_import_uploads(), 'Done! deleted 1 stale import uploads')
+        self.assertEqual(os.listdir(self.uploads), ['new.csv'])
+
+    def test_api_is_admin_only(self):
+        self.client.force_authenticate(user=User.objects.create_user(phone_number='09129999990'))
+        upload = SimpleUploadedFile('users.csv', b'phone_number\n09129999999\n')
+        response = self.client.post('/api/users/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_api_import(self):
+        celery_app.conf.task_always_eager = True
+        self.addCleanup(setattr, celery_app.conf, 'task_always_eager', False)
+        admin = User.objects.create_superuser(phone_number='09129999990', password='admin-pass-123')
+        self.client.force_authenticate(user=admin)
+
+        response = self.client.post('/api/users/import/', {'file': SimpleUploadedFile('users.txt', b'')}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        upload = SimpleUploadedFile('users.csv', b'phone_number,bio\n09129999999,via api\n')
+        response = self.client.post('/api/users/import/', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(Profile.objects.get(user__phone_number='09129999999').bio, 'via api')
+        # the upload waited outside MEDIA_ROOT and is removed once imported
+        self.assertFalse(default_storage.exists('imports'))
+        self.assertEqual(os.listdir(self.uploads), [])
+
+        job = mock.Mock(state='SUCCESS', result={'created': 1})
+        job.successful.return_value = True
+        with mock.patch('users.views.import_users_file.AsyncResult', return_value=job):
+            response = self.client.get(f"/api/users/import/{response.data['job_id']}/")
+        self.assertEqual(response.data['report'], {'created': 1})
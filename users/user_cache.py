@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import FileField
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+
+# never written to the cache, the user comes back with it deferred
+UNCACHED_USER_FIELDS = ('password',)
+
+
+def _user_key(user_id):
+    return f'auth-user:{user_id}'
+
+
+def _generation_key(user_id):
+    return f'auth-user-gen:{user_id}'
+
+
+def _field_values(instance, exclude=()):
+    """
+    (attnames, values) of the concrete fields, files as their stored name
+    """
+    names, values = [], []
+    for field in instance._meta.concrete_fields:
+        if field.name in exclude:
+            continue
+        value = getattr(instance, field.attname)
+        if isinstance(field, FileField):
+            value = value.name
+        names.append(field.attname)
+        values.append(value)
+    return tuple(names), values
+
+
+def _from_values(model, names, values):
+    # the fields of a model from an older deploy may not match anymore
+    if set(names) - {field.attname for field in model._meta.concrete_fields}:
+        return None
+    return model.from_db(None, names, values)
+
+
+def get_cached_user(user_id):
+    """
+    The cached user with their profile, or None when missing or from an
+    older generation. One cache round trip: the entry and the current
+    generation are read together.
+
+    The user has no password loaded, the md5 of its hash (for the simplejwt
+    revoke check) is on user.cached_password_hash.
+    """
+    values = cache.get_many([_user_key(user_id), _generation_key(user_id)])
+    entry = values.get(_user_key(user_id))
+    if entry is None:
+        return None
+    generation, fields, profile_fields, password_hash = entry
+    if generation != values.get(_generation_key(user_id), 0):
+        return None
+    user = _from_values(get_user_model(), *fields)
+    if user is None:
+        return None
+    if profile_fields is not None:
+        profile = _from_values(user._meta.get_field('profile').related_model, *profile_fields)
+        if profile is None:
+            return None
+        user.profile = profile
+    user.cached_password_hash = password_hash
+    return user
+
+
+def current_generation(user_id):
+    return cache.get(_generation_key(user_id), 0)
+
+
+def cache_user(user, generation):
+    """
+    Cache the field values of the user and their loaded profile, never the
+    password hash.
+
+    generation must be read before the user was loaded: if the user changed
+    meanwhile the entry is already stale and will never be served
+    """
+    profile = user._meta.get_field('profile').get_cached_value(user, default=None)
+    entry = (
+        generation,
+        _field_values(user, exclude=UNCACHED_USER_FIELDS),
+        _field_values(profile) if profile is not None else None,
+        get_md5_hash_password(user.password),
+    )
+    cache.set(_user_key(user.pk), entry, timeout=settings.AUTH_USER_CACHE_TIMEOUT)
+
+
+def invalidate_cached_user(user_id):
+    """
+    Move the user to a new generation once the change is committed, bumping
+    before commit would let a concurrent request cache the old row again
+    """
+    def bump():
+        key = _generation_key(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            if not cache.add(key, 1, timeout=None):
+                cache.incr(key)
+        cache.delete(_user_key(user_id))
+
+    transaction.on_commit(bump)
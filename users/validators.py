@@ -0,0 +1,14 @@
+from rest_framework import serializers
+
+
+def validate_phone_number_format(value):
+    """
+    shape of a phone number, shared by registration and the user import
+    """
+    if not value.startswith('09'):
+        raise serializers.ValidationError('شماره تلفن باید با 09 شروع شود')
+    if len(value) != 11:
+        raise serializers.ValidationError('شماره تلفن باید 11 رقم باشد')
+    if not value.isdigit():
+        raise serializers.ValidationError('شماره تلفن باید عدد باشد')
+    return value
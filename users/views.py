@@ -1,12 +1,19 @@
+import uuid
+
 from django.shortcuts import render
-from rest_framework import generics
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from django.urls import reverse
+from rest_framework import generics, status
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from .serializers import UserRegisterSerializer
 from .models import User
 from .serializers import ProfileSerializer
 from rest_framework.parsers import MultiPartParser, FormParser 
 from drf_spectacular.utils import extend_schema, OpenApiParameter
 from drf_spectacular.types import OpenApiTypes
+from .importing import UserImportError, detect_format, import_upload_storage
+from .tasks import import_users_file
 
 
 class RegisterView(generics.CreateAPIView):
@@ -43,6 +50,65 @@ class ProfileView(generics.RetrieveUpdateAPIView):
         return self.request.user.profile
     
 
+@extend_schema(
+    request={
+        'multipart/form-data': {
+            'type': 'object',
+            'properties': {
+                'file': {'type': 'string', 'format': 'binary', 'description': 'CSV or JSON lines of users'},
+                'format': {'type': 'string', 'enum': ['csv', 'jsonl']},
+                'dry_run': {'type': 'boolean'},
+            },
+        }
+    }
+)
+class UserImportView(APIView):
+    """
+    Start a user import job, the same import as `manage.py import_users`
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser, FormParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['فایل الزامی است']}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fmt = detect_format(upload.name, request.data.get('format'))
+        except UserImportError as e:
+            return Response({'file': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        dry_run = str(request.data.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+
+        storage = import_upload_storage()
+        path = storage.save(f'{uuid.uuid4().hex}.{fmt}', upload)
+        try:
+            job = import_users_file.delay(path, fmt, dry_run=dry_run)
+        except Exception:
+            # no job will ever read it
+            storage.delete(path)
+            raise
+        return Response(
+            {'job_id': job.id, 'status_url': request.build_absolute_uri(reverse('user-import-status', args=[job.id]))},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
+
+class UserImportStatusView(APIView):
+    """
+    State of an import job, with its report once it finished
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, job_id):
+        job = import_users_file.AsyncResult(job_id)
+        data = {'job_id': job_id, 'state': job.state}
+        if job.successful():
+            data['report'] = job.result
+        elif job.failed():
+            data['error'] = str(job.result)
+        return Response(data)
+
+
 def login_page_view(request):
     return render(request, 'login.html')
     